@@ -0,0 +1,44 @@
+/**
+ * Long-lived GATK process used by utils/gatk_worker.py to avoid paying JVM startup and JIT warmup for every
+ * HaplotypeCaller run.
+ *
+ * Reads one GATK command per line from stdin (the args that would follow "java -jar GenomeAnalysisTK.jar",
+ * separated by tabs), runs it in this JVM, and then prints "GATK_WORKER_DONE <exit code>" on its own line.
+ *
+ * To compile:
+ *    javac -cp bin/GATK_readVizFix_071116.jar -d bin/gatk_worker java/GatkWorker.java
+ */
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+
+import org.broadinstitute.gatk.engine.CommandLineGATK;
+import org.broadinstitute.gatk.utils.commandline.CommandLineProgram;
+
+public class GatkWorker {
+    public static final String DONE_MARKER = "GATK_WORKER_DONE";
+
+    public static void main(String[] args) throws Exception {
+        BufferedReader stdin = new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while ((line = stdin.readLine()) != null) {
+            if (line.trim().isEmpty()) {
+                continue;
+            }
+
+            int exitCode;
+            try {
+                // same as CommandLineGATK.main(..), but without System.exit(..)
+                CommandLineProgram.start(new CommandLineGATK(), line.split("\t"));
+                exitCode = CommandLineProgram.result;
+            } catch (Throwable t) {
+                t.printStackTrace(System.out);
+                exitCode = 1;
+            }
+
+            System.err.flush();
+            System.out.println(DONE_MARKER + " " + exitCode);
+            System.out.flush();
+        }
+    }
+}
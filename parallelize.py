@@ -5,7 +5,9 @@ This script takes the name of another python script (let's say some_script.py)
 and launches N parallel instances of some_script.py on the short queue as an
 array job. Each instance of some_script.py will get passed
  --chrom, --start-pos, and --end-pos args which will define the genomic
-region it should operate on. This region should be small enough for
+region it should operate on, and --exit-after N (where N is the number of
+minutes left before the queue time limit) when it's running in a queue with a
+time limit. This region should be small enough for
 some_script.py to finish in < 4 hours (the short queue's runtime limit) in the
 worst case. It's up to some_script.py to avoid redoing the same work if
 it is run multiple times on the same genomic interval (eg. if the 1st run fails).
@@ -16,6 +18,36 @@ other than 0 if it fails.
 Example:
 
 python parallelize.py -L /seq/references/Homo_sapiens_assembly19/v1/variant_calling/exome_calling_regions.v1.interval_list -n 1000 python3.4 generate_HC_bams.py
+
+With --in-process, the command is instead the name of an importable python
+function (eg. pipeline.compute_HC_bams_from_sample_table.process_interval)
+which is called directly in each array job task as
+f(chrom, start_pos, end_pos, exit_after_minutes=N, **kwargs), where N is the
+time left before the queue time limit. This avoids paying interpreter startup
+and module initialization costs for every interval, and lets state like GATK
+workers and caches be reused across intervals. The function should return True
+if it processed the whole interval, or False if it stopped early (the interval
+is then released for another task). Raising an exception marks the interval as
+failed.
+
+Options after the function name are converted to **kwargs by a
+parse_<function>_args(argv) function in the same module, which returns a dict.
+If the module has a cleanup_<function>() function, it's called after the last
+interval (eg. to stop worker processes and delete local caches).
+
+Example:
+
+python parallelize.py --in-process -L /seq/references/Homo_sapiens_assembly19/v1/variant_calling/exome_calling_regions.v1.interval_list -n 1000 pipeline.compute_HC_bams_from_sample_table.process_interval --gatk-workers --num-workers 4
+
+With --supervise, parallelize.py keeps running after submitting the array job
+and resubmits tasks as they exit so that -n tasks are running until all
+intervals are done.
+
+With -c N (--max-concurrent-intervals), each task runs up to N interval
+commands at a time, starting another one only while the machine has a free
+cpu and enough free memory for another GATK heap. With --run-local and
+-w M (--num-local-workers), N is the limit for the whole machine, so each of
+the M workers runs up to N/M commands at a time.
 """
 
 
@@ -24,40 +56,162 @@ import datetime
 import os
 import peewee
 import getpass
+import importlib
+import multiprocessing
 import random
 import signal
 import slugify
 import subprocess
-from utils.constants import DB_HOST, DB_PORT, DB_USER, BAM_OUTPUT_DIR, EXIT_UGER_JOB_AFTER_N_HOURS
+import sys
+import time
+import traceback
+from utils.constants import DB_HOST, DB_PORT, DB_USER, BAM_OUTPUT_DIR, EXIT_UGER_JOB_AFTER_N_HOURS, \
+    RUNTIME_PREDICTION_PERCENTILE
+from utils.constants import CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES, MEMORY_PER_INTERVAL_COMMAND_GB
+from utils.cluster_executors import SGEExecutor, LSFExecutor, LocalExecutor, run_supervisor, get_queue_time_limit_hours, \
+    get_array_job_task_id
+from utils.command_output import run_command_and_stream_output, read_output_tail
+from utils.database import add_missing_columns, add_missing_indexes
+from utils.interval_splitting import split_intervals_by_size, split_intervals_by_workload
+from utils.leases import compute_lease_expiration, is_claimable, keep_lease_alive, release_lease, get_fields_to_save, \
+    LeaseHeartbeat, mark_unclaimed_records, unclaim_records, UNCLAIMED_LEASE_EXPIRATION
+from utils.load_aware_concurrency import get_machine_load, compute_target_concurrency
+from utils.priorities import read_top_intervals, compute_priority, assign_interval_priorities, \
+    pick_highest_priority_record, get_priority_ordering
+from utils.runtime_prediction import predict_runtime, will_next_unit_fit, get_runtimes_in_seconds
 
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
 #logging.getLogger('peewee').setLevel(logging.DEBUG)
 
 CTRL_C_SIGNAL = False
+PREVIOUS_SIGNAL_HANDLER = None  # set when an --in-process entry point module installs its own SIGINT handler
 def signal_handler(signal, frame):
     global CTRL_C_SIGNAL
     CTRL_C_SIGNAL = True
     logging.info("Ctrl-C pressed")
+    if PREVIOUS_SIGNAL_HANDLER is not None:
+        PREVIOUS_SIGNAL_HANDLER(signal, frame)  # let the entry point also finish its current unit of work and return
 
 signal.signal(signal.SIGINT, signal_handler)
 
+
+def load_entry_point(entry_point_name):
+    """Imports and returns the function specified by a name like 'pipeline.some_module.some_function' or
+    'pipeline.some_module:some_function'.
+    """
+    global PREVIOUS_SIGNAL_HANDLER
+
+    module_name, _, function_name = entry_point_name.replace(":", ".").rpartition(".")
+    if not module_name:
+        raise ValueError("Invalid entry point: '%s'. Expected a name like module.function" % entry_point_name)
+
+    module = importlib.import_module(module_name)
+    entry_point = getattr(module, function_name)
+
+    # importing the module may have replaced our Ctrl-C handler, so chain them
+    current_handler = signal.getsignal(signal.SIGINT)
+    if current_handler is not signal_handler:
+        if callable(current_handler):
+            PREVIOUS_SIGNAL_HANDLER = current_handler
+        signal.signal(signal.SIGINT, signal_handler)
+
+    return entry_point
+
+
+def get_entry_point_hook(entry_point, hook_name_format):
+    """Returns the function in the entry point's module whose name is hook_name_format % the entry point's name (eg.
+    "parse_%s_args"), or None if there isn't one."""
+    module = sys.modules[entry_point.__module__]
+    return getattr(module, hook_name_format % entry_point.__name__, None)
+
+
+def parse_entry_point_args(entry_point, entry_point_args):
+    """Converts the options that follow the --in-process function name into keyword args for the function, using
+    the parse_<function>_args(argv) function in its module.
+
+    Return:
+        dict of keyword args
+    """
+    if not entry_point_args:
+        return {}
+    parse_args = get_entry_point_hook(entry_point, "parse_%s_args")
+    if parse_args is None:
+        raise ValueError("%s.parse_%s_args(..) not found, so options can't be passed to %s: %s" % (
+            entry_point.__module__, entry_point.__name__, entry_point.__name__, " ".join(entry_point_args)))
+    return parse_args(entry_point_args)
+
+def get_unfinished_samples_by_position(chrom=None):
+    """Counts the unfinished records in the Sample table at each position.
+
+    Args:
+        chrom: (optional) if specified, only count samples on this chromosome
+    Return:
+        dict that maps each chrom to a 2-tuple of lists (positions, counts), sorted by position
+    """
+    from utils.database import Sample
+
+    query = Sample.select(Sample.chrom, Sample.pos, peewee.fn.COUNT(Sample.id)).where(Sample.finished == 0)
+    if chrom:
+        query = query.where(Sample.chrom == chrom)
+    query = query.group_by(Sample.chrom, Sample.pos).order_by(Sample.chrom, Sample.pos)
+
+    unfinished_samples_by_position = {}
+    for sample_chrom, pos, count in query.tuples().execute():
+        positions, counts = unfinished_samples_by_position.setdefault(sample_chrom, ([], []))
+        positions.append(pos)
+        counts.append(count)
+
+    return unfinished_samples_by_position
+
+
 p = argparse.ArgumentParser()
 p.add_argument("-L", "--interval-list", help="An interval file")
 p.add_argument("-n", "--num-jobs", help="Number of array job tasks to launch")
 p.add_argument("-isize", "--interval-size", help="Max interval size", type=int, default=200)
+p.add_argument("-wsize", "--workload-per-interval", help="If specified, adjacent intervals are merged (up to "
+    "--interval-size) or split so that each contains roughly this many unfinished records in the Sample table", type=int)
 p.add_argument("--log-dir", help="Logging directory", default=os.path.join(BAM_OUTPUT_DIR, "logs"))
 p.add_argument("-bsub", "--run-on-LSF", help="Submit to LSF", action="store_true")
 p.add_argument("-local", "--run-local", help="Run locally instead of submitting array jobs", action="store_true")
+p.add_argument("-w", "--num-local-workers", help="With --run-local, the number of worker processes to run in "
+    "parallel on this machine. Each worker claims its own intervals and logs to its own file in --log-dir", type=int, default=1)
+p.add_argument("--supervise", help="After submitting the array job, keep running and resubmit array job tasks as "
+    "they exit so that --num-jobs tasks are running until all intervals are done", action="store_true")
+p.add_argument("--supervisor-poll-interval", help="With --supervise, how often (in minutes) to check progress",
+    type=float, default=5)
+p.add_argument("--local-executor", help="Launch array job tasks as local subprocesses instead of submitting them to "
+    "the cluster. Useful for testing --supervise", action="store_true")
+p.add_argument("--assign-priorities", help="Recompute the priority of each unfinished interval in a previously-loaded "
+    "intervals table (intervals that overlap scripts/data/top_intervals.txt are processed first)", action="store_true")
+p.add_argument("-c", "--max-concurrent-intervals", help="Run up to this many interval commands at a time in each "
+    "task, depending on the machine's load average and free memory. With --num-local-workers, this is divided "
+    "between the workers", type=int, default=1)
 p.add_argument("--regenerate-intervals-table", help="Regenerate intervals table from scratch", action="store_true")
 p.add_argument("--chrom", help="If specified, will only process intervals from this chromosome (eg. 'X').")
+p.add_argument("--in-process", help="Treat the command as the name of a python function (eg. "
+    "pipeline.compute_HC_bams_from_sample_table.process_interval) and call it directly for each interval instead of "
+    "launching a new subprocess per interval", action="store_true")
 p.add_argument("command", nargs="+", help="The command to parallelize. The command must work with --chrom, --start-pos, --end-pos")
 
 args, unknown_args = p.parse_known_args()
-db_table_name = "%s_i%d" % ("_".join([a[0:8] for a in args.command + unknown_args if not a.startswith("-")][0:2]), args.interval_size)
+if args.in_process and len(args.command) > 1:
+    p.error("--in-process requires the command to be a single python function name, optionally followed by "
+            "--options for it. Got: %s" % " ".join(args.command + unknown_args))
+
+# with --in-process, the options after the function name are passed to it (see parse_entry_point_args(..)), so they
+# don't change the table name
+table_name_args = args.command if args.in_process else args.command + unknown_args
+db_table_name = "%s_i%d" % ("_".join([a[0:8] for a in table_name_args if not a.startswith("-")][0:2]), args.interval_size)
+if args.workload_per_interval:
+    db_table_name += "_w%d" % args.workload_per_interval
 db_table_name = slugify.slugify(db_table_name).replace("-", "_")  # remove special chars
 
+entry_point_name = args.command[0]
+entry_point_args = unknown_args
 args.command = " ".join(args.command + unknown_args)
+if args.in_process and args.max_concurrent_intervals > 1:
+    p.error("--max-concurrent-intervals can't be used with --in-process")
 
 logging.info("args: command: " + args.command)
 logging.info("db_table_name: " + db_table_name)
@@ -95,6 +249,9 @@ class ParallelIntervals(peewee.Model):
 
     comments = peewee.CharField(null=True, max_length=100)  # used for debugging
 
+    # renewed by the task processing this interval. If the task dies, the interval can be claimed again once this expires
+    lease_expires = peewee.DateTimeField(default=UNCLAIMED_LEASE_EXPIRATION, null=True, index=True)
+
     class Meta:
         db_table = db_table_name
         database = db
@@ -102,11 +259,35 @@ class ParallelIntervals(peewee.Model):
             (('started', 'finished', 'chrom'), False), # True means unique index
             (('chrom', 'start_pos', 'end_pos'), True), # True means unique index
             (('job_id', 'task_id', 'unique_id'), False),  # not unique because a given task can process multiple intervals
+            (('finished', 'priority'), False),  # for claiming intervals in priority order
         )
 
-array_job_task_id = os.getenv('SGE_TASK_ID', -1)
+    def save(self, *args, **kwargs):
+        # don't overwrite lease_expires since it may have been renewed by a heartbeat after this record was loaded
+        if self.id is not None and not kwargs.get("only"):
+            kwargs["only"] = get_fields_to_save(self)
+        return super(ParallelIntervals, self).save(*args, **kwargs)
+
+array_job_task_id = get_array_job_task_id()
 
-is_startup = array_job_task_id == -1 or array_job_task_id == "undefined"
+
+def get_interval_progress():
+    """Returns a 2-tuple (num_claimable, num_in_progress) with the number of intervals that can be claimed, and that
+    are claimed by a task that's still renewing its lease.
+    """
+    where_clause = is_claimable(ParallelIntervals)
+    in_progress_clause = (ParallelIntervals.started == 1) & (ParallelIntervals.finished == 0) & (
+        ParallelIntervals.lease_expires >= datetime.datetime.now())
+    if args.chrom:
+        where_clause &= (ParallelIntervals.chrom == args.chrom)
+        in_progress_clause &= (ParallelIntervals.chrom == args.chrom)
+
+    num_claimable = ParallelIntervals.select().where(where_clause).count()
+    num_in_progress = ParallelIntervals.select().where(in_progress_clause).count()
+    return num_claimable, num_in_progress
+
+
+is_startup = array_job_task_id is None
 if is_startup:
     # this instance of parallelize.py is being run for the first time
     if not args.interval_list:
@@ -128,27 +309,41 @@ if is_startup:
     logging.info("Parsed %s intervals from %s" % (len(intervals), args.interval_list))
 
     # split intervals so they are no bigger than args.interval_size
-    final_intervals = []
-    for interval in intervals:
-        chrom, start, end = interval["chrom"], interval["start_pos"], interval["end_pos"]
-        if end - start > args.interval_size:
-            #print("Breaking up large interval %s:%s-%s" % (chrom, start, end))
-            while end - start > args.interval_size:
-                #print("   %s:%s-%s" % (chrom, start, start + args.interval_size-1))
-                final_intervals.append({"chrom": chrom,
-                                        "start_pos": start,
-                                        "end_pos": start + args.interval_size-1})
-                start = start + args.interval_size
-            #print("   %s:%s-%s" % (chrom, start, end))
-
-        final_intervals.append({"chrom": chrom, "start_pos": start, "end_pos": end})
+    final_intervals = split_intervals_by_size(intervals, args.interval_size)
 
     logging.info("Broke the %s intervals into %s intervals of size %s or less" % (len(intervals), len(final_intervals), args.interval_size))
 
     # populate database table if it doesn't exist already
-    if ParallelIntervals.table_exists() and ParallelIntervals.select().count() == len(final_intervals) and not args.regenerate_intervals_table:
-        logging.info("%s: %s intervals loaded previously" % (ParallelIntervals._meta.db_table, len(final_intervals)))
+    if args.workload_per_interval:
+        # the workload-based split changes as samples finish, so reuse the table instead of resetting interval progress
+        is_table_loaded_previously = ParallelIntervals.table_exists() and ParallelIntervals.select().count() > 0
     else:
+        is_table_loaded_previously = ParallelIntervals.table_exists() and ParallelIntervals.select().count() == len(final_intervals)
+
+    if is_table_loaded_previously and not args.regenerate_intervals_table:
+        logging.info("%s: %s intervals loaded previously" % (ParallelIntervals._meta.db_table, ParallelIntervals.select().count()))
+        add_missing_columns(ParallelIntervals)  # in case the table was created by an older version of this script
+        add_missing_indexes(ParallelIntervals)
+        if args.assign_priorities:
+            assign_interval_priorities(ParallelIntervals, read_top_intervals())
+    else:
+        if args.workload_per_interval:
+            # merge and split intervals so that they contain roughly equal numbers of unfinished samples
+            logging.info("Counting unfinished samples per position")
+            workload_by_position = get_unfinished_samples_by_position(args.chrom)
+            final_intervals = split_intervals_by_workload(final_intervals, workload_by_position,
+                args.workload_per_interval, args.interval_size)
+            for interval in final_intervals:
+                del interval["workload"]
+
+            logging.info("Re-split intervals into %s intervals with ~%s unfinished samples each" % (
+                len(final_intervals), args.workload_per_interval))
+
+        # intervals in important genes are processed first
+        top_intervals = read_top_intervals()
+        for interval in final_intervals:
+            interval["priority"] = compute_priority(top_intervals, interval["chrom"], interval["start_pos"], interval["end_pos"])
+
         if ParallelIntervals.table_exists():
             logging.info("Dropping existing table: %s" % ParallelIntervals._meta.db_table)
             ParallelIntervals.drop_table()
@@ -171,102 +366,230 @@ if is_startup:
         if not os.path.isdir(args.log_dir):
             os.system("mkdir -m 777 -p %s" % args.log_dir)
 
-        if args.run_on_LSF:
-            launch_array_job_cmd = (
-                "bsub -N -J prog[1-%(num_jobs)s] -o %(log_dir)s -q hour "
-                    "python2.7 parallelize.py %(chrom_arg)s -isize %(interval_size)s %(command)s"
-            )
+        if args.local_executor:
+            executor = LocalExecutor()
+        elif args.run_on_LSF:
+            executor = LSFExecutor()
         else:
-            launch_array_job_cmd = ("qsub -q short "
-                "-t 1-%(num_jobs)s "
-                "-cwd "
-                "-l h_vmem=4g -l m_mem_free=4g "
-                "-o %(log_dir)s "
-                "-e %(log_dir)s "
-                "-j y -V "
-                "./run_python.sh python2.7 parallelize.py %(chrom_arg)s "
-                                    "-isize %(interval_size)s "
-                                    "%(command)s")
-
-        chrom_arg = ""
-        if args.chrom:
-            chrom_arg = " --chrom %s " % args.chrom
+            executor = SGEExecutor()
 
-        launch_array_job_cmd = launch_array_job_cmd  % {
+        extra_args = ""
+        if args.chrom:
+            extra_args += " --chrom %s " % args.chrom
+        if args.in_process:
+            extra_args += " --in-process "
+        if args.workload_per_interval:
+            extra_args += " -wsize %s " % args.workload_per_interval
+        if args.max_concurrent_intervals > 1:
+            extra_args += " -c %s --log-dir %s " % (args.max_concurrent_intervals, args.log_dir)
+
+        task_command = "python2.7 parallelize.py %(extra_args)s -isize %(interval_size)s %(command)s" % {
             "interval_size" : args.interval_size,
-            "num_jobs": args.num_jobs,
-            "log_dir" : args.log_dir,
-            "chrom_arg": chrom_arg,
+            "extra_args": extra_args,
             "command" : args.command
         }
 
-        logging.info("Running: %s" % launch_array_job_cmd)
-        subprocess.check_call(launch_array_job_cmd, shell=True)
-
-
-        # TODO run loop that restarts array jobs, and also does error recovery
-        # to reset unfinished task from jobs that have finished
-        # also, compute worst time and exit task before 3 hours is up so job doesn't get killed
-        # since job restarts are cheap
+        job_id = executor.submit_array_job(task_command, int(args.num_jobs), args.log_dir)
+        logging.info("Submitted array job: %s" % job_id)
+
+        if args.supervise:
+            # keep resubmitting tasks as they exit (eg. at the queue time limit) until all intervals are done.
+            # Intervals from tasks that were killed become claimable again once their lease expires.
+            run_supervisor(executor, task_command, int(args.num_jobs), args.log_dir, get_interval_progress,
+                poll_interval_seconds=args.supervisor_poll_interval*60, job_ids=[job_id],
+                should_stop=lambda: CTRL_C_SIGNAL)
 
 
-if not is_startup or args.run_local:
-    # this instance of parallelize.py is running as one of many array job tasks.
-    # run a loop that continually launches some_script.py on the next unprocessed
-    # interval until times runs out for this task
-
-    logging.info("USER: %s" % os.getenv('USER', ''))
-
-    job_id = os.getenv('JOB_ID', os.getenv('LSB_JOBID', -1))
-    if job_id != -1 and job_id != "undefined" and not args.run_local:
-        logging.info("parallelize.py - job id: %s" % job_id)
+# possible outcomes of processing an interval
+INTERVAL_FINISHED = "finished"
+INTERVAL_STOPPED_EARLY = "stopped early"  # the command didn't process the whole interval (eg. it ran out of time)
+INTERVAL_FAILED = "failed"
+
+# messages printed by the command when it stops early or finishes the whole interval
+STOPPED_EARLY_MARKER = "generate_HC_bams stopped early"
+FINISHED_MARKERS = ("generate_HC_bams finished", "-- interval finished --")
+
+ERROR_MESSAGE_TAIL_LINES = 200  # when the command fails, only this many of its last output lines are saved
+
+
+def run_interval_in_process(entry_point, interval, exit_after_minutes, entry_point_kwargs=None):
+    """Calls the --in-process entry point function on the given interval.
+
+    Args:
+        entry_point_kwargs: (optional) other keyword args for the function (see parse_entry_point_args(..))
+    Return:
+        3-tuple (outcome, error_code, error_message)
+    """
+    logging.info("interval: %s:%s-%s - calling %s" % (interval.chrom, interval.start_pos, interval.end_pos, args.command))
+    try:
+        interval_finished = entry_point(interval.chrom, interval.start_pos, interval.end_pos,
+                                        exit_after_minutes=exit_after_minutes, **(entry_point_kwargs or {}))
+    except Exception as e:
+        error_message = ("%s(%s, %s, %s)\n"
+                         "exception: %s\n"
+                         "%s") % (args.command, interval.chrom, interval.start_pos, interval.end_pos, e, traceback.format_exc())
+        return INTERVAL_FAILED, 1, error_message
+
+    if not interval_finished:
+        return INTERVAL_STOPPED_EARLY, 0, None
+
+    return INTERVAL_FINISHED, 0, None
+
+
+def run_interval_command(interval, exit_after_minutes=None):
+    """Launches the command as a subprocess on the given interval.
+
+    Args:
+        interval: the ParallelIntervals record
+        exit_after_minutes: (optional) passed to the command as --exit-after (see get_interval_command(..))
+    Return:
+        3-tuple (outcome, error_code, error_message)
+    """
+    cmd = get_interval_command(interval, exit_after_minutes)
+    logging.info("interval: %s:%s-%s - launching %s" % (interval.chrom, interval.start_pos, interval.end_pos, cmd))
+
+    # stream the output instead of buffering it since it includes the full GATK logs of every sample in the interval
+    returncode, output_tail, markers_seen = run_command_and_stream_output(cmd.split(" "),
+        markers=(STOPPED_EARLY_MARKER,) + FINISHED_MARKERS, tail_lines=ERROR_MESSAGE_TAIL_LINES)
+
+    return get_command_outcome(cmd, returncode, output_tail, markers_seen)
+
+
+def get_interval_command(interval, exit_after_minutes=None):
+    """Returns the command line for running the command on the given interval. If exit_after_minutes is specified,
+    the command is also passed --exit-after so that it stops before the queue time limit, like the function that's
+    called with --in-process (see run_interval_in_process(..)).
+    """
+    cmd = "%s --chrom %s --start-pos %s --end-pos %s" % (args.command, interval.chrom, interval.start_pos, interval.end_pos)
+    if exit_after_minutes is not None:
+        cmd += " --exit-after %d" % max(exit_after_minutes, 0)
+    return cmd
+
+
+def get_minutes_remaining(task_started_time, interval, queue_time_limit_hours):
+    """Returns how many minutes this task has left before the queue time limit when the given interval was started,
+    or None if the task isn't running in a queue with a time limit.
+    """
+    if queue_time_limit_hours is None:
+        return None
+    seconds_since_task_started = (interval.started_date - task_started_time).total_seconds()
+    return queue_time_limit_hours*60 - seconds_since_task_started/60.0
+
+
+def get_command_outcome(cmd, returncode, output_tail, markers_seen):
+    """Decides whether the command finished the interval based on its return code and output.
+
+    Return:
+        3-tuple (outcome, error_code, error_message)
+    """
+    if returncode == 0 and STOPPED_EARLY_MARKER in markers_seen:
+        return INTERVAL_STOPPED_EARLY, 0, None
+
+    if returncode == 0 and not markers_seen.intersection(FINISHED_MARKERS):
+        returncode = 100
+
+    if returncode != 0:
+        error_message = ("%s\n"
+                         "return code: %s\n"
+                         "last %s lines of output: %s") % (cmd, returncode, ERROR_MESSAGE_TAIL_LINES, output_tail.strip())
+        return INTERVAL_FAILED, returncode, error_message
+
+    return INTERVAL_FINISHED, 0, None
+
+
+def record_interval_outcome(interval, outcome, error_code, error_message):
+    """Saves the outcome of processing the given interval to the database and releases the interval's lease."""
+    if outcome == INTERVAL_FINISHED:
+        interval.finished = 1
+        interval.finished_date = datetime.datetime.now()
+        #interval.comments = str(interval.comments or "") + "_id" + str(interval.task_id) + "_done"
+        interval.save()
+        logging.info("interval: %s:%s-%s - succeeded!" % (interval.chrom, interval.start_pos, interval.end_pos))
+    elif outcome == INTERVAL_STOPPED_EARLY:
+        # the command stopped early (eg. Ctrl-C or time limit), so release the interval for other tasks
+        interval.save()
+        unclaim_records(ParallelIntervals, [interval.id])
+        logging.info("interval: %s:%s-%s - stopped before finishing. Released it." % (interval.chrom, interval.start_pos, interval.end_pos))
+        return
     else:
-        job_id = os.getpid()
-        array_job_task_id = 0
-        logging.info("parellelize.py - running as local process - id: %s" % job_id)
-
-    #if not args.run_local:
-    #    time.sleep(random.randint(1, 30)) # sleep between 0 and 60 seconds to avoid all tasks trying to aquire intervals at the same time
-
-    unique_8_digit_id = random.randint(10**8, 10**9 - 1)  # don't use actual job id to avoid collisions in case this script has been restarted and the same job id is reused.
-
-    task_started_time = datetime.datetime.now()
-
+        interval.error_code = error_code
+        interval.error_message = error_message
+        #interval.comments = str(interval.comments or "") + "_id" + str(interval.task_id) + "_error_ret" + str(error_code)
+        interval.save()
+        logging.info("interval: %s:%s-%s - failed: %s" % (interval.chrom, interval.start_pos, interval.end_pos, error_message))
+
+    release_lease(ParallelIntervals, interval.id)
+
+
+def get_recent_interval_runtimes(n=1000):
+    """Returns a list of runtimes (in seconds) of the n most recently-started intervals that finished successfully"""
+    query = ParallelIntervals.select(ParallelIntervals.started_date, ParallelIntervals.finished_date).where(
+        ParallelIntervals.finished == 1).order_by(ParallelIntervals.started_date.desc()).limit(n)
+
+    return get_runtimes_in_seconds(query.tuples())
+
+
+def claim_next_interval(job_id, task_id, unique_8_digit_id, task_started_time, interval_runtimes,
+                        queue_time_limit_hours=None):
+    """Claims the next unprocessed interval.
+
+    Args:
+        job_id: cluster array job id (or process id if running locally)
+        task_id: cluster array job task id (or worker number if running locally)
+        unique_8_digit_id: random id of this task
+        task_started_time: when this task started
+        interval_runtimes: list of runtimes (in seconds) of previous intervals
+        queue_time_limit_hours: the time limit of the cluster queue this task is running in, or None if it's not
+            running in a cluster job (see get_task_time_limit_hours(..))
+    Return:
+        the claimed ParallelIntervals record, or None if there are no more intervals or not enough time left to
+        process another one.
+    """
     while True:
-        # get next interval
-        current_interval = None
-
-        if CTRL_C_SIGNAL:
-            logging.info("Interrupted. Exiting..")
-            break
-
         # claim an interval
         #with db.atomic() as txn:
         #db.execute_sql("LOCK TABLE %s WRITE" % db_table_name)
         #unprocessed_intervals =  ParallelIntervals.raw("SELECT * FROM %s WHERE job_id is NULL and task_id is NULL and unique_id is NULL" % db_table_name)
         randomized_variant_num = random.randint(1, 1000)  # used to reduce chance of collisions
 
-        where_clause = (ParallelIntervals.started == 0) & (ParallelIntervals.finished == 0)
+        # intervals that aren't started, or whose lease expired because the task processing them died, can be claimed
+        where_clause = is_claimable(ParallelIntervals)
         if args.chrom:
             where_clause &= (ParallelIntervals.chrom == args.chrom)
 
-        unprocessed_intervals = ParallelIntervals.select().where(where_clause).limit(randomized_variant_num)
+        unprocessed_intervals = ParallelIntervals.select().where(where_clause).order_by(
+            *get_priority_ordering(ParallelIntervals)).limit(randomized_variant_num)
  
         unprocessed_intervals = list(unprocessed_intervals)
         if len(unprocessed_intervals) == 0:
             logging.info("Finished all intervals. Exiting..")
-            break
+            return None
 
-        current_interval = unprocessed_intervals[-1]
+        current_interval = pick_highest_priority_record(unprocessed_intervals)
         interval_started_time = datetime.datetime.now()
 
-        hours_since_task_started = (interval_started_time - task_started_time).total_seconds()/3600.0
-        if hours_since_task_started > EXIT_UGER_JOB_AFTER_N_HOURS:   # TODO check if args.run_on_LSF
-            logging.info("Job has been running for %s hours. UGER short queue time limit is coming up. Exiting to avoid getting killed." % hours_since_task_started)
-            break
+        seconds_since_task_started = (interval_started_time - task_started_time).total_seconds()
+        hours_since_task_started = seconds_since_task_started/3600.0
+
+        # without enough runtimes to predict the next interval's runtime, fall back on a fixed cutoff
+        if (queue_time_limit_hours is not None and hours_since_task_started > EXIT_UGER_JOB_AFTER_N_HOURS and
+                predict_runtime(interval_runtimes, percentile=RUNTIME_PREDICTION_PERCENTILE) is None):
+            logging.info("Job has been running for %s hours. Queue time limit is coming up. Exiting to avoid getting killed." % hours_since_task_started)
+            return None
+
+        if queue_time_limit_hours is not None and not will_next_unit_fit(seconds_since_task_started,
+                queue_time_limit_hours*3600, interval_runtimes, percentile=RUNTIME_PREDICTION_PERCENTILE):
+            logging.info("Job has been running for %s hours and the next interval isn't expected to finish before the "
+                         "%s hour queue time limit. Exiting to avoid getting killed." % (hours_since_task_started, queue_time_limit_hours))
+            return None
 
         rows_updated = ParallelIntervals.update(
             started = 1,
+            started_date = interval_started_time,
+            job_id = job_id,
+            task_id = task_id,
+            unique_id = unique_8_digit_id,
+            lease_expires = compute_lease_expiration(CLAIM_LEASE_DURATION_MINUTES),
         ).where(
             (ParallelIntervals.id == current_interval.id) & where_clause
         ).execute()
@@ -278,9 +601,11 @@ if not is_startup or args.run_local:
         #db.execute_sql("UNLOCK TABLE")
         current_interval.started = 1
         current_interval.started_date = interval_started_time
+        current_interval.error_code = 0
+        current_interval.error_message = None
 
         current_interval.job_id = job_id
-        current_interval.task_id = array_job_task_id
+        current_interval.task_id = task_id
         current_interval.unique_id = unique_8_digit_id
 
         current_interval.username = getpass.getuser()
@@ -288,33 +613,237 @@ if not is_startup or args.run_local:
         current_interval.machine_average_load = os.getloadavg()[-1]
         #current_interval.comments = str(current_interval.comments or "") + "__s_%s_id%s_%s" % (job_id, array_job_task_id, unique_8_digit_id)
 
-        cmd = "%s --chrom %s --start-pos %s --end-pos %s" % (args.command,
-            current_interval.chrom, current_interval.start_pos, current_interval.end_pos)
-        logging.info("interval: %s:%s-%s - launching %s" % (
-            current_interval.chrom, current_interval.start_pos, current_interval.end_pos, cmd))
-        try:
-            cmd_output = subprocess.check_output(cmd.split(" "), stderr=subprocess.STDOUT).decode()
-            for line in cmd_output.split("\n"):
-                logging.info("      %s" % line.strip())
-            if "generate_HC_bams finished" not in cmd_output and "-- interval finished --" not in cmd_output:
-                raise subprocess.CalledProcessError(100, cmd, cmd_output)
-        except subprocess.CalledProcessError as e:
-            error_message = ("%s\n"
-                             "return code: %s\n"
-                             "output: %s") % (e.cmd, e.returncode, e.output.strip())
-            current_interval.error_code = e.returncode
-            current_interval.error_message = error_message
-            #current_interval.comments = str(current_interval.comments or "") + "_id" + str(current_interval.task_id) + "_error_ret" + str(e.returncode)+"_msg"+e.output.strip()[0:10]
-            current_interval.save()
-            logging.info("interval: %s:%s-%s - failed: %s" % (current_interval.chrom, current_interval.start_pos, current_interval.end_pos, error_message))
+        return current_interval
+
+
+def get_task_time_limit_hours():
+    """Returns how long this task can run before the scheduler kills it, or None if there's no limit (eg. with
+    --run-local)"""
+    if args.run_local:
+        return None
+    return get_queue_time_limit_hours()
+
+
+def run_intervals_loop(job_id, task_id, stop_event=None):
+    """Runs a loop that continually claims the next unprocessed interval and runs the command on it until all
+    intervals are done, time runs out for this task, or Ctrl-C is pressed.
+
+    Args:
+        job_id: cluster array job id (or process id if running locally)
+        task_id: cluster array job task id (or worker number if running locally)
+        stop_event: (optional) multiprocessing.Event which, when set, tells this loop to exit after the current interval
+    """
+    #if not args.run_local:
+    #    time.sleep(random.randint(1, 30)) # sleep between 0 and 60 seconds to avoid all tasks trying to aquire intervals at the same time
+
+    unique_8_digit_id = random.randint(10**8, 10**9 - 1)  # don't use actual job id to avoid collisions in case this script has been restarted and the same job id is reused.
+
+    task_started_time = datetime.datetime.now()
+    queue_time_limit_hours = get_task_time_limit_hours()
+    logging.info("queue time limit: %s hours" % queue_time_limit_hours)
+
+    # runtimes of previous intervals are used to predict whether the next interval will finish before the time limit
+    interval_runtimes = get_recent_interval_runtimes()
+
+    entry_point = entry_point_kwargs = None
+    if args.in_process:
+        logging.info("loading entry point: %s" % entry_point_name)
+        entry_point = load_entry_point(entry_point_name)
+        entry_point_kwargs = parse_entry_point_args(entry_point, entry_point_args)
+
+    try:
+        while True:
+            if CTRL_C_SIGNAL or (stop_event is not None and stop_event.is_set()):
+                logging.info("Interrupted. Exiting..")
+                break
+
+            current_interval = claim_next_interval(job_id, task_id, unique_8_digit_id, task_started_time, interval_runtimes,
+                                                   queue_time_limit_hours)
+            if current_interval is None:
+                break
+
+            interval_started_time = current_interval.started_date
+
+            # let the command use the rest of the time until the queue time limit
+            minutes_remaining = get_minutes_remaining(task_started_time, current_interval, queue_time_limit_hours)
+
+            # renew the lease while the interval is being processed
+            with keep_lease_alive(ParallelIntervals, current_interval.id, CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES):
+                if args.in_process:
+                    outcome, error_code, error_message = run_interval_in_process(entry_point, current_interval,
+                                                                                 minutes_remaining, entry_point_kwargs)
+                else:
+                    outcome, error_code, error_message = run_interval_command(current_interval, minutes_remaining)
+
+            record_interval_outcome(current_interval, outcome, error_code, error_message)
+            if outcome == INTERVAL_FINISHED:
+                interval_runtimes.append((current_interval.finished_date - interval_started_time).total_seconds())
+    finally:
+        if entry_point is not None:
+            # eg. stop GATK workers and delete cached bam regions that were shared by all intervals in this process
+            cleanup = get_entry_point_hook(entry_point, "cleanup_%s")
+            if cleanup is not None:
+                cleanup()
+
+
+def run_intervals_concurrently(job_id, task_id, max_concurrency, stop_event=None, poll_interval_seconds=15,
+                               ramp_up_seconds=120):
+    """Like run_intervals_loop(..), but runs up to max_concurrency interval commands at a time. The number of
+    commands grows while the machine has free cpus and enough free memory for another command, and shrinks (by not
+    replacing commands that finish) when it's overloaded.
+
+    Args:
+        job_id: cluster array job id (or process id if running locally)
+        task_id: cluster array job task id (or worker number if running locally)
+        max_concurrency: max number of interval commands to run at a time
+        stop_event: (optional) multiprocessing.Event which, when set, tells this loop to not launch any more commands,
+            and to exit once the running ones finish
+        poll_interval_seconds: how often to check on running commands and machine load
+        ramp_up_seconds: commands that started less than this long ago may not have allocated their memory yet
+    """
+    unique_8_digit_id = random.randint(10**8, 10**9 - 1)
+
+    task_started_time = datetime.datetime.now()
+    queue_time_limit_hours = get_task_time_limit_hours()
+    interval_runtimes = get_recent_interval_runtimes()
+
+    running = []  # list of (interval, command, process, output log path, lease heartbeat) tuples
+    no_more_intervals = False
+    while True:
+        # check on running commands
+        for running_interval in list(running):
+            interval, cmd, process, log_path, heartbeat = running_interval
+            if process.poll() is None:
+                continue
+            running.remove(running_interval)
+            heartbeat.stop()
+
+            output_tail, markers_seen = read_output_tail(log_path,
+                markers=(STOPPED_EARLY_MARKER,) + FINISHED_MARKERS, tail_lines=ERROR_MESSAGE_TAIL_LINES)
+            outcome, error_code, error_message = get_command_outcome(
+                cmd, process.returncode, output_tail, markers_seen)
+            record_interval_outcome(interval, outcome, error_code, error_message)
+            if outcome != INTERVAL_FAILED:
+                os.remove(log_path)  # only keep logs of failed intervals
+            if outcome == INTERVAL_FINISHED:
+                interval_runtimes.append((interval.finished_date - interval.started_date).total_seconds())
+
+        # checked before each launch, since the loop starts over after each one
+        if (CTRL_C_SIGNAL or (stop_event is not None and stop_event.is_set())) and not no_more_intervals:
+            logging.info("Interrupted. Waiting for %s running intervals to finish.." % len(running))
+            no_more_intervals = True
+
+        if no_more_intervals:
+            if not running:
+                break
         else:
-            # finished
-            current_interval.finished = 1
-            current_interval.finished_date = datetime.datetime.now()
-            #current_interval.comments = str(current_interval.comments or "") + "_id" + str(current_interval.task_id) + "_done"
-            current_interval.save()
+            now = datetime.datetime.now()
+            load_average, num_cpus, free_memory_gb = get_machine_load()
+            num_starting = sum(1 for interval, _, _, _, _ in running if (now - interval.started_date).total_seconds() < ramp_up_seconds)
+            target_concurrency = compute_target_concurrency(len(running), num_starting, max_concurrency,
+                load_average, num_cpus, free_memory_gb, MEMORY_PER_INTERVAL_COMMAND_GB)
+
+            if len(running) < target_concurrency:
+                logging.info("load: %0.1f, cpus: %s, free memory: %s GB - running %s of %s intervals. Starting another.." % (
+                    load_average, num_cpus, free_memory_gb, len(running), target_concurrency))
+
+                interval = claim_next_interval(job_id, task_id, unique_8_digit_id, task_started_time,
+                                               interval_runtimes, queue_time_limit_hours)
+                if interval is None:
+                    no_more_intervals = True
+                else:
+                    cmd = get_interval_command(interval,
+                        get_minutes_remaining(task_started_time, interval, queue_time_limit_hours))
+                    log_path = os.path.join(args.log_dir, "%s.%s_%s_%s.log" % (
+                        db_table_name, interval.chrom, interval.start_pos, interval.end_pos))
+                    logging.info("interval: %s:%s-%s - launching %s. Log: %s" % (
+                        interval.chrom, interval.start_pos, interval.end_pos, cmd, log_path))
+                    with open(log_path, "w") as log_file:
+                        process = subprocess.Popen(cmd.split(" "), stdout=log_file, stderr=subprocess.STDOUT)
+
+                    heartbeat = LeaseHeartbeat(ParallelIntervals, interval.id, CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES)
+                    heartbeat.start()
+                    running.append((interval, cmd, process, log_path, heartbeat))
+                    continue  # check right away whether there's room for another command
+
+        time.sleep(poll_interval_seconds)
+
+
+def run_local_worker(worker_i, job_id, stop_event):
+    """Entry point for each worker process launched by --run-local --num-local-workers N. Redirects logging to a
+    per-worker log file and then runs the intervals loop (or with -c, the concurrent intervals loop).
+    """
+    random.seed()  # re-seed since forked workers inherit the parent's random state, which would cause claim collisions
+
+    log_path = os.path.join(args.log_dir, "%s.local_worker%d.log" % (db_table_name, worker_i))
+    log_handler = logging.FileHandler(log_path)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s: worker ' + str(worker_i) + ': %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p'))
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(log_handler)
+
+    logging.info("parellelize.py - local worker %s - pid: %s" % (worker_i, os.getpid()))
+    if args.max_concurrent_intervals > 1:
+        # -c is the limit for the whole machine, so it's divided between the workers
+        max_concurrency = max(1, args.max_concurrent_intervals // args.num_local_workers)
+        run_intervals_concurrently(job_id, worker_i, max_concurrency, stop_event)
+    else:
+        run_intervals_loop(job_id, worker_i, stop_event)
 
-            logging.info("interval: %s:%s-%s - succeeded!" % (current_interval.chrom, current_interval.start_pos, current_interval.end_pos))
+
+if not is_startup or args.run_local:
+    # this instance of parallelize.py is running as one of many array job tasks.
+    # run a loop that continually launches some_script.py on the next unprocessed
+    # interval until times runs out for this task
+
+    logging.info("USER: %s" % os.getenv('USER', ''))
+
+    # intervals that were reset (eg. by scripts/reset_failed_db_records.py) don't have a lease yet
+    mark_unclaimed_records(ParallelIntervals)
+
+    job_id = os.getenv('JOB_ID', os.getenv('LSB_JOBID', -1))
+    if job_id != -1 and job_id != "undefined" and not args.run_local:
+        logging.info("parallelize.py - job id: %s" % job_id)
+    else:
+        job_id = os.getpid()
+        array_job_task_id = 0
+        logging.info("parellelize.py - running as local process - id: %s" % job_id)
+
+    if args.run_local and args.num_local_workers > 1:
+        # run N workers on this machine, each of which claims its own intervals
+        if not os.path.isdir(args.log_dir):
+            os.system("mkdir -m 777 -p %s" % args.log_dir)
+
+        if args.in_process:
+            load_entry_point(entry_point_name)  # import once before forking so that workers share the warm module state
+
+        db.close()  # each worker process opens its own database connection
+
+        stop_event = multiprocessing.Event()
+        workers = []
+        for worker_i in range(1, args.num_local_workers + 1):
+            worker = multiprocessing.Process(target=run_local_worker, args=(worker_i, job_id, stop_event))
+            worker.start()
+            workers.append(worker)
+            logging.info("started local worker %s (pid: %s). Log: %s" % (
+                worker_i, worker.pid, os.path.join(args.log_dir, "%s.local_worker%d.log" % (db_table_name, worker_i))))
+
+        while any(worker.is_alive() for worker in workers):
+            if CTRL_C_SIGNAL and not stop_event.is_set():
+                logging.info("Telling all local workers to exit after their current interval..")
+                stop_event.set()
+            time.sleep(1)
+
+        for worker_i, worker in enumerate(workers, 1):
+            worker.join()
+            logging.info("local worker %s exited with code %s" % (worker_i, worker.exitcode))
+    elif args.max_concurrent_intervals > 1:
+        if not os.path.isdir(args.log_dir):
+            os.system("mkdir -m 777 -p %s" % args.log_dir)
+        run_intervals_concurrently(job_id, array_job_task_id, args.max_concurrent_intervals)
+    else:
+        run_intervals_loop(job_id, array_job_task_id)
 
 
 chrom_sizes = {
@@ -12,10 +12,13 @@ import peewee
 from peewee import fn
 from playhouse import shortcuts
 import pysam
+import socket
+import time
 import traceback
 
 from utils.haplotype_caller import compute_output_bam_path
-from utils.database import Sample, _SharedVariantPositionFields
+from utils.database import Sample, ChildProcessUsage, _SharedVariantPositionFields
+from utils.resource_usage import run_command_with_usage
 from utils.constants import BAM_OUTPUT_DIR, PICARD_JAR_PATH, MAX_SAMPLES_TO_SHOW_PER_VARIANT
 
 
@@ -24,6 +27,25 @@ def run(cmd):
     os.system(cmd)
 
 
+def run_and_save_usage(cmd, program, label, num_samples=None):
+    """Runs the given command and saves the resources it used to the ChildProcessUsage table"""
+    logging.info(cmd)
+    start_time = time.time()
+    returncode, output, usage = run_command_with_usage(cmd)
+    wall_seconds = time.time() - start_time
+    logging.info(output)
+    if returncode != 0:
+        logging.error("%s exited with return code %s" % (program, returncode))
+
+    try:
+        ChildProcessUsage.create(program=program, label=label[:100], num_samples=num_samples,
+            hostname=socket.gethostname()[:100], num_concurrent=1, wall_seconds=wall_seconds,
+            cpu_seconds=usage.cpu_seconds, peak_rss_mb=usage.peak_rss_mb, read_mb=usage.read_mb,
+            write_mb=usage.write_mb)
+    except Exception as e:
+        logging.warning("couldn't save %s resource usage: %s" % (program, e))
+
+
 def bam_path_to_fields(bam_path):
     # for example: /read_viz/22/5822/chr22-46615822-A-G_het0.bam
     return os.path.basename(bam_path).replace(".bam", "").replace('_', '-').split('-')
@@ -121,8 +143,9 @@ def generate_combined_bam(base_dir, samples_to_combine, temp_combined_bam_path,
     logging.info("Running picard SortSam:")
     picard_jar = PICARD_JAR_PATH
 
-    run(("java -jar %(picard_jar)s SortSam VALIDATION_STRINGENCY=LENIENT "
-         "I=%(temp_combined_bam_path)s O=%(combined_bam_path)s SO=coordinate CREATE_INDEX=true") % locals())
+    run_and_save_usage(("java -jar %(picard_jar)s SortSam VALIDATION_STRINGENCY=LENIENT "
+         "I=%(temp_combined_bam_path)s O=%(combined_bam_path)s SO=coordinate CREATE_INDEX=true") % locals(),
+         program="SortSam", label=os.path.basename(combined_bam_path), num_samples=len(samples_to_combine))
     run("rm %(temp_combined_bam_path)s" % locals())
     
     bai_path = combined_bam_path.replace(".bam", ".bai")
@@ -266,6 +289,8 @@ if __name__ == "__main__":
        help="bams are divided between directories with names 000 through 999. "
             "This should be a number between 0 and 999 which specifies the end of "
             "a range of these directories to process.")
+    p.add_argument("--exit-after", metavar="MINUTES", type=float,
+       help="Passed by parallelize.py. Ignored, since each directory is quick to combine.")
     args = p.parse_args()
 
     if args.position_hash is not None:
@@ -18,22 +18,43 @@ configargparse.initArgumentParser(
         default_config_files=["~/.generate_HC_bams_config"],
         formatter_class=configargparse.ArgumentDefaultsHelpFormatter)
 
+import argparse
 import collections
 import datetime
+import multiprocessing
 import random
 import signal
+import tempfile
+import threading
 import time
 import traceback
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # python2
 
 logging.info("compute_HC_bams_from_sample_table - done with imports - #1")
 
 from utils.database import init_db, Sample, _readviz_db
+from utils.exac_calling_intervals import get_overlapping_calling_interval
+from utils.file_utils import create_dir
+from utils.gatk_worker import GatkResult
 logging.info("compute_HC_bams_from_sample_table - done with imports - #2")
 
-from utils.constants import BAM_OUTPUT_DIR, MAX_SAMPLES_TO_SHOW_PER_VARIANT, BACKUP_SAMPLES_IN_CASE_OF_ERRORS
+from utils.constants import BAM_OUTPUT_DIR, MAX_SAMPLES_TO_SHOW_PER_VARIANT, BACKUP_SAMPLES_IN_CASE_OF_ERRORS, \
+    RUNTIME_PREDICTION_PERCENTILE, CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES, \
+    HC_MAX_HEAP_SIZE_MB, HC_JVM_OVERHEAD_MB, MAX_CLAIM_ATTEMPTS
+from utils.leases import compute_lease_expiration, is_claimable, keep_leases_alive, LeaseHeartbeat, \
+    mark_unclaimed_records, UNCLAIMED_LEASE_EXPIRATION
+from utils.load_aware_concurrency import get_free_memory_gb, compute_num_workers
+from utils.priorities import pick_highest_priority_record, get_priority_ordering
+from utils.sample_indexes import assign_sample_indexes, get_variant_condition
+from utils.runtime_prediction import will_next_unit_fit, get_runtimes_in_seconds
 logging.info("compute_HC_bams_from_sample_table - done with imports - #3")
 
-from utils.haplotype_caller import run_haplotype_caller
+from utils.haplotype_caller import run_haplotype_caller, run_haplotype_caller_batch, run_gatk, \
+    prepare_haplotype_caller_batch, finish_haplotype_caller_batch, get_calling_window, start_gatk_workers, \
+    stop_gatk_workers, enable_result_cache, enable_downsampling, hc_failed, ERROR_TOO_MANY_CLAIM_ATTEMPTS
 logging.info("compute_HC_bams_from_sample_table - done with imports - #4")
 
 CTRL_C_SIGNAL = False
@@ -45,93 +66,541 @@ def signal_handler(signal, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 
-def main(sample_iterator, bam_output_dir, exit_after_minutes=None):
+def main(sample_iterator, bam_output_dir, exit_after_minutes=None, scratch_dir=None, region_cache=None):
     """Generates HC-reassembled bams.
 
     Args:
-        sample_iterator: Iterator that returns Sample records.
+        sample_iterator: Iterator that returns Sample records, or lists of Sample records that have the same sample_id
+            so that HC can be run on all of them at once (see create_sample_batch_iterator(..)).
         bam_output_dir: Top level output dir for all bams
-        exit_after_minutes: (optional - integer) after this many minutes, finish processing the current sample and exit
+        exit_after_minutes: (optional - integer) don't start processing a sample unless it's expected to finish
+            within this many minutes of when main(..) was called
+        scratch_dir: (optional) node-local directory for HC's intermediate files (see run_haplotype_caller(..))
+        region_cache: (optional) BamRegionCache to get local copies of the needed bam regions from
+    Return:
+        True if the sample_iterator was exhausted, or False if processing stopped early (eg. due to the time limit
+        or Ctrl-C) and some samples may still be unprocessed.
     """
 
     # iterate over the Samples
     main_started_time = datetime.datetime.now()
 
-    counters = collections.defaultdict(int)
-    for sr in sample_iterator:
-        # print some stats
-        logging.info("-----")
-
-        counters["all_samples_gt"] += 1
-        if counters["all_samples_gt"] % 100 == 0:
-            logging.info(", ".join(["%s=%s" % (k, v) for k,v in sorted(counters.items(), key=lambda kv: kv[0])]),)
-            logging.info("-----")
+    # runtimes of recently-finished samples are used to predict whether the next sample will finish before the time limit
+    sample_runtimes = get_recent_sample_runtimes() if exit_after_minutes else []
 
+    counters = collections.defaultdict(int)
+    finished_all_samples = True
+    while True:
+        # check the time limit and Ctrl-C before claiming the next sample so that it doesn't get left half-done
         if exit_after_minutes:
-            minutes_since_task_started = (datetime.datetime.now() - main_started_time).total_seconds()/3600
-            if minutes_since_task_started > exit_after_minutes:
-                logging.info("Time limit of %s minutes reached. Exiting..." % exit_after_minutes)
+            seconds_since_task_started = (datetime.datetime.now() - main_started_time).total_seconds()
+            if not will_next_unit_fit(seconds_since_task_started, exit_after_minutes*60, sample_runtimes, percentile=RUNTIME_PREDICTION_PERCENTILE):
+                logging.info("Next sample isn't expected to finish within the time limit of %s minutes. Exiting..." % exit_after_minutes)
+                finished_all_samples = False
                 break
         if CTRL_C_SIGNAL:
             logging.info("Interrupted. Exiting...")
+            finished_all_samples = False
+            break
+
+        sample_records = next(sample_iterator, None)
+        if sample_records is None:
             break
+        if not isinstance(sample_records, list):
+            sample_records = [sample_records]
 
-        # skip if sample has been processed already -- this should never happen
-        if sr.finished:
-            logging.info("%s-%s-%s-%s %s - already done - skipping.." % (
-                sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi))
-            counters[sr.het_or_hom_or_hemi+"_sample_already_done"] += 1
+        batch_started_time = datetime.datetime.now()
+
+        samples_to_run = [sr for sr in sample_records if prepare_sample(sr, counters)]
+        if not samples_to_run:
             continue
 
-        if sr.sample_i is None:
-            available_sample_ids = [
-                s.id for s in Sample.select().where(
-                    (Sample.chrom == sr.chrom) &
-                    (Sample.pos == sr.pos) &
-                    (Sample.ref == sr.ref) &
-                    (Sample.alt == sr.alt) &
-                    (Sample.het_or_hom_or_hemi == sr.het_or_hom_or_hemi)
-            ).order_by(Sample.id.asc())]
+        # original_bam_path was recomputed, so make sure all samples in a batch still share the same bam
+        samples_by_bam_path = collections.OrderedDict()
+        for sr in samples_to_run:
+            samples_by_bam_path.setdefault(sr.original_bam_path, []).append(sr)
+
+        # renew the leases on these samples while HC is running. If this task dies, the samples can be re-claimed
+        # once the leases expire. If run_haplotype_caller raises an exception, the leases are left to expire so
+        # that the samples are retried.
+        with keep_leases_alive(Sample, [sr.id for sr in samples_to_run], CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES):
+            for batch in samples_by_bam_path.values():
+                # an error in one batch shouldn't keep the other batches from running
+                try:
+                    # local copy of the bam regions, if they were prefetched (see prefetch_sample_batches(..))
+                    staged_bam_path = getattr(batch[0], "staged_bam_path", None)
+                    if staged_bam_path is not None and batch[0].original_bam_path != batch[0].staged_from_bam_path:
+                        staged_bam_path = None
+
+                    cached_bam_path = None
+                    if staged_bam_path is None and region_cache is not None:
+                        cached_bam_path = staged_bam_path = get_cached_bam_path(region_cache, batch)
+
+                    try:
+                        run_haplotype_caller_on_batch(batch, bam_output_dir, staged_bam_path, scratch_dir)
+                    finally:
+                        if cached_bam_path is not None:
+                            region_cache.release(cached_bam_path)
+                except Exception as e:
+                    logging.error("%s - error in run_haplotype_caller: %s" % (
+                        ", ".join("%s-%s-%s-%s %s" % (sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi) for sr in batch), e))
+                    traceback.print_exc()
+
+        # split the batch runtime evenly between its samples
+        batch_runtime = (datetime.datetime.now() - batch_started_time).total_seconds()
+        sample_runtimes.extend([batch_runtime / len(samples_to_run)] * len(samples_to_run))
 
-            sr.sample_i = available_sample_ids.index(sr.id)  # the 1st sample will have sample_i = 0, etc.
+    logging.info(", ".join(["%s=%s" % (k, v) for k,v in sorted(counters.items(), key=lambda kv: kv[0])]),)
+    if finished_all_samples:
+        logging.info("generate_HC_bams finished.") # at %s:%s" % (chrom, pos))
+    else:
+        logging.info("generate_HC_bams stopped early.")  # detected by parallelize.py to release the interval
+
+    return finished_all_samples
+
+
+def run_haplotype_caller_on_batch(batch, bam_output_dir, input_bam_path, scratch_dir):
+    """Runs HC on a list of Sample records with the same original bam"""
+    if len(batch) > 1:
+        run_haplotype_caller_batch(batch, all_bam_output_dir=bam_output_dir, input_bam_path=input_bam_path,
+                                   scratch_dir=scratch_dir)
+        return
+
+    sr = batch[0]
+    run_haplotype_caller(
+        sr.chrom,
+        sr.pos,
+        sr.ref,
+        sr.alt,
+        sr.het_or_hom_or_hemi,
+        original_bam_path=sr.original_bam_path,
+        original_gvcf_path=sr.original_gvcf_path,
+        sample_id=sr.sample_id,
+        sample_i=sr.sample_i,
+        all_bam_output_dir=bam_output_dir,
+        only_choose_samples=False,
+        input_bam_path=input_bam_path,
+        scratch_dir=scratch_dir,
+    )
+
+
+def get_bam_regions(sample_records):
+    """Returns the list of (chrom, start, end) regions of the original bam that HC needs for the given samples"""
+    regions = []
+    for sr in sample_records:
+        _, calling_intervals = get_calling_window(sr.chrom, sr.pos)
+        regions += [(i.chrom, i.start, i.end) for i in calling_intervals]
+    return regions
+
+
+def get_cached_bam_path(region_cache, sample_records):
+    """Returns a local copy of the bam regions that HC needs for the given samples, which all have the same original
+    bam, or None if copying failed. The returned path must be passed to region_cache.release(..) when HC is done.
+    """
+    try:
+        return region_cache.get(sample_records[0].original_bam_path, get_bam_regions(sample_records))
+    except Exception as e:
+        logging.warning("%s - couldn't copy bam regions to the local cache: %s" % (sample_records[0].sample_id, e))
+        return None
+
+
+def main_with_worker_pool(sample_iterator, bam_output_dir, num_workers, exit_after_minutes=None, scratch_dir=None,
+                          region_cache=None):
+    """Generates HC-reassembled bams while running up to num_workers HaplotypeCaller commands at the same time.
 
-            logging.info("%s-%s-%s-%s %s - computed sample_i: %s" % (
-                sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, sr.sample_i))
+    Only the HaplotypeCaller commands run in worker threads. Claiming samples, checking GVCFs, postprocessing bams
+    and all database updates (except lease renewals) happen in this thread, so they go through one connection.
 
-        sr.original_bam_path = lookup_original_bam_path(sr.sample_id)  # recompute the original bam path in case it's changed
-        sr.save()
+    Samples that need another HC run (see finish_haplotype_caller_batch(..)) are run as separate commands in the worker
+    threads too, before any more samples are claimed.
 
-        if sr.sample_i >= MAX_SAMPLES_TO_SHOW_PER_VARIANT + BACKUP_SAMPLES_IN_CASE_OF_ERRORS:
-            logging.info("%s-%s-%s-%s %s - sample_i too large. Skipping: %s" % (
-                sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, sr.sample_i))
-            sr.delete_instance()
+    On Ctrl-C, no more samples are claimed, and the commands that are already running are allowed to finish.
+
+    Args:
+        sample_iterator: Iterator that returns Sample records or lists of Sample records (see
+            create_sample_record_iterator(..) and create_sample_batch_iterator(..))
+        bam_output_dir: Top level output dir for all bams
+        num_workers: max number of HaplotypeCaller commands to run at the same time
+        exit_after_minutes: (optional - integer) don't claim another sample unless it's expected to finish
+            within this many minutes of when main_with_worker_pool(..) was called
+        scratch_dir: (optional) node-local directory for HC's intermediate files (see run_haplotype_caller(..))
+        region_cache: (optional) BamRegionCache to get local copies of the needed bam regions from
+    Return:
+        True if the sample_iterator was exhausted, or False if processing stopped early.
+    """
+    main_started_time = datetime.datetime.now()
+    sample_runtimes = get_recent_sample_runtimes() if exit_after_minutes else []
+
+    counters = collections.defaultdict(int)
+    finished_all_samples = True
+    sample_iterator_exhausted = False
+    hc_results = queue.Queue()
+    running_jobs = {}  # maps job number to (HaplotypeCallerJob, LeaseHeartbeat, started time, cached bam path)
+    retry_jobs = collections.deque()  # (HaplotypeCallerJob, LeaseHeartbeat) - see finish_haplotype_caller_batch(..)
+    job_counter = [0]
+
+    def run_job(job_number, hc_command_line):
+        try:
+            hc_result = run_gatk(hc_command_line, ignore_sigint=True)
+        except Exception as e:
+            hc_result = GatkResult(False, -1, str(e), 0, None, None, None, False)
+        hc_results.put((job_number, hc_result))
+
+    def launch_job(job, heartbeat, cached_bam_path):
+        job_counter[0] += 1
+        running_jobs[job_counter[0]] = (job, heartbeat, datetime.datetime.now(), cached_bam_path)
+
+        logging.info("launching HC on %s variants (%s running): %s" % (
+            len(job.samples_to_run), len(running_jobs), job.hc_command_line))
+        worker = threading.Thread(target=run_job, args=(job_counter[0], job.hc_command_line),
+                                  name="HaplotypeCaller-%s" % job_counter[0])
+        worker.daemon = True
+        worker.start()
+
+    while True:
+        # samples that need another HC run were already claimed, so they're run before claiming more samples, and
+        # even after claiming stopped
+        while retry_jobs and len(running_jobs) < num_workers:
+            launch_job(*retry_jobs.popleft(), cached_bam_path=None)
+
+        # claim and start more samples while there are free workers
+        can_start_more = not sample_iterator_exhausted and finished_all_samples and len(running_jobs) < num_workers
+        if can_start_more and exit_after_minutes:
+            seconds_since_task_started = (datetime.datetime.now() - main_started_time).total_seconds()
+            if not will_next_unit_fit(seconds_since_task_started, exit_after_minutes*60, sample_runtimes, percentile=RUNTIME_PREDICTION_PERCENTILE):
+                logging.info("Next sample isn't expected to finish within the time limit of %s minutes. Waiting for "
+                             "%s running samples to finish..." % (exit_after_minutes, len(running_jobs)))
+                finished_all_samples = can_start_more = False
+        if can_start_more and CTRL_C_SIGNAL:
+            logging.info("Interrupted. Waiting for %s running samples to finish..." % len(running_jobs))
+            finished_all_samples = can_start_more = False
+
+        if can_start_more:
+            sample_records = next(sample_iterator, None)
+            if sample_records is None:
+                sample_iterator_exhausted = True
+                continue
+            if not isinstance(sample_records, list):
+                sample_records = [sample_records]
+
+            samples_to_run = [sr for sr in sample_records if prepare_sample(sr, counters)]
+            samples_by_bam_path = collections.OrderedDict()
+            for sr in samples_to_run:
+                samples_by_bam_path.setdefault(sr.original_bam_path, []).append(sr)
+
+            for batch in samples_by_bam_path.values():
+                cached_bam_path = get_cached_bam_path(region_cache, batch) if region_cache is not None else None
+                try:
+                    job = prepare_haplotype_caller_batch(batch, all_bam_output_dir=bam_output_dir,
+                                                         input_bam_path=cached_bam_path, scratch_dir=scratch_dir)
+                except Exception as e:
+                    logging.error("%s - error in prepare_haplotype_caller_batch: %s" % (batch[0].original_bam_path, e))
+                    traceback.print_exc()
+                    job = None
+
+                if job is None or job.hc_command_line is None:
+                    if cached_bam_path is not None:
+                        region_cache.release(cached_bam_path)
+                    continue
+
+                heartbeat = LeaseHeartbeat(Sample, [sr.id for _, sr, _, _ in job.samples_to_run],
+                                           CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES)
+                heartbeat.start()
+                launch_job(job, heartbeat, cached_bam_path)
             continue
 
+        if not running_jobs:
+            break
+
+        # wait for the next command to finish. Use a timeout so that Ctrl-C is handled in python2
+        try:
+            job_number, hc_result = hc_results.get(timeout=5)
+        except queue.Empty:
+            continue
+
+        job, heartbeat, job_started_time, cached_bam_path = running_jobs.pop(job_number)
+        new_retry_jobs = []
         try:
-            run_haplotype_caller(
-                    sr.chrom,
-                    sr.pos,
-                    sr.ref,
-                    sr.alt,
-                    sr.het_or_hom_or_hemi,
-                    original_bam_path=sr.original_bam_path,
-                    original_gvcf_path=sr.original_gvcf_path,
-                    sample_id=sr.sample_id,
-                    sample_i=sr.sample_i,
-                    all_bam_output_dir=bam_output_dir,
-                    only_choose_samples=False,
-            )
+            finish_haplotype_caller_batch(job, hc_result, new_retry_jobs)
         except Exception as e:
-            logging.error("%s-%s-%s-%s %s - error in run_haplotype_caller: %s" % (
-                sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, e))
+            # the leases are left to expire so that the samples are retried
+            logging.error("%s - error in finish_haplotype_caller_batch: %s" % (job.batch_bam_path, e))
             traceback.print_exc()
+        finally:
+            heartbeat.stop()
+            if cached_bam_path is not None:
+                region_cache.release(cached_bam_path)
+
+        # keep the leases of the samples that need another HC run alive until it's launched
+        for retry_job in new_retry_jobs:
+            retry_heartbeat = LeaseHeartbeat(Sample, [sr.id for _, sr, _, _ in retry_job.samples_to_run],
+                                             CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES)
+            retry_heartbeat.start()
+            retry_jobs.append((retry_job, retry_heartbeat))
+
+        job_runtime = (datetime.datetime.now() - job_started_time).total_seconds()
+        sample_runtimes.extend([job_runtime / len(job.samples_to_run)] * len(job.samples_to_run))
 
     logging.info(", ".join(["%s=%s" % (k, v) for k,v in sorted(counters.items(), key=lambda kv: kv[0])]),)
-    logging.info("generate_HC_bams finished.") # at %s:%s" % (chrom, pos))
+    if finished_all_samples:
+        logging.info("generate_HC_bams finished.")
+    else:
+        logging.info("generate_HC_bams stopped early.")  # detected by parallelize.py to release the interval
+
+    return finished_all_samples
+
+
+def prefetch_sample_batches(sample_iterator, prefetcher, num_batches_to_prefetch):
+    """Wraps a sample iterator to claim num_batches_to_prefetch batches of samples ahead of the one being processed,
+    and copy the regions of their original bams that HC will need into local bams in the background while HC is
+    running (see utils/bam_prefetcher.py). The local bam path is set as the staged_bam_path attribute of each returned
+    Sample record, or None if copying failed. The local bam is deleted when the next batch is requested.
+
+    The leases on claimed batches are renewed while they wait. If the iterator is closed early (eg. because of the
+    time limit), batches that were claimed ahead are unclaimed so other tasks can process them right away.
+
+    Args:
+        sample_iterator: Iterator that returns lists of Sample records (see create_sample_batch_iterator(..))
+        prefetcher: BamPrefetcher
+        num_batches_to_prefetch: how many batches to claim ahead
+    """
+    claimed_batches = collections.deque()  # (list of Sample records, LeaseHeartbeat)
+    previous_batch_key = None
+    try:
+        while True:
+            while len(claimed_batches) <= num_batches_to_prefetch:
+                batch = next(sample_iterator, None)
+                if batch is None:
+                    break
+                if not isinstance(batch, list):
+                    batch = [batch]
+
+                original_bam_path = None
+                try:
+                    original_bam_path = lookup_original_bam_path(batch[0].sample_id)
+                    prefetcher.prefetch(batch[0].id, original_bam_path, get_bam_regions(batch))
+                except Exception as e:
+                    logging.warning("%s - couldn't prefetch: %s" % (batch[0].sample_id, e))
+
+                for sr in batch:
+                    sr.staged_from_bam_path = original_bam_path
+
+                heartbeat = LeaseHeartbeat(Sample, [sr.id for sr in batch], CLAIM_LEASE_DURATION_MINUTES, CLAIM_HEARTBEAT_INTERVAL_MINUTES)
+                heartbeat.start()
+                claimed_batches.append((batch, heartbeat))
+
+            if previous_batch_key is not None:
+                prefetcher.release(previous_batch_key)
+                previous_batch_key = None
+
+            if not claimed_batches:
+                break
+
+            batch, heartbeat = claimed_batches.popleft()
+            heartbeat.stop()
+
+            staged_bam_path = prefetcher.get(batch[0].id)
+            for sr in batch:
+                sr.staged_bam_path = staged_bam_path
+
+            previous_batch_key = batch[0].id
+            yield batch
+    finally:
+        if previous_batch_key is not None:
+            prefetcher.release(previous_batch_key)
+
+        for batch, heartbeat in claimed_batches:
+            heartbeat.stop()
+            prefetcher.release(batch[0].id)
+            # these samples weren't processed, so their claims don't count as attempts
+            Sample.update(started=0, lease_expires=UNCLAIMED_LEASE_EXPIRATION,
+                          claim_attempts=Sample.claim_attempts - 1).where(
+                (Sample.id << [sr.id for sr in batch]) & (Sample.finished == 0)).execute()
+            logging.info("%s - unclaimed %s prefetched samples" % (batch[0].sample_id, len(batch)))
+
+
+def compute_num_hc_workers(max_workers=None):
+    """Returns how many HaplotypeCaller commands fit on this machine given its cpus, free memory, and the configured
+    HaplotypeCaller heap size.
+    """
+    memory_per_worker_gb = (HC_MAX_HEAP_SIZE_MB + HC_JVM_OVERHEAD_MB) / 1024.0
+    free_memory_gb = get_free_memory_gb()
+    num_workers = compute_num_workers(max_workers, multiprocessing.cpu_count(), free_memory_gb, memory_per_worker_gb)
+    logging.info("Using %s HaplotypeCaller workers (free memory: %s GB, memory per worker: %0.1f GB)" % (
+        num_workers, free_memory_gb, memory_per_worker_gb))
+
+    return num_workers
+
+
+def prepare_sample(sr, counters):
+    """Computes sample_i and the original bam path for the given claimed sample before running HC on it.
+
+    Args:
+        sr: Sample record
+        counters: dictionary of stats counters
+    Return:
+        True if HC should be run on this sample, or False if it should be skipped.
+    """
+    # print some stats
+    logging.info("-----")
+
+    counters["all_samples_gt"] += 1
+    if counters["all_samples_gt"] % 100 == 0:
+        logging.info(", ".join(["%s=%s" % (k, v) for k,v in sorted(counters.items(), key=lambda kv: kv[0])]),)
+        logging.info("-----")
+
+    # skip if sample has been processed already -- this should never happen
+    if sr.finished:
+        logging.info("%s-%s-%s-%s %s - already done - skipping.." % (
+            sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi))
+        counters[sr.het_or_hom_or_hemi+"_sample_already_done"] += 1
+        return False
+
+    # the previous attempts didn't record a result, eg. because of an exception that happens every time
+    if sr.claim_attempts > MAX_CLAIM_ATTEMPTS:
+        logging.info("%s-%s-%s-%s %s - claimed %s times without a result - giving up" % (
+            sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, sr.claim_attempts))
+        counters[sr.het_or_hom_or_hemi+"_sample_too_many_claim_attempts"] += 1
+        sr.finished = 1
+        hc_failed(ERROR_TOO_MANY_CLAIM_ATTEMPTS, "no result after %s attempts" % MAX_CLAIM_ATTEMPTS, sr)
+        return False
+
+    if sr.sample_i is None:
+        # sample_i is normally assigned in bulk by process_interval(..), so this only happens for samples that were
+        # added since then
+        assign_sample_indexes(Sample, get_variant_condition(Sample, sr), num_primary_samples=MAX_SAMPLES_TO_SHOW_PER_VARIANT)
+
+        sr.sample_i = Sample.get(Sample.id == sr.id).sample_i  # the 1st sample will have sample_i = 0, etc.
+
+        logging.info("%s-%s-%s-%s %s - computed sample_i: %s" % (
+            sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, sr.sample_i))
+
+    sr.original_bam_path = lookup_original_bam_path(sr.sample_id)  # recompute the original bam path in case it's changed
+    sr.save()  # also saves claim_seconds
+
+    if sr.sample_i >= MAX_SAMPLES_TO_SHOW_PER_VARIANT + BACKUP_SAMPLES_IN_CASE_OF_ERRORS:
+        logging.info("%s-%s-%s-%s %s - sample_i too large. Skipping: %s" % (
+            sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, sr.sample_i))
+        sr.delete_instance()
+        return False
+
+    return True
+
+
+def get_recent_sample_runtimes(n=1000):
+    """Returns a list of runtimes (in seconds) of the n most recently-created samples that were processed successfully"""
+    query = Sample.select(Sample.started_time, Sample.finished_time).where(
+        (Sample.finished == 1) & (Sample.hc_succeeded == 1)).order_by(Sample.id.desc()).limit(n)
+
+    return get_runtimes_in_seconds(query.tuples())
+
+
+def process_interval(chrom, start_pos, end_pos, bam_output_dir=BAM_OUTPUT_DIR, exit_after_minutes=None, batch_size=1,
+                     num_workers=1, prefetch=0, scratch_dir=None, use_gatk_workers=False, region_cache_gb=0,
+                     result_cache_dir=None, downsample_to_depth=None):
+    """Generates HC-reassembled bams for all unprocessed samples in the given genomic region.
+
+    This is the entry point used by parallelize.py --in-process, which calls it repeatedly from the same
+    python process so that module-level state (eg. the exac info table) is only loaded once.
+
+    Args:
+        chrom: chromosome
+        start_pos: integer 1-based inclusive start position of genomic region
+        end_pos: integer 1-based inclusive end position of genomic region
+        bam_output_dir: Top level output dir for all bams
+        exit_after_minutes: (optional - integer) after this many minutes, finish processing the current sample and exit
+        batch_size: run HC on up to this many variants of the same sample at once (see run_haplotype_caller_batch(..)).
+            If 1, samples are claimed one at a time, as before batching was added.
+        num_workers: run up to this many HC commands at the same time, or 0 to decide based on the machine's free
+            memory (see main_with_worker_pool(..))
+        prefetch: copy the bam regions of this many of the next samples into local bams while HC is running (see
+            prefetch_sample_batches(..)). Only used when num_workers is 1.
+        scratch_dir: node-local directory for HC's intermediate files and prefetched bams. If not specified,
+            intermediate files are written to bam_output_dir, and prefetched bams to the system temp dir.
+        use_gatk_workers: run HC commands in long-lived JVMs (see utils/gatk_worker.py)
+        region_cache_gb: keep up to this many GB of local bam region copies in scratch_dir (or the system temp dir),
+            so that they can be reused for other variants of the same sample (see utils/bam_region_cache.py). The
+            cache is reused by later process_interval(..) calls in the same process.
+        result_cache_dir: reuse bams that were already computed from the same inputs (eg. before the sample records
+            were reset) from this directory, and add new bams to it (see utils/result_cache.py)
+        downsample_to_depth: leave reads out of HC's input so that no position is covered by more than this many
+            reads (see utils/downsampling.py)
+    Return:
+        True if all samples in the region were processed.
+    """
+    if start_pos:
+        start_pos = start_pos - 1  # because start_pos is 1-based inclusive and fetch(..) doesn't include the start_pos
+
+    # fail before claiming any samples if the scratch dir can't be created, instead of failing every sample's HC run
+    if scratch_dir:
+        create_dir(scratch_dir)
+
+    # compute sample_i for all samples in the region at once, instead of with a separate query for each sample. Only
+    # the variants that have samples without sample_i are read, so this is cheap when the region was already started.
+    assign_sample_indexes(Sample, get_region_condition(chrom, start_pos, end_pos), num_primary_samples=MAX_SAMPLES_TO_SHOW_PER_VARIANT)
+
+    # samples that were added or reset without a lease aren't claimable until they have an expired one. Only those
+    # samples are updated, so this doesn't lock the region when there aren't any.
+    mark_unclaimed_records(Sample, get_region_condition(chrom, start_pos, end_pos))
+
+    if batch_size == 1:
+        sample_record_iterator = create_sample_record_iterator(chrom=chrom, start_pos=start_pos, end_pos=end_pos)
+    else:
+        sample_record_iterator = create_sample_batch_iterator(chrom=chrom, start_pos=start_pos, end_pos=end_pos, batch_size=batch_size)
+    if num_workers != 1:
+        num_workers = compute_num_hc_workers(num_workers or None)
+
+    # the workers are started once and then reused by later process_interval(..) calls in the same process
+    if use_gatk_workers:
+        start_gatk_workers(num_workers)
+
+    if result_cache_dir:
+        enable_result_cache(result_cache_dir)
+
+    if downsample_to_depth:
+        enable_downsampling(downsample_to_depth)
+
+    region_cache = get_bam_region_cache(scratch_dir, region_cache_gb) if region_cache_gb > 0 else None
+
+    if num_workers != 1:
+        return main_with_worker_pool(sample_iterator=sample_record_iterator, bam_output_dir=bam_output_dir,
+                                     num_workers=num_workers, exit_after_minutes=exit_after_minutes,
+                                     scratch_dir=scratch_dir, region_cache=region_cache)
+
+    if prefetch > 0:
+        from utils.bam_prefetcher import BamPrefetcher
+        prefetcher = BamPrefetcher(scratch_dir or tempfile.gettempdir(), region_cache=region_cache)
+        sample_record_iterator = prefetch_sample_batches(sample_record_iterator, prefetcher, prefetch)
+
+    try:
+        return main(sample_iterator=sample_record_iterator, bam_output_dir=bam_output_dir,
+                    exit_after_minutes=exit_after_minutes, scratch_dir=scratch_dir, region_cache=region_cache)
+    finally:
+        if prefetch > 0:
+            sample_record_iterator.close()  # unclaims samples that were claimed ahead
+            prefetcher.stop()  # otherwise each process_interval(..) call would leave a thread running
+
+
+_bam_region_cache = None
+
+def get_bam_region_cache(scratch_dir, region_cache_gb):
+    """Returns the BamRegionCache shared by all process_interval(..) calls in this process, creating it if needed"""
+    global _bam_region_cache
+    if _bam_region_cache is None:
+        from utils.bam_region_cache import BamRegionCache
+        _bam_region_cache = BamRegionCache(scratch_dir or tempfile.gettempdir(), max_bytes=int(region_cache_gb * 1024**3))
+    return _bam_region_cache
+
+
+def clear_bam_region_cache():
+    """Deletes the local bams in the BamRegionCache, if one was created"""
+    if _bam_region_cache is not None:
+        _bam_region_cache.clear()
 
 
 def create_sample_record_iterator(chrom=None, start_pos=None, end_pos=None):
-    """Iterate over sample records that are marked as not-yet-finished in the sample table
+    """Iterate over sample records that are marked as not-yet-finished in the sample table. Each record is claimed
+    (by setting started=1 and a lease) before it's returned.
 
     Args:
         chrom: chromosome
@@ -141,18 +610,18 @@ def create_sample_record_iterator(chrom=None, start_pos=None, end_pos=None):
         Sample records
     """
 
-    where_condition = (Sample.started == 0) & (Sample.finished == 0)
-    if chrom is not None:
-        where_condition = where_condition & (Sample.chrom == chrom)
-    if start_pos is not None:
-        where_condition = where_condition & (Sample.pos >= start_pos)
-    if end_pos is not None:
-        where_condition = where_condition & (Sample.pos <= end_pos)
+    region_condition = get_region_condition(chrom, start_pos, end_pos)
 
+    claim_started_time = time.time()
     while True:
-        # get the next Sample to process
+        # samples that aren't started, or whose lease expired because the worker processing them died, can be claimed
+        where_condition = is_claimable_sample()
+        if region_condition is not None:
+            where_condition = where_condition & region_condition
+
+        # get the next Sample to process, starting with the highest-priority ones (see utils/priorities.py)
         randomized_sample_num = random.randint(1, 1000)
-        unprocessed_samples = Sample.select().where(where_condition).limit(randomized_sample_num)
+        unprocessed_samples = Sample.select().where(where_condition).order_by(*get_priority_ordering(Sample)).limit(randomized_sample_num)
         unprocessed_samples_list = list(unprocessed_samples)
         if len(unprocessed_samples_list) == 0:
             logging.info("Finished all samples. Exiting..")
@@ -162,7 +631,7 @@ def create_sample_record_iterator(chrom=None, start_pos=None, end_pos=None):
         #sql, params = unprocessed_samples.sql()
         #logging.info("query: %s \n rows retreived %s" % ( (sql % tuple(params)), len(unprocessed_samples_list)))
 
-        current_sample = unprocessed_samples_list[-1]  # pick the last one
+        current_sample = pick_highest_priority_record(unprocessed_samples_list)
         logging.info("retrieving next sample id = %s: %s-%s-%s-%s %s" % (current_sample.id,
                                                                          current_sample.chrom,
                                                                          current_sample.pos,
@@ -170,34 +639,198 @@ def create_sample_record_iterator(chrom=None, start_pos=None, end_pos=None):
                                                                          current_sample.alt,
                                                                          current_sample.het_or_hom_or_hemi))
 
-        with db.atomic():
-            query = Sample.update(started=1).where( (Sample.id == current_sample.id) & where_condition )
-            rows_updated = query.execute()
-
-        #sql, params = query.sql()
-        #logging.info("query: %s \n rows updated: %s" % ( (sql % tuple(params)), rows_updated))
-
-        if rows_updated == 0:
+        if not claim_sample(current_sample, where_condition):
             sleep_interval = random.randint(1, 15)
             logging.info("%s-%s-%s-%s - sample claimed by another task. Skipping.. (sleep for %s sec)" % (
                 current_sample.chrom, current_sample.pos, current_sample.ref, current_sample.alt, sleep_interval))
             time.sleep(sleep_interval) # sleep for a random time interval to avoid constant lock contension
             continue
 
+        # includes the time spent on samples that were claimed by another task first
+        current_sample.claim_seconds = time.time() - claim_started_time
+
         yield current_sample
+        claim_started_time = time.time()
+
 
+def create_sample_batch_iterator(chrom=None, start_pos=None, end_pos=None, batch_size=1):
+    """Iterate over lists of claimed sample records, where each list contains not-yet-finished samples in the given
+    region that have the same sample_id (and so the same original bam), so that HC can be run on all of them at once.
+
+    Each list contains all samples whose variants are in the same exac calling interval as the first sample's
+    variant (eg. the alleles of a multi-allelic site, or nearby variants), since HC would be run on exactly the same
+    window for each of them. Then it's filled with other variants of the same sample up to batch_size.
+
+    Args:
+        chrom: chromosome
+        start_pos: integer 1-based inclusive start position of genomic region
+        end_pos: integer 1-based inclusive end position of genomic region
+        batch_size: max number of samples in each list, not counting samples with the same calling window as the
+            first one
+    Returns:
+        lists of Sample records
+    """
+    region_condition = get_region_condition(chrom, start_pos, end_pos)
+
+    for current_sample in create_sample_record_iterator(chrom=chrom, start_pos=start_pos, end_pos=end_pos):
+        batch = [current_sample]
+
+        where_condition = is_claimable_sample() & (Sample.sample_id == current_sample.sample_id)
+        if region_condition is not None:
+            where_condition = where_condition & region_condition
+
+        # claim samples that have the same calling window (see run_haplotype_caller(..)) as the current sample
+        try:
+            calling_interval = get_overlapping_calling_interval(current_sample.chrom, current_sample.pos)
+        except ValueError as e:
+            calling_interval = None  # run_haplotype_caller will record the error
+            logging.info("%s-%s-%s-%s - %s" % (current_sample.chrom, current_sample.pos, current_sample.ref, current_sample.alt, e))
+
+        if calling_interval is not None:
+            same_window_condition = where_condition & (Sample.chrom == calling_interval.chrom) & (
+                Sample.pos >= calling_interval.start) & (Sample.pos <= calling_interval.end)
+            for other_sample in Sample.select().where(same_window_condition).order_by(*get_priority_ordering(Sample)):
+                # samples claimed by another task in the meantime are just left out of the batch
+                if timed_claim_sample(other_sample, same_window_condition):
+                    batch.append(other_sample)
+
+        if len(batch) < batch_size:
+            other_samples = Sample.select().where(where_condition).order_by(*get_priority_ordering(Sample)).limit(batch_size - len(batch))
+            for other_sample in other_samples:
+                if timed_claim_sample(other_sample, where_condition):
+                    batch.append(other_sample)
+
+        if len(batch) > 1:
+            logging.info("%s - claimed %s variants" % (current_sample.sample_id, len(batch)))
+        yield batch
+
+
+def is_claimable_sample():
+    """Returns a where-clause that selects samples that can be claimed - see is_claimable(..). Backup samples are only
+    claimable once they've been activated (see utils/sample_indexes.py).
+    """
+    return is_claimable(Sample) & (Sample.is_inactive_backup == 0)
+
+
+def claim_sample(sample, where_condition):
+    """Claims the given sample by setting started=1 and a lease, and counting the attempt in claim_attempts.
+
+    Args:
+        sample: Sample record
+        where_condition: the sample is only claimed if it still matches this where-clause
+    Return:
+        True if the sample was claimed, or False if it was claimed by another task first
+    """
+    with _readviz_db.atomic():
+        query = Sample.update(
+            started=1,
+            lease_expires=compute_lease_expiration(CLAIM_LEASE_DURATION_MINUTES),
+            claim_attempts=Sample.claim_attempts + 1,
+        ).where( (Sample.id == sample.id) & where_condition )
+        rows_updated = query.execute()
+
+    #sql, params = query.sql()
+    #logging.info("query: %s \n rows updated: %s" % ( (sql % tuple(params)), rows_updated))
+
+    if rows_updated == 0:
+        return False
+
+    sample.started = 1
+    sample.claim_attempts = (sample.claim_attempts or 0) + 1
+    return True
+
+
+def timed_claim_sample(sample, where_condition):
+    """Calls claim_sample(..) and records how long it took in sample.claim_seconds"""
+    claim_started_time = time.time()
+    claimed = claim_sample(sample, where_condition)
+    sample.claim_seconds = time.time() - claim_started_time
+    return claimed
+
+
+def get_region_condition(chrom=None, start_pos=None, end_pos=None):
+    """Returns a where-clause that selects samples in the given region, or None if no region is specified"""
+    region_condition = None
+    if chrom is not None:
+        region_condition = (Sample.chrom == chrom)
+    if start_pos is not None:
+        region_condition = (Sample.pos >= start_pos) if region_condition is None else region_condition & (Sample.pos >= start_pos)
+    if end_pos is not None:
+        region_condition = (Sample.pos <= end_pos) if region_condition is None else region_condition & (Sample.pos <= end_pos)
+
+    return region_condition
+
+
+def add_process_interval_args(p):
+    """Adds the command line options for process_interval(..)'s keyword args (other than exit_after_minutes) to the
+    given argparse parser. See get_process_interval_kwargs(..)"""
+    p.add_argument("--bam-output-dir", help="Where to output HC-reassembled bams", default=BAM_OUTPUT_DIR)
+    p.add_argument("--batch-size", help="Run HaplotypeCaller on up to this many variants of the same sample at once, "
+        "to avoid paying HaplotypeCaller's startup cost for every variant. Variants of the same sample that have the "
+        "same calling window are always run together.", default=1, type=int)
+    p.add_argument("--prefetch", help="While HaplotypeCaller is running, copy the needed regions of this many of the "
+        "next samples' bams into local bams. HaplotypeCaller then runs on the local copies.", default=0, type=int)
+    p.add_argument("--scratch-dir", help="Node-local directory for HaplotypeCaller's intermediate files and "
+        "prefetched bams, to avoid writing them to --bam-output-dir on shared storage. Created if it doesn't exist")
+    p.add_argument("--gatk-workers", help="Run HaplotypeCaller commands in long-lived JVMs (see java/GatkWorker.java) "
+        "instead of starting a new JVM for each one", action="store_true")
+    p.add_argument("--region-cache-gb", help="Keep up to this many GB of local copies of bam regions in --scratch-dir, "
+        "and reuse them for other variants of the same sample instead of reading the original bam again. 0 disables "
+        "the cache", default=0, type=float)
+    p.add_argument("--result-cache-dir", help="Save each reassembled bam under a digest of its inputs (bam, calling "
+        "window, GATK jar and args, variant) in this directory, and reuse it instead of re-running HaplotypeCaller "
+        "when a reset or rebuilt sample record has the same inputs")
+    p.add_argument("--downsample-to-depth", help="Before running HaplotypeCaller, leave reads out of its input so that "
+        "no position is covered by more than this many reads. Reads are chosen deterministically for each sample and "
+        "variant, preferring reads that span the variant. If the GVCF check fails on every window, HC is run once "
+        "more on all reads before the sample is failed. 0 disables downsampling", default=0, type=int)
+    p.add_argument("--num-workers", help="Run up to this many HaplotypeCaller commands at the same time. 0 means as "
+        "many as fit into this machine's cpus and free memory", default=1, type=int)
+
+
+def get_process_interval_kwargs(args):
+    """Returns the process_interval(..) keyword args for options added by add_process_interval_args(..)"""
+    return {
+        "bam_output_dir": args.bam_output_dir,
+        "batch_size": args.batch_size,
+        "num_workers": args.num_workers,
+        "prefetch": args.prefetch,
+        "scratch_dir": args.scratch_dir,
+        "use_gatk_workers": args.gatk_workers,
+        "region_cache_gb": args.region_cache_gb,
+        "result_cache_dir": args.result_cache_dir,
+        "downsample_to_depth": args.downsample_to_depth,
+    }
+
+
+def parse_process_interval_args(argv):
+    """Parses the options that follow process_interval on the parallelize.py --in-process command line.
+
+    Return:
+        dict of process_interval(..) keyword args
+    """
+    p = argparse.ArgumentParser(prog="process_interval")
+    add_process_interval_args(p)
+    return get_process_interval_kwargs(p.parse_args(argv))
+
+
+def cleanup_process_interval():
+    """Stops the GATK workers and deletes the bam region cache that process_interval(..) calls in this process
+    shared. parallelize.py --in-process calls this after its last interval."""
+    stop_gatk_workers()
+    clear_bam_region_cache()
 
 
 if __name__ == "__main__":
     p = configargparse.getArgumentParser()
-    p.add("--bam-output-dir", help="Where to output HC-reassembled bams", default=BAM_OUTPUT_DIR)
     p.add("--chrom", help="If specified, only process this chromosome", action="append")
     p.add("--start-pos", help="If specified, only process region in this interval (1-based inclusive coordinates)", type=int)
     p.add("--end-pos", help="If specified, only process region in this interval (1-based inclusive coordinates)", type=int, default=10**10)
 
     p.add("--exit-after", metavar="MINUTES", help="This many minutes after starting, finish processing "
                                                   "the current sample and then exit", default=60*1, type=float)
-
+    p.add("--profile", help="Profile this run with pyinstrument and print the results at the end", action="store_true")
+    add_process_interval_args(p)
     args = p.parse_args()
 
     logging.info("Running with settings: ")
@@ -210,21 +843,13 @@ if __name__ == "__main__":
         if not key.startswith("_"):
             logging.info("%s=%s" % (key, utils.constants.__dict__[key]))
 
-    if args.start_pos:
-        args.start_pos = args.start_pos - 1  # because start_pos is 1-based inclusive and fetch(..) doesn't include the start_pos
-
     # db = init_db()  # commented out to avoid overloading database initially.
     db = _readviz_db
 
-    try:
+    profiler = None
+    if args.profile:
         from pyinstrument import Profiler
-        profiling_enabled = True
-    except:
-        profiling_enabled = False
-
-    profiling_enabled = False
-    if profiling_enabled:
-        profiler = Profiler() # or Profiler(use_signal=False), see below
+        profiler = Profiler()
         profiler.start()
 
     # process the samples
@@ -235,11 +860,19 @@ if __name__ == "__main__":
         logging.info("chrom args: %s" % str(args.chrom))
         chromosomes = args.chrom
 
+    if args.scratch_dir:
+        try:
+            create_dir(args.scratch_dir)
+        except OSError as e:
+            p.error("Couldn't create --scratch-dir %s: %s" % (args.scratch_dir, e))
+
     for chrom in chromosomes:
         logging.info("Processing chrom: %s" % chrom)
-        sample_record_iterator = create_sample_record_iterator(chrom=chrom, start_pos=args.start_pos, end_pos=args.end_pos)
-        main(sample_iterator=sample_record_iterator, bam_output_dir=args.bam_output_dir, exit_after_minutes=args.exit_after)
+        process_interval(chrom, args.start_pos, args.end_pos, exit_after_minutes=args.exit_after,
+                         **get_process_interval_kwargs(args))
+
+    cleanup_process_interval()
 
-    if profiling_enabled:
+    if profiler is not None:
         profiler.stop()
         print(profiler.output_text(unicode=False, color=True))
@@ -0,0 +1,18 @@
+"""
+Sets sample_i for all records in the sample table that don't have it yet (eg. right after the table is populated, or
+after reset_failed_db_records.py). compute_HC_bams_from_sample_table.py also does this for each region it processes.
+Backup samples are marked as inactive, so that HC is only run on them if it fails on enough of the variant's other
+samples.
+"""
+
+from utils.constants import MAX_SAMPLES_TO_SHOW_PER_VARIANT
+
+from utils.database import Sample
+from utils.sample_indexes import assign_sample_indexes
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+
+for chrom in [row[0] for row in Sample.select(Sample.chrom).distinct().tuples()]:
+    logging.info("chrom %s" % chrom)
+    assign_sample_indexes(Sample, Sample.chrom == chrom, num_primary_samples=MAX_SAMPLES_TO_SHOW_PER_VARIANT)
@@ -0,0 +1,18 @@
+"""
+Sets the priority of each unfinished record in the sample table so that samples in important genes
+(scripts/data/top_intervals.txt) are claimed first by compute_HC_bams_from_sample_table.py and TCGA samples last.
+The priorities of parallelize.py intervals tables are assigned when the table is created (or with --assign-priorities).
+"""
+
+from utils.constants import TCGA_NEW_BAM_PATHS
+from utils.database import Sample
+from utils.priorities import read_top_intervals, read_tcga_sample_ids, assign_sample_priorities
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+
+assign_sample_priorities(Sample, read_top_intervals(), read_tcga_sample_ids(TCGA_NEW_BAM_PATHS))
+
+for priority, count in Sample.select(Sample.priority, Sample.id.count()).where(Sample.finished == 0).group_by(
+        Sample.priority).order_by(Sample.priority).tuples():
+    logging.info("priority %s: %s unfinished samples" % (priority, count))
@@ -0,0 +1,165 @@
+"""
+Prints throughput, per-chromosome completion, runtime distribution, error breakdown and ETA for a parallelize.py
+intervals table and/or the sample table. All stats are computed with aggregate queries so that this is fast even
+for tables with millions of rows.
+
+Example:
+
+python scripts/print_progress_report.py --intervals-table python2_pipeline_i1000000 --samples
+"""
+
+import argparse
+from mysql.connector import MySQLConnection
+from utils.constants import DB_HOST, DB_PORT, DB_USER
+from utils.runtime_prediction import compute_eta
+from utils.stage_timing import STAGES
+
+# describes how to compute stats for each kind of table
+INTERVALS_TABLE_COLUMNS = {
+    "unit": "intervals",
+    "started_time": "started_date",
+    "finished_time": "finished_date",
+    "error_code": "error_code",
+    "is_error": "error_code != 0",
+    "is_remaining": "finished=0 and error_code=0",
+}
+
+SAMPLE_TABLE_COLUMNS = {
+    "unit": "samples",
+    "started_time": "started_time",
+    "finished_time": "finished_time",
+    "error_code": "hc_error_code",
+    # HC crashes leave finished=0, so errors are identified by their error code
+    "is_error": "hc_error_code is not null and hc_error_code != 0",
+    # inactive backup samples are only run if they're activated (see utils/sample_indexes.py)
+    "is_remaining": "finished=0 and (hc_error_code is null or hc_error_code = 0) and is_inactive_backup=0",
+}
+
+
+p = argparse.ArgumentParser()
+p.add_argument("--intervals-table", help="Name of a parallelize.py intervals table (eg. python2_pipeline_i1000000)")
+p.add_argument("--samples", help="Print a report for the sample table", action="store_true")
+p.add_argument("--throughput-window", metavar="MINUTES", help="Compute throughput based on units of work that "
+    "finished in this many most recent minutes", type=int, default=60)
+args = p.parse_args()
+
+if not args.intervals_table and not args.samples:
+    p.error("--intervals-table and/or --samples must be specified")
+
+conn = MySQLConnection(user=DB_USER, host=DB_HOST, port=DB_PORT, database='exac_readviz')
+c = conn.cursor(buffered=True)
+
+
+def run_query(q):
+    c.execute(q)
+    return c.fetchall()
+
+
+def format_hours(hours):
+    if hours is None:
+        return "unknown"
+    if hours < 48:
+        return "%0.1f hours" % hours
+    return "%0.1f days" % (hours / 24.0)
+
+
+def print_report(table, columns):
+    q = dict(columns, table=table, window=args.throughput_window)
+    q["runtime"] = "TIMESTAMPDIFF(SECOND, %(started_time)s, %(finished_time)s)" % q
+
+    print("===== %(table)s =====" % q)
+
+    total, finished, errors, remaining, in_progress = run_query(
+        "select count(*), sum(finished=1), sum(%(is_error)s), sum(%(is_remaining)s), "
+        "sum(started=1 and %(is_remaining)s and lease_expires >= NOW()) from %(table)s" % q)[0]
+    print("%s %s total: %s finished, %s failed, %s remaining (%s in progress)" % (
+        total, q["unit"], finished, errors, remaining, in_progress))
+
+    # throughput and ETA, which also uses the avg runtime of the most recent window
+    (finished_in_window,) = run_query(
+        "select count(*) from %(table)s where finished=1 and %(finished_time)s >= NOW() - INTERVAL %(window)s MINUTE" % q)[0]
+    (min_runtime, avg_runtime, max_runtime, recent_avg_runtime) = run_query(
+        "select min(%(runtime)s), avg(%(runtime)s), max(%(runtime)s), "
+        "avg(if(%(finished_time)s >= NOW() - INTERVAL %(window)s MINUTE, %(runtime)s, NULL)) "
+        "from %(table)s where finished=1 and %(finished_time)s >= %(started_time)s" % q)[0]
+    throughput_per_hour, eta_hours, eta_hours_from_runtime = compute_eta(
+        remaining, finished_in_window, args.throughput_window, in_progress, recent_avg_runtime)
+    print("throughput: %0.1f %s per hour (%s finished in the last %s minutes)" % (
+        throughput_per_hour, q["unit"], finished_in_window, args.throughput_window))
+
+    # runtime distribution as a histogram with power-of-2 bins, plus the runtimes of the most recent window
+    print("runtime (seconds): min %s, avg %s, max %s, avg in last %s minutes %s" % (
+        min_runtime, avg_runtime, max_runtime, args.throughput_window, recent_avg_runtime))
+
+    for bin_i, count in run_query(
+            "select floor(log2(greatest(1, %(runtime)s))) as bin, count(*) from %(table)s "
+            "where finished=1 and %(finished_time)s >= %(started_time)s group by bin order by bin" % q):
+        print("   %6d - %6d seconds: %s" % (2**int(bin_i), 2**(int(bin_i) + 1), count))
+
+    # errors
+    for error_code, count in run_query(
+            "select %(error_code)s, count(*) from %(table)s where %(is_error)s "
+            "group by %(error_code)s order by count(*) desc" % q):
+        print("error code %s: %s %s (%0.2f%% of finished or failed)" % (
+            error_code, count, q["unit"], 100.0 * count / max(1, int(finished or 0) + int(errors or 0))))
+
+    # ETA at current concurrency
+    print("ETA based on throughput: %s" % format_hours(eta_hours))
+    if eta_hours_from_runtime is not None:
+        print("ETA based on %s in progress and recent avg runtime: %s" % (
+            in_progress, format_hours(eta_hours_from_runtime)))
+
+    # per-chromosome completion
+    for chrom, chrom_total, chrom_finished, chrom_errors in run_query(
+            "select chrom, count(*), sum(finished=1), sum(%(is_error)s) from %(table)s "
+            "group by chrom order by chrom" % q):
+        print("   chr%s: %s finished, %s failed out of %s %s (%0.1f%% done)" % (
+            chrom, chrom_finished, chrom_errors, chrom_total, q["unit"],
+            100.0 * int(chrom_finished) / max(1, int(chrom_total))))
+
+
+def print_stage_timing_report(table, window_minutes=None):
+    """Prints how much of the processing time of successfully-finished samples was spent in each stage (see
+    utils/stage_timing.py), overall and by genotype.
+
+    Args:
+        table: sample table name
+        window_minutes: if specified, only include samples that finished in this many most recent minutes
+    """
+    where = "finished=1 and hc_succeeded=1 and hc_seconds is not null"
+    if window_minutes:
+        where += " and finished_time >= NOW() - INTERVAL %s MINUTE" % window_minutes
+
+    sums = ", ".join("sum(%s_seconds)" % stage for stage in STAGES)
+    for group_by in (None, "het_or_hom_or_hemi"):
+        select = "%s, " % group_by if group_by else "'all', "
+        q = "select %scount(*), %s, sum(gatk_runtime_seconds) from %s where %s" % (select, sums, table, where)
+        if group_by:
+            q += " group by %s order by %s" % (group_by, group_by)
+
+        for row in run_query(q):
+            group, count, stage_sums, gatk_runtime_sum = row[0], row[1], row[2:2+len(STAGES)], row[-1]
+            if not count:
+                continue
+            total = sum(float(v or 0) for v in stage_sums)
+            print("stage timing (%s%s): %s samples, avg %0.1f seconds per sample" % (
+                group, ", last %s minutes" % window_minutes if window_minutes else "", count, total / count))
+            for stage, stage_sum in zip(STAGES, stage_sums):
+                stage_sum = float(stage_sum or 0)
+                print("   %20s: avg %8.2f seconds (%5.1f%%)" % (stage, stage_sum / count, 100.0 * stage_sum / max(total, 1e-9)))
+
+            # the difference between HC's wall time and the runtime GATK reports is mostly JVM startup and GATK
+            # initialization
+            if gatk_runtime_sum is not None:
+                print("   %20s: avg %8.2f seconds, so avg HC overhead is %0.2f seconds" % (
+                    "gatk reported", float(gatk_runtime_sum) / count,
+                    (float(stage_sums[STAGES.index("hc")] or 0) - float(gatk_runtime_sum)) / count))
+
+
+if args.intervals_table:
+    print_report(args.intervals_table, INTERVALS_TABLE_COLUMNS)
+
+if args.samples:
+    print_report("sample", SAMPLE_TABLE_COLUMNS)
+    print_stage_timing_report("sample")
+    print_stage_timing_report("sample", args.throughput_window)
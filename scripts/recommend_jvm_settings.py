@@ -0,0 +1,82 @@
+"""
+Prints the distribution of peak memory, cpu utilization and I/O of previous HaplotypeCaller (or Picard) runs from the
+ChildProcessUsage table, and recommends a JVM heap size (HC_MAX_HEAP_SIZE_MB in utils/constants.py) and how many
+commands to run at the same time on a node (compute_HC_bams_from_sample_table.py --num-workers).
+
+The heap size is based on runs that started their own JVM. For runs in a long-lived GATK worker
+(compute_HC_bams_from_sample_table.py --gatk-workers), the recorded peak memory is the worker's peak over all the
+commands it ran so far, so it's shown separately and not used for the recommendation.
+
+Example:
+
+python scripts/recommend_jvm_settings.py --program HaplotypeCaller --node-memory-gb 60 --num-cpus 16
+"""
+
+import argparse
+import logging
+import multiprocessing
+
+from utils.constants import HC_MAX_HEAP_SIZE_MB, HC_JVM_OVERHEAD_MB
+from utils.database import ChildProcessUsage
+from utils.load_aware_concurrency import get_free_memory_gb
+from utils.resource_usage import recommend_jvm_settings
+from utils.runtime_prediction import compute_percentile
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+
+p = argparse.ArgumentParser()
+p.add_argument("--program", help="ChildProcessUsage.program to use", default="HaplotypeCaller")
+p.add_argument("--node-memory-gb", help="Memory available for the commands on each node. Defaults to this "
+                                        "machine's free memory", type=float)
+p.add_argument("--num-cpus", help="Number of cpus on each node. Defaults to this machine's", type=int)
+p.add_argument("--percentile", help="Size the heap so that runs at this percentile of peak memory fit",
+               type=float, default=99)
+p.add_argument("--safety-margin", help="Fraction to add to the peak memory percentile", type=float, default=0.25)
+p.add_argument("-n", help="Use the n most recent runs", type=int, default=10000)
+args = p.parse_args()
+
+node_memory_gb = args.node_memory_gb or get_free_memory_gb()
+num_cpus = args.num_cpus or multiprocessing.cpu_count()
+if node_memory_gb is None:
+    p.error("Couldn't determine this machine's free memory. Please specify --node-memory-gb")
+
+rows = list(ChildProcessUsage.select(
+    ChildProcessUsage.wall_seconds, ChildProcessUsage.cpu_seconds, ChildProcessUsage.peak_rss_mb,
+    ChildProcessUsage.read_mb, ChildProcessUsage.write_mb, ChildProcessUsage.ran_in_worker,
+).where(
+    (ChildProcessUsage.program == args.program) & ChildProcessUsage.peak_rss_mb.is_null(False)
+).order_by(ChildProcessUsage.id.desc()).limit(args.n).tuples())
+
+if not rows:
+    p.error("No %s runs found in the %s table" % (args.program, ChildProcessUsage._meta.db_table))
+
+peak_rss_mb_values = [row[2] for row in rows if not row[5]]
+worker_peak_rss_mb_values = [row[2] for row in rows if row[5]]
+cpu_utilization_values = [row[1] / row[0] for row in rows if row[0]]
+
+if not peak_rss_mb_values:
+    p.error("All %s runs found ran in GATK workers, so their peak memory isn't per command. Run some samples without "
+            "--gatk-workers first" % args.program)
+
+print("%s runs: %s (%s in GATK workers)" % (args.program, len(rows), len(worker_peak_rss_mb_values)))
+for label, values in (
+        ("peak RSS (MB)", peak_rss_mb_values),
+        ("worker peak RSS (MB)", worker_peak_rss_mb_values),
+        ("cpu utilization", cpu_utilization_values),
+        ("wall time (seconds)", [row[0] for row in rows]),
+        ("read (MB)", [row[3] for row in rows]),
+        ("written (MB)", [row[4] for row in rows])):
+    if values:
+        print("   %20s: %s" % (label, ", ".join("p%s=%0.2f" % (percentile, compute_percentile(values, percentile))
+                                                for percentile in (50, 90, 99, 100))))
+
+recommendation = recommend_jvm_settings(peak_rss_mb_values, cpu_utilization_values or [1.0], node_memory_gb, num_cpus,
+                                        HC_JVM_OVERHEAD_MB, percentile=args.percentile, safety_margin=args.safety_margin)
+
+print("node: %0.1f GB memory, %s cpus" % (node_memory_gb, num_cpus))
+print("current heap size: %s MB. Recommended: %s MB (p%s peak RSS %0.0f MB + %d%% - %s MB JVM overhead)" % (
+    HC_MAX_HEAP_SIZE_MB, recommendation["max_heap_mb"], args.percentile, recommendation["peak_rss_mb_percentile"],
+    100 * args.safety_margin, HC_JVM_OVERHEAD_MB))
+print("recommended commands per node: %s (%s fit in memory, %s fit in cpus at %0.2f cpus per command)" % (
+    recommendation["num_concurrent"], recommendation["num_concurrent_by_memory"],
+    recommendation["num_concurrent_by_cpu"], recommendation["avg_cpu_utilization"]))
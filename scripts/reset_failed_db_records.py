@@ -25,7 +25,6 @@ reset_unfinished_samples_in_finished_chroms = 0
 run_stat_queries = 0
 reset_unfinished_samples_in_finished_chroms = 0
 set_intervals_where_all_contained_variants_have_finished = 0
-reset_unfinished_intervals_in_important_genes = 0
 reset_samples_with_original_bams_marked_missing_due_to_transient_error = 0
 
 # set flags to execute particular sections of code
@@ -129,7 +128,7 @@ if reset_samples_with_original_bams_marked_missing_due_to_transient_error:
     found_bam_paths = tuple([p[0] for p in all_original_bam_paths if os.path.isfile(p[0])])
     print("Of these, %d actually exist on disk. Reset records with missing-bam errors to finished=0 for bams in this list" % len(found_bam_paths))
     if found_bam_paths:
-        run_query("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL "
+        run_query("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL, claim_attempts=0 "
                   "where hc_error_code=1000 and original_bam_path IN %s" % str(found_bam_paths).replace(',)', ')').replace("u'", "'"))
 
 if reset_variants_with_transient_errors:
@@ -153,28 +152,6 @@ FINISHED_CHROMS = list(map(str, [12,14,15,7,"X"])) #21,22,3,4,5,6,7,8,9, 'X','Y'
 FINISHED_CHROMS_STRING = str(tuple(map(str, FINISHED_CHROMS))).replace(",)", ")") #
 
 
-# reset unfinished intervals not in top genes and not in genomic regions
-if reset_unfinished_intervals_in_important_genes:
-    print("=== reset_unfinished_intervals_in_important_genes ===")
-    print("Reset intervals in important genes")
-    sql_is_overlapping = []
-    with open(os.path.join(os.path.abspath(os.path.dirname(__file__)),  "data/top_intervals.txt")) as f:
-        for line in f:
-            i_name, i_chrom, i_start, i_end = line.strip("\n").split("\t")
-            sql_is_overlapping.append( "(chrom='%(i_chrom)s' and start_pos <= %(i_end)s and end_pos>=%(i_start)s )" % locals() )
-            if len(sql_is_overlapping) > 300:
-                break
-
-    run_query(("select * from " + INTERVALS_TABLE +
-               "where finished=0 and ( %s )") % " or ".join(sql_is_overlapping))
-
-    # enable intervals that are overlapping the intervals of interest
-    print("Reset intervals overlapping intervals of interest")
-    run_query(("update " + INTERVALS_TABLE + " set job_id=NULL, comments=NULL, task_id=NULL, unique_id=NULL "
-               "where (job_id is NULL or job_id = -1 ) and finished=0 and ( %s )") % " or ".join(sql_is_overlapping))
-
-
-
 if run_stat_queries or set_intervals_where_all_contained_variants_have_finished or reset_intervals_that_contain_unfinished_variants or reset_intervals_that_contain_unfinished_samples:
     """
     +---------------------+--------------+------+-----+---------+----------------+
@@ -277,7 +254,7 @@ if reset_variants_with_bams_in_db_but_not_on_disk:
                 run_query("update variant as v "
                           "set v.finished=0, v.comments=NULL, n_available_samples=NULL, n_expected_samples=NULL, readviz_bam_paths=NULL "
                           "where chrom='%s' and pos=%s and ref='%s' and alt='%s' and het_or_hom_or_hemi='%s' " % t[1:])
-                run_query("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL "
+                run_query("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL, claim_attempts=0 "
                           "where chrom='%s' and pos=%s and ref='%s' and alt='%s' and het_or_hom_or_hemi='%s' " % t[1:])
 
 if reset_variants_that_contain_unfinished_samples:
@@ -341,11 +318,11 @@ if reset_intervals_that_contain_unfinished_variants:
         #            "error_code=500, error_message=NULL where finished=0 and started_date <")
 
 if reset_samples_with_transient_error:
-        run_query(("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL "
+        run_query(("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL, claim_attempts=0 "
                    "where hc_error_code >= 2000 and hc_error_code < 3000 and chrom in %(FINISHED_CHROMS_STRING)s") % locals())
 
 if reset_unfinished_samples_in_finished_chroms:
-    run_query("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL "
+    run_query("update sample set started=0, started_time=NULL, finished=0, finished_time=NULL, hc_succeeded=0, hc_error_text=NULL, hc_error_code=NULL, comments=NULL, claim_attempts=0 "
               "where chrom in %(FINISHED_CHROMS_STRING)s and started in (0, 1) and finished=0" % locals())
 
 
@@ -388,7 +365,7 @@ if reset_intervals_that_contain_unfinished_samples:
             end_pos = i[2]
             run_query(("update %(INTERVALS_TABLE)s "
                        "set job_id=null, task_id=null, unique_id=null, started=0, started_date=null, finished=0, finished_date=null, "
-                       "error_code=0, error_message=null, priority=null, username=null, machine_hostname=null, machine_average_load=null, comments=null " 
+                       "error_code=0, error_message=null, username=null, machine_hostname=null, machine_average_load=null, comments=null " 
                        "where chrom='%(chrom)s' and start_pos=%(start_pos)s and end_pos=%(end_pos)s") % locals())
 
         #print_query("update python3_4_generate_HC_bams_py_i200 set "
@@ -401,14 +378,14 @@ if reset_intervals_that_had_error_code:
     print("=== reset_intervals_that_had_error_code ===")
     run_query("update " + INTERVALS_TABLE +
               "set job_id=null, task_id=null, unique_id=null, started=0, started_date=null, finished=0, finished_date=null, "
-              "error_code=0, error_message=null, priority=null, username=null, machine_hostname=null, machine_average_load=null, comments=null " 
+              "error_code=0, error_message=null, username=null, machine_hostname=null, machine_average_load=null, comments=null " 
               "where error_code > 0")
 
 if reset_unfinished_intervals_to_clear_job_id:
     print("=== reset_unfinished_intervals_to_clear_job_id ===")
     run_query("update " + INTERVALS_TABLE +
               "set job_id=null, task_id=null, unique_id=null, started=0, started_date=null, finished=0, finished_date=null, "
-              "error_code=0, error_message=null, priority=null, username=null, machine_hostname=null, machine_average_load=null, comments=null " 
+              "error_code=0, error_message=null, username=null, machine_hostname=null, machine_average_load=null, comments=null " 
               "where finished=0")
 
 
@@ -0,0 +1,76 @@
+"""
+Replays the interval runtimes from a finished parallelize.py intervals table to predict the makespan and wasted
+compute for different values of --num-jobs, --interval-size and EXIT_UGER_JOB_AFTER_N_HOURS (see
+utils/schedule_simulator.py for the model).
+
+Example:
+
+python scripts/simulate_schedule.py --intervals-table python2_pipeline_i1000000 --num-jobs 500 1000 2000 \
+    --interval-size 200 1000 --exit-after-hours 0.5 1 2
+"""
+
+import argparse
+import itertools
+from mysql.connector import MySQLConnection
+from utils.constants import DB_HOST, DB_PORT, DB_USER, EXIT_UGER_JOB_AFTER_N_HOURS, \
+    UGER_SHORT_QUEUE_TIME_LIMIT_HOURS, CLAIM_LEASE_DURATION_MINUTES
+from utils.schedule_simulator import retile_interval_runtimes, simulate_schedule
+
+p = argparse.ArgumentParser()
+p.add_argument("--intervals-table", help="Name of a finished parallelize.py intervals table", required=True)
+p.add_argument("-n", "--num-jobs", help="Candidate numbers of array job tasks", type=int, nargs="+", required=True)
+p.add_argument("-isize", "--interval-size", help="Candidate max interval sizes. If not specified, the table's "
+    "intervals are used as-is", type=int, nargs="+")
+p.add_argument("--exit-after-hours", help="Candidate values of EXIT_UGER_JOB_AFTER_N_HOURS", type=float, nargs="+",
+    default=[EXIT_UGER_JOB_AFTER_N_HOURS])
+p.add_argument("--time-limit-hours", help="Queue time limit", type=float, default=UGER_SHORT_QUEUE_TIME_LIMIT_HOURS)
+p.add_argument("--per-interval-overhead", metavar="SECONDS", help="Part of each interval's runtime that doesn't "
+    "depend on its size (eg. process startup)", type=float, default=0)
+p.add_argument("--claim-seconds", help="How long it takes to claim an interval", type=float, default=1.0)
+p.add_argument("--resubmit-delay", metavar="SECONDS", help="How long it takes for a replacement task to start",
+    type=float, default=60)
+p.add_argument("--seed", help="Random seed", type=int, default=0)
+args = p.parse_args()
+
+conn = MySQLConnection(user=DB_USER, host=DB_HOST, port=DB_PORT, database='exac_readviz')
+c = conn.cursor(buffered=True)
+
+c.execute("select chrom, start_pos, end_pos, TIMESTAMPDIFF(SECOND, started_date, finished_date) from %s "
+          "where finished=1 and finished_date >= started_date order by chrom, start_pos" % args.intervals_table)
+intervals = [{"chrom": chrom, "start_pos": int(start_pos), "end_pos": int(end_pos), "runtime": float(runtime)}
+             for chrom, start_pos, end_pos, runtime in c.fetchall()]
+
+c.execute("select count(*) from %s where finished=0" % args.intervals_table)
+num_unfinished = c.fetchone()[0]
+print("Loaded runtimes of %s finished intervals from %s (%s unfinished intervals are left out)" % (
+    len(intervals), args.intervals_table, num_unfinished))
+
+print("\t".join(["num_jobs", "interval_size", "exit_after_hours", "num_intervals", "makespan_hours", "task_hours",
+                 "useful_hours", "wasted_hours", "wasted_percent", "num_killed", "num_collisions", "num_tasks",
+                 "num_never_finish"]))
+
+for interval_size in (args.interval_size or [None]):
+    if interval_size is None:
+        runtimes = [i["runtime"] for i in intervals]
+    else:
+        runtimes = retile_interval_runtimes(intervals, interval_size, args.per_interval_overhead)
+
+    for num_jobs, exit_after_hours in itertools.product(args.num_jobs, args.exit_after_hours):
+        result = simulate_schedule(runtimes, num_jobs,
+            time_limit_seconds=args.time_limit_hours*3600,
+            exit_after_seconds=exit_after_hours*3600,
+            claim_seconds=args.claim_seconds,
+            lease_seconds=CLAIM_LEASE_DURATION_MINUTES*60,
+            resubmit_delay_seconds=args.resubmit_delay,
+            seed=args.seed)
+
+        wasted_seconds = result.killed_seconds + result.collision_seconds
+        print("\t".join(map(str, [
+            num_jobs, interval_size or "as-is", exit_after_hours, len(runtimes),
+            "%0.1f" % (result.makespan_seconds / 3600.0),
+            "%0.1f" % (result.task_seconds / 3600.0),
+            "%0.1f" % (result.useful_seconds / 3600.0),
+            "%0.1f" % (wasted_seconds / 3600.0),
+            "%0.2f" % (100.0 * wasted_seconds / max(1, result.task_seconds)),
+            result.num_killed, result.num_collisions, result.num_tasks, result.num_unfinished,
+        ])))
@@ -0,0 +1,16 @@
+"""Fake java/GatkWorker.java used by test_gatk_worker.py"""
+
+import sys
+
+for line in iter(sys.stdin.readline, ""):
+    args = line.rstrip("\n").split("\t")
+    if "die" in args:
+        sys.exit(1)
+    if "fail" in args:
+        print("ERROR MESSAGE: fail")
+        print("GATK_WORKER_DONE 1")
+    else:
+        print("HaplotypeCaller %s" % " ".join(args))
+        print("Total runtime 1.00 secs")
+        print("GATK_WORKER_DONE 0")
+    sys.stdout.flush()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pysam
+from utils.bam_prefetcher import merge_regions, stage_bam_regions, BamPrefetcher
+
+
+def write_bam(bam_path, contigs, reads):
+    """Writes an indexed bam with the given (name, length) contigs and (read name, chrom, 0-based start) reads,
+    which must be sorted in the order of contigs"""
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"}, "SQ": [{"SN": name, "LN": length} for name, length in contigs]}
+    contig_names = [name for name, _ in contigs]
+    bam = pysam.AlignmentFile(bam_path, "wb", header=header)
+    for read_name, chrom, start in reads:
+        r = pysam.AlignedSegment()
+        r.query_name = read_name
+        r.query_sequence = "A" * 50
+        r.flag = 0
+        r.reference_id = contig_names.index(chrom)
+        r.reference_start = start
+        r.mapping_quality = 60
+        r.cigartuples = [(0, 50)]
+        bam.write(r)
+    bam.close()
+    pysam.index(bam_path)
+
+
+class TestBamPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_merge_regions(self):
+        regions = [("2", 100, 200), ("1", 5000, 5100), ("1", 100, 200), ("1", 250, 300)]
+
+        self.assertListEqual(merge_regions(regions), [("1", 100, 200), ("1", 250, 300), ("1", 5000, 5100), ("2", 100, 200)])
+        self.assertListEqual(merge_regions(regions, margin=50), [("1", 50, 350), ("1", 4950, 5150), ("2", 50, 250)])
+
+    def test_merge_regions_contig_order(self):
+        regions = [("10", 100, 200), ("X", 100, 200), ("2", 300, 400), ("GL000192.1", 100, 200), ("2", 100, 200)]
+        contig_order = ["1", "2", "10", "X", "Y"]
+
+        self.assertListEqual(merge_regions(regions, contig_order=contig_order), [
+            ("2", 100, 200), ("2", 300, 400), ("10", 100, 200), ("X", 100, 200), ("GL000192.1", 100, 200)])
+
+    def test_stage_bam_regions(self):
+        contigs = [("1", 10000), ("2", 10000), ("10", 10000)]
+        input_bam_path = os.path.join(self.temp_dir, "input.bam")
+        write_bam(input_bam_path, contigs, [
+            ("r1a", "1", 100), ("r1b", "1", 5000),
+            ("r2a", "2", 100), ("r2b", "2", 130),
+            ("r10a", "10", 100), ("r10b", "10", 8000),
+        ])
+
+        # the regions on chrom 2 overlap, but their reads are only copied once
+        output_bam_path = os.path.join(self.temp_dir, "staged.bam")
+        regions = [("10", 50, 200), ("2", 120, 300), ("2", 50, 200), ("1", 50, 200)]
+        self.assertEqual(stage_bam_regions(input_bam_path, output_bam_path, regions, margin=0), 4)
+
+        staged_bam = pysam.AlignmentFile(output_bam_path, "rb")
+        self.assertEqual(tuple(staged_bam.references), ("1", "2", "10"))
+        self.assertListEqual([r.query_name for r in staged_bam.fetch(until_eof=True)], ["r1a", "r2a", "r2b", "r10a"])
+        self.assertListEqual([r.query_name for r in staged_bam.fetch("10", 0, 10000)], ["r10a"])  # it's indexed
+        staged_bam.close()
+
+    def test_prefetcher_stop(self):
+        input_bam_path = os.path.join(self.temp_dir, "input.bam")
+        write_bam(input_bam_path, [("1", 10000)], [("r1a", "1", 100)])
+        scratch_dir = os.path.join(self.temp_dir, "scratch")
+        os.mkdir(scratch_dir)
+
+        prefetcher = BamPrefetcher(scratch_dir)
+        prefetcher.prefetch("sample1", input_bam_path, [("1", 50, 200)])
+        self.assertTrue(os.path.isfile(prefetcher.get("sample1")))
+
+        prefetcher.stop()
+        self.assertFalse(prefetcher._thread.is_alive())
+        self.assertListEqual(os.listdir(scratch_dir), [])
+
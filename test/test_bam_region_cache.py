@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+import utils.bam_region_cache
+from utils.bam_region_cache import BamRegionCache, are_regions_covered
+
+
+def fake_stage_bam_regions(input_bam_path, output_bam_path, regions, margin):
+    with open(output_bam_path, "w") as f:
+        f.write("x" * 100)
+
+
+class TestBamRegionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bam_path = os.path.join(self.temp_dir, "sample.bam")
+        open(self.bam_path, "w").close()
+
+        self.original_stage_bam_regions = utils.bam_region_cache.stage_bam_regions
+        utils.bam_region_cache.stage_bam_regions = fake_stage_bam_regions
+
+    def tearDown(self):
+        utils.bam_region_cache.stage_bam_regions = self.original_stage_bam_regions
+        shutil.rmtree(self.temp_dir)
+
+    def test_are_regions_covered(self):
+        self.assertTrue(are_regions_covered([("1", 10, 20)], [("1", 1, 100)]))
+        self.assertFalse(are_regions_covered([("1", 10, 200)], [("1", 1, 100)]))
+        self.assertFalse(are_regions_covered([("1", 10, 20), ("2", 10, 20)], [("1", 1, 100)]))
+
+    def test_cache(self):
+        cache = BamRegionCache(self.temp_dir, max_bytes=250, margin=10)
+
+        path1 = cache.get(self.bam_path, [("1", 1000, 2000)])
+        cache.release(path1)
+
+        # overlapping request that's contained in the cached region
+        self.assertEqual(cache.get(self.bam_path, [("1", 1005, 1500)]), path1)
+        cache.release(path1)
+
+        path2 = cache.get(self.bam_path, [("1", 5000, 6000)])
+        path3 = cache.get(self.bam_path, [("1", 9000, 9100)])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        # path1 was least recently used, so it's deleted. path2 and path3 are in use.
+        self.assertFalse(os.path.exists(path1))
+        self.assertTrue(os.path.exists(path2) and os.path.exists(path3))
+
+        cache.release(path2)
+        cache.release(path3)
+        self.assertEqual(cache.total_bytes(), 200)
+
+        cache.clear()
+        self.assertFalse(os.path.exists(path2) or os.path.exists(path3))
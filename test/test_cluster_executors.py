@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+import unittest
+from utils.cluster_executors import parse_sge_task_ids, compute_num_tasks_to_submit, get_queue_time_limit_hours, \
+    get_array_job_task_id, ClusterExecutor, LocalExecutor, run_supervisor
+
+
+class TestClusterExecutors(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_parse_sge_task_ids(self):
+        self.assertEqual(parse_sge_task_ids("7"), 1)
+        self.assertEqual(parse_sge_task_ids("1-10:1"), 10)
+        self.assertEqual(parse_sge_task_ids("3,5-9:2"), 4)
+        self.assertRaises(ValueError, parse_sge_task_ids, "r")
+
+    def test_compute_num_tasks_to_submit(self):
+        self.assertEqual(compute_num_tasks_to_submit(100, 7, 10), 3)
+        self.assertEqual(compute_num_tasks_to_submit(2, 7, 10), 2)
+        self.assertEqual(compute_num_tasks_to_submit(100, 12, 10), 0)
+
+    def test_get_queue_time_limit_hours(self):
+        self.assertEqual(get_queue_time_limit_hours({}), None)
+        self.assertEqual(get_queue_time_limit_hours({"JOB_ID": "123", "QUEUE": "short"}), 4)
+        self.assertEqual(get_queue_time_limit_hours({"JOB_ID": "123"}), 4)
+        self.assertEqual(get_queue_time_limit_hours({"LSB_JOBID": "123", "LSB_QUEUE": "hour"}), 1)
+
+    def test_get_array_job_task_id(self):
+        self.assertEqual(get_array_job_task_id({}), None)
+        self.assertEqual(get_array_job_task_id({"JOB_ID": "123", "SGE_TASK_ID": "7"}), "7")
+        self.assertEqual(get_array_job_task_id({"JOB_ID": "123", "SGE_TASK_ID": "undefined"}), None)
+        self.assertEqual(get_array_job_task_id({"LSB_JOBID": "123", "LSB_JOBINDEX": "7"}), "7")
+        self.assertEqual(get_array_job_task_id({"LSB_JOBID": "123", "LSB_JOBINDEX": "0"}), None)
+
+    def test_cluster_executor_is_abstract(self):
+        class IncompleteExecutor(ClusterExecutor):
+            def count_live_tasks(self, job_ids):
+                return 0
+
+        self.assertRaises(TypeError, ClusterExecutor)
+        self.assertRaises(TypeError, IncompleteExecutor)
+
+    def test_local_executor(self):
+        executor = LocalExecutor()
+        job_id = executor.submit_array_job("sleep 0", 3, self.log_dir)
+        for process in executor.processes_by_job_id[job_id]:
+            process.wait()
+        self.assertEqual(executor.count_live_tasks([job_id]), 0)
+
+    def test_run_supervisor(self):
+        # each task processes one of 5 units of work and exits
+        executor = LocalExecutor()
+
+        def get_progress():
+            all_processes = [p for processes in executor.processes_by_job_id.values() for p in processes]
+            for process in all_processes:
+                process.wait()
+            return 5 - len(all_processes), 0
+
+        job_ids = run_supervisor(executor, "sleep 0", 2, self.log_dir, get_progress, poll_interval_seconds=0)
+        self.assertEqual([len(executor.processes_by_job_id[job_id]) for job_id in job_ids], [2, 2, 1])
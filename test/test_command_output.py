@@ -0,0 +1,25 @@
+import sys
+import tempfile
+import unittest
+from utils.command_output import run_command_and_stream_output, read_output_tail
+
+
+class TestCommandOutput(unittest.TestCase):
+
+    def test_run_command_and_stream_output(self):
+        script = "import sys\nfor i in range(1000): print('line %d' % i)\nprint('-- done --')\nsys.exit(3)"
+        returncode, output_tail, markers_seen = run_command_and_stream_output(
+            [sys.executable, "-c", script], markers=("-- done --", "not printed"), tail_lines=3)
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(output_tail, "line 998\nline 999\n-- done --")
+        self.assertSetEqual(markers_seen, set(["-- done --"]))
+
+    def test_read_output_tail(self):
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write("a\nb -- done --\nc\n")
+            f.flush()
+            output_tail, markers_seen = read_output_tail(f.name, markers=("-- done --",), tail_lines=2)
+
+        self.assertEqual(output_tail, "b -- done --\nc")
+        self.assertSetEqual(markers_seen, set(["-- done --"]))
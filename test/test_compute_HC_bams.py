@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+import utils.bam_region_cache
+import pipeline.compute_HC_bams_from_sample_table as compute_HC
+
+
+def fake_stage_bam_regions(input_bam_path, output_bam_path, regions, margin):
+    with open(output_bam_path, "w") as f:
+        f.write("x" * 100)
+
+
+class TestProcessInterval(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bam_path = os.path.join(self.temp_dir, "sample.bam")
+        open(self.bam_path, "w").close()
+
+        # replace the database queries and HC runs, so that only the region cache is used
+        self.original_functions = {}
+        for name, f in [
+                ("assign_sample_indexes", lambda *args, **kwargs: None),
+                ("mark_unclaimed_records", lambda *args, **kwargs: 0),
+                ("create_sample_record_iterator", lambda *args, **kwargs: iter([])),
+                ("main", self.fake_main)]:
+            self.original_functions[name] = getattr(compute_HC, name)
+            setattr(compute_HC, name, f)
+
+        self.original_stage_bam_regions = utils.bam_region_cache.stage_bam_regions
+        utils.bam_region_cache.stage_bam_regions = fake_stage_bam_regions
+
+    def tearDown(self):
+        compute_HC.cleanup_process_interval()
+        compute_HC._bam_region_cache = None
+        for name, f in self.original_functions.items():
+            setattr(compute_HC, name, f)
+        utils.bam_region_cache.stage_bam_regions = self.original_stage_bam_regions
+        shutil.rmtree(self.temp_dir)
+
+    def fake_main(self, sample_iterator, bam_output_dir, exit_after_minutes=None, scratch_dir=None, region_cache=None):
+        # the same variant in both intervals needs the same bam region
+        local_bam_path = region_cache.get(self.bam_path, [("1", 1000, 2000)])
+        region_cache.release(local_bam_path)
+        return True
+
+    def test_region_cache_is_reused_by_later_intervals(self):
+        kwargs = compute_HC.parse_process_interval_args(["--scratch-dir", self.temp_dir, "--region-cache-gb", "1"])
+
+        self.assertTrue(compute_HC.process_interval("1", 1, 1500, **kwargs))
+        self.assertTrue(compute_HC.process_interval("1", 1501, 3000, **kwargs))
+
+        region_cache = compute_HC._bam_region_cache
+        self.assertEqual((region_cache.hits, region_cache.misses), (1, 1))
+
+        compute_HC.cleanup_process_interval()
+        self.assertEqual(region_cache.total_bytes(), 0)
@@ -0,0 +1,67 @@
+import unittest
+from utils.downsampling import choose_reads_to_keep, is_spanning_read
+
+
+def compute_max_depth(reads, read_indexes):
+    depth = {}
+    for read_i in read_indexes:
+        _, chrom, start, end = reads[read_i]
+        if start is None:
+            continue
+        for pos in range(start, end):
+            depth[(chrom, pos)] = depth.get((chrom, pos), 0) + 1
+    return max(depth.values()) if depth else 0
+
+
+# 200 reads of length 100 starting at every 5th base of 1:1000-2000, so the depth is ~20 in the middle
+READS = [("read%s" % i, "1", 1000 + 5*i, 1100 + 5*i) for i in range(200)]
+
+
+class TestDownsampling(unittest.TestCase):
+
+    def test_is_spanning_read(self):
+        self.assertTrue(is_spanning_read("1", 99, 200, [("1", 100, 100)]))
+        self.assertFalse(is_spanning_read("1", 100, 200, [("1", 100, 100)]))
+        self.assertFalse(is_spanning_read("1", 99, 200, [("1", 150, 210)]))
+        self.assertFalse(is_spanning_read("2", 99, 200, [("1", 100, 100)]))
+
+    def test_choose_reads_to_keep(self):
+        kept = choose_reads_to_keep(READS, 10, "sample1 1-1500-A-T")
+        self.assertLessEqual(compute_max_depth(READS, kept), 10)
+        self.assertGreater(len(kept), 50)
+
+        # deterministic for the same seed, but depends on the seed
+        self.assertEqual(kept, choose_reads_to_keep(READS, 10, "sample1 1-1500-A-T"))
+        self.assertNotEqual(kept, choose_reads_to_keep(READS, 10, "sample2 1-1500-A-T"))
+
+        # no reads are left out where the depth is already below the max
+        self.assertEqual(len(choose_reads_to_keep(READS, 1000, "sample1 1-1500-A-T")), len(READS))
+
+    def test_spanning_reads_are_kept(self):
+        variant_regions = [("1", 1501, 1501)]
+        kept = choose_reads_to_keep(READS, 10, "sample1 1-1501-A-T", variant_regions)
+        spanning = [i for i, (_, chrom, start, end) in enumerate(READS) if is_spanning_read(chrom, start, end, variant_regions)]
+        self.assertEqual(sum(1 for i in spanning if i in kept), 10)
+
+    def test_unaligned_reads_are_kept(self):
+        reads = READS + [("unmapped%s" % i, "1", None, None) for i in range(50)]
+        kept = choose_reads_to_keep(reads, 5, "sample1 1-1500-A-T")
+        self.assertTrue(all(i in kept for i in range(len(READS), len(reads))))
+        self.assertLessEqual(compute_max_depth(reads, kept), 5)
+
+    def test_mates_are_kept_together(self):
+        # read pairs with one mate at 1000-1500 and the other 300bp to the right
+        reads = []
+        for i in range(100):
+            reads.append(("pair%s" % i, "1", 1000 + 5*i, 1100 + 5*i))
+            reads.append(("pair%s" % i, "1", 1400 + 5*i, 1500 + 5*i))
+        kept = choose_reads_to_keep(reads, 10, "sample1 1-1500-A-T")
+        self.assertLessEqual(compute_max_depth(reads, kept), 10)
+        self.assertGreater(len(kept), 0)
+        for i in range(0, len(reads), 2):
+            self.assertEqual(i in kept, i + 1 in kept)
+
+        # overlapping mates both count towards the depth
+        reads = [("pair", "1", 1000, 1100), ("pair", "1", 1050, 1150)]
+        self.assertEqual(choose_reads_to_keep(reads, 1, "sample1 1-1500-A-T"), set())
+        self.assertEqual(choose_reads_to_keep(reads, 2, "sample1 1-1500-A-T"), set([0, 1]))
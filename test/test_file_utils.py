@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+from utils.file_utils import create_dir, link_file, publish_file
+
+
+class TestFileUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_publish_file(self):
+        source_path = os.path.join(self.scratch_dir, "a.bam")
+        destination_path = os.path.join(self.output_dir, "b.bam")
+        with open(source_path, "w") as f:
+            f.write("new")
+        with open(destination_path, "w") as f:
+            f.write("old")
+
+        publish_file(source_path, destination_path)
+
+        self.assertFalse(os.path.exists(source_path))
+        self.assertListEqual(os.listdir(self.output_dir), ["b.bam"])
+        with open(destination_path) as f:
+            self.assertEqual(f.read(), "new")
+
+    def test_link_file(self):
+        source_path = os.path.join(self.scratch_dir, "a.bam")
+        destination_path = os.path.join(self.output_dir, "b.bam")
+        with open(source_path, "w") as f:
+            f.write("new")
+
+        link_file(source_path, destination_path)
+
+        self.assertTrue(os.path.exists(source_path))
+        self.assertListEqual(os.listdir(self.output_dir), ["b.bam"])
+        with open(destination_path) as f:
+            self.assertEqual(f.read(), "new")
+
+    def test_create_dir(self):
+        dir_path = os.path.join(self.scratch_dir, "a", "b")
+        create_dir(dir_path)
+        self.assertTrue(os.path.isdir(dir_path))
+        create_dir(dir_path)  # already exists
+
+        file_path = os.path.join(self.scratch_dir, "c")
+        with open(file_path, "w") as f:
+            f.write("")
+        self.assertRaises(OSError, create_dir, file_path)
@@ -0,0 +1,65 @@
+import os
+import signal
+import sys
+import unittest
+from utils.gatk_worker import GatkWorker, GatkWorkerPool, get_gatk_args, parse_total_runtime
+
+FAKE_WORKER_COMMAND = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_gatk_worker.py")]
+
+
+class TestGatkWorker(unittest.TestCase):
+
+    def assertSucceeded(self, result):
+        self.assertEqual((result.succeeded, result.returncode, result.error_message), (True, 0, None))
+        self.assertEqual(result.gatk_runtime_seconds, 1.0)
+
+    def test_get_gatk_args(self):
+        self.assertListEqual(get_gatk_args("java -Xmx100m -jar GATK.jar -T HaplotypeCaller -L 1:1-10"),
+                             ["-T", "HaplotypeCaller", "-L", "1:1-10"])
+
+    def test_parse_total_runtime(self):
+        output = "INFO  10:45:02,521 ProgressMeter - Total runtime 41.77 secs, 0.70 min, 0.01 hours\n"
+        self.assertEqual(parse_total_runtime(output), 41.77)
+        self.assertIsNone(parse_total_runtime("ERROR MESSAGE: fail"))
+
+    def test_run(self):
+        worker = GatkWorker(FAKE_WORKER_COMMAND, max_commands=2)
+        try:
+            self.assertSucceeded(worker.run("java -jar GATK.jar -T HaplotypeCaller"))
+            process = worker.process
+
+            succeeded, returncode, error_message = worker.run("java -jar GATK.jar fail")[:3]
+            self.assertFalse(succeeded)
+            self.assertEqual(returncode, 1)
+            self.assertIn("ERROR MESSAGE: fail", error_message)
+            self.assertIs(worker.process, process)
+
+            # restarted after max_commands
+            self.assertSucceeded(worker.run("java -jar GATK.jar -T HaplotypeCaller"))
+            self.assertIsNot(worker.process, process)
+
+            # the caller falls back to a new JVM if the worker dies
+            self.assertIsNone(worker.run("java -jar GATK.jar die"))
+            self.assertSucceeded(worker.run("java -jar GATK.jar -T HaplotypeCaller"))
+        finally:
+            worker.stop()
+
+    def test_ignores_sigint(self):
+        worker = GatkWorker(FAKE_WORKER_COMMAND)
+        try:
+            self.assertSucceeded(worker.run("java -jar GATK.jar -T HaplotypeCaller"))
+            process = worker.process
+
+            os.kill(process.pid, signal.SIGINT)
+            self.assertSucceeded(worker.run("java -jar GATK.jar -T HaplotypeCaller"))
+            self.assertIs(worker.process, process)
+            self.assertIsNone(process.poll())
+        finally:
+            worker.stop()
+
+    def test_pool(self):
+        pool = GatkWorkerPool(FAKE_WORKER_COMMAND, num_workers=2)
+        try:
+            self.assertSucceeded(pool.run("java -jar GATK.jar -T HaplotypeCaller"))
+        finally:
+            pool.stop()
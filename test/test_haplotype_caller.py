@@ -0,0 +1,140 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+import pysam
+import utils.haplotype_caller
+from utils.gatk_worker import GatkResult
+from utils.haplotype_caller import is_tcga_sample, finish_haplotype_caller_batch, HaplotypeCallerJob
+from utils.hc_window import choose_hc_window
+from test.test_postprocess import write_bamout
+
+
+class Interval(collections.namedtuple("Interval", ["chrom", "start", "end"])):
+    def __str__(self):
+        return "%s:%s-%s" % (self.chrom, self.start, self.end)
+
+
+# the calling interval of each variant in test.test_postprocess.BATCH_BAMOUT_RECORDS
+CALLING_INTERVALS = {1101: Interval("1", 1001, 1200), 5101: Interval("1", 5001, 5200)}
+
+
+class FakeSampleRecord(object):
+    """Sample record that hasn't been saved. Fields that aren't set are None."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        return None
+
+
+class TestTcgaSamples(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tcga_bam_paths = os.path.join(self.temp_dir, "TCGA_external_cghublink_all.tsv")
+        with open(self.tcga_bam_paths, "w") as f:
+            f.write("TCGA-A1-0001\tx\tx\tx\tx\t/gvcfs/TCGA-A1-0001.g.vcf.gz\t/bams/TCGA-A1-0001.bam\n")
+
+        self.original_tcga_bam_paths = utils.haplotype_caller.TCGA_NEW_BAM_PATHS
+        utils.haplotype_caller.TCGA_NEW_BAM_PATHS = self.tcga_bam_paths
+        utils.haplotype_caller._tcga_sample_ids = None
+
+    def tearDown(self):
+        utils.haplotype_caller.TCGA_NEW_BAM_PATHS = self.original_tcga_bam_paths
+        utils.haplotype_caller._tcga_sample_ids = None
+        shutil.rmtree(self.temp_dir)
+
+    def test_is_tcga_sample(self):
+        self.assertTrue(is_tcga_sample("TCGA-A1-0001", "/seq/exomes/sample.bam"))
+        self.assertTrue(is_tcga_sample("other", "/seq/TCGA/other.bam"))
+        self.assertFalse(is_tcga_sample("other", "/seq/exomes/other.bam"))
+
+        # sample ids that are substrings of the table's path or of a listed sample id aren't TCGA samples
+        self.assertFalse(is_tcga_sample("cghublink", "/seq/exomes/cghublink.bam"))
+        self.assertFalse(is_tcga_sample("A1-0001", "/seq/exomes/A1-0001.bam"))
+
+    def test_table_is_read_once(self):
+        self.assertTrue(is_tcga_sample("TCGA-A1-0001", "/seq/exomes/sample.bam"))
+        os.remove(self.tcga_bam_paths)
+        self.assertTrue(is_tcga_sample("TCGA-A1-0001", "/seq/exomes/sample.bam"))
+
+
+class TestFinishHaplotypeCallerBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bam_output_dir = os.path.join(self.temp_dir, "output")
+        self.scratch_dir = os.path.join(self.temp_dir, "scratch")
+        os.makedirs(self.scratch_dir)
+
+        # replace the calling interval lookups and the GVCF check, which need the database and the original GVCFs
+        self.postprocessed = []
+        self.original_functions = {}
+        for name, f in [
+                ("get_calling_window", lambda chrom, pos: (CALLING_INTERVALS[pos], [CALLING_INTERVALS[pos]])),
+                ("_check_gvcf_and_postprocess", self.fake_check_gvcf_and_postprocess)]:
+            self.original_functions[name] = getattr(utils.haplotype_caller, name)
+            setattr(utils.haplotype_caller, name, f)
+
+    def tearDown(self):
+        for name, f in self.original_functions.items():
+            setattr(utils.haplotype_caller, name, f)
+        shutil.rmtree(self.temp_dir)
+
+    def fake_check_gvcf_and_postprocess(self, sr, output_bam_path, temp_output_bam_path, temp_output_gvcf_path,
+                                        all_bam_output_dir, is_gvcf_shared=False, window=None, allow_retry=False):
+        # the GVCF doesn't match the original call
+        with pysam.AlignmentFile(temp_output_bam_path, "rb") as bam:
+            self.postprocessed.append((sr.pos, [r.query_name for r in bam.fetch(until_eof=True)], allow_retry))
+        os.remove(temp_output_bam_path)
+        return None
+
+    def create_batch_job(self):
+        samples_to_run = []
+        for sample_record_i, pos in enumerate(sorted(CALLING_INTERVALS)):
+            sr = FakeSampleRecord(chrom="1", pos=pos, ref="A", alt="T", het_or_hom_or_hemi="het",
+                                  sample_id="sample1", original_bam_path="/seq/exomes/sample1.bam")
+            window = choose_hc_window(pos, "A", "T", CALLING_INTERVALS[pos], [CALLING_INTERVALS[pos]], 0)
+            output_bam_path = "1/%s/chr1-%s-A-T_het0.bam" % (pos % 1000, pos)
+            samples_to_run.append((sample_record_i, sr, output_bam_path, window))
+
+        batch_bam_path = os.path.join(self.scratch_dir, "tmp.batch.bam")
+        batch_gvcf_path = os.path.join(self.scratch_dir, "tmp.batch.gvcf")
+        write_bamout(batch_bam_path)
+        open(batch_gvcf_path, "w").close()
+
+        return HaplotypeCallerJob("java -jar GenomeAnalysisTK.jar", [None] * len(samples_to_run), samples_to_run,
+                                  batch_bam_path, batch_gvcf_path, self.bam_output_dir, self.scratch_dir, None)
+
+    def test_gvcf_mismatch_is_retried(self):
+        job = self.create_batch_job()
+        hc_result = GatkResult(True, 0, None, 10.0, 8.0, None, 1, False)
+
+        retry_jobs = []
+        results = finish_haplotype_caller_batch(job, hc_result, retry_jobs)
+
+        # each variant was checked on only its own part of the batch bamout
+        self.assertListEqual(self.postprocessed, [
+            (1101, ["haplotype1", "read1a", "read1b"], True),
+            (5101, ["haplotype2", "read2a"], True),
+        ])
+
+        # neither variant has a result yet. Instead, each is queued to run again on a larger window.
+        self.assertListEqual(results, [None, None])
+        self.assertEqual(len(retry_jobs), 2)
+        for retry_job, (sample_record_i, sr, output_bam_path, window) in zip(retry_jobs, job.samples_to_run):
+            self.assertIs(retry_job.results, results)
+            self.assertEqual(len(retry_job.samples_to_run), 1)
+            retry_sample_record_i, retry_sr, retry_output_bam_path, retry_window = retry_job.samples_to_run[0]
+            self.assertEqual((retry_sample_record_i, retry_output_bam_path), (sample_record_i, output_bam_path))
+            self.assertIs(retry_sr, sr)
+            self.assertEqual(retry_window.level, window.level + 1)
+            self.assertIn("-L %s" % CALLING_INTERVALS[sr.pos], retry_job.hc_command_line)
+
+        # nothing was published, and the batch files were deleted
+        self.assertListEqual([files for _, _, files in os.walk(self.bam_output_dir) if files], [])
+        self.assertFalse(os.path.exists(job.batch_bam_path))
+        self.assertFalse(os.path.exists(job.batch_gvcf_path))
@@ -0,0 +1,53 @@
+import collections
+import unittest
+from utils.hc_window import choose_hc_window, get_initial_window_level, get_padding, MAX_WINDOW_LEVEL
+
+
+class Interval(collections.namedtuple("Interval", ["chrom", "start", "end"])):
+    def __str__(self):
+        return "%s:%s-%s" % (self.chrom, self.start, self.end)
+
+
+INTERVALS = [
+    Interval("1", 1000, 1200),
+    Interval("1", 2000, 2200),
+    Interval("1", 2300, 2500),
+    Interval("1", 2550, 2700),
+    Interval("1", 5000, 5200),
+]
+
+
+class TestHcWindow(unittest.TestCase):
+
+    def test_get_initial_window_level(self):
+        self.assertEqual(get_initial_window_level("A", "T"), 0)
+        self.assertEqual(get_initial_window_level("A", "AT"), 0)
+        self.assertEqual(get_initial_window_level("A", "A" + "T" * 30), 1)
+
+    def test_get_padding(self):
+        self.assertEqual(get_padding("A", "T", 0), 100)
+        self.assertEqual(get_padding("ATT", "A", 0), 104)
+        self.assertEqual(get_padding("A", "A" + "T" * 200, 0), 300)
+        self.assertEqual(get_padding("A", "T", 1), 300)
+
+    def test_choose_hc_window(self):
+        # SNV in the middle of its interval
+        window = choose_hc_window(2400, "A", "T", INTERVALS[2], INTERVALS, 0)
+        self.assertListEqual(window.intervals, [INTERVALS[2]])
+        self.assertEqual((window.padding_around_snps, window.padding_around_indels), (100, 300))
+
+        # SNV near the end of its interval also needs the next interval
+        window = choose_hc_window(2490, "A", "T", INTERVALS[2], INTERVALS, 0)
+        self.assertListEqual(window.intervals, INTERVALS[2:4])
+
+        # indels need more padding, so they reach the previous interval too
+        window = choose_hc_window(2400, "A", "AT" * 50, INTERVALS[2], INTERVALS, 0)
+        self.assertListEqual(window.intervals, INTERVALS[1:4])
+        self.assertEqual(window.padding_around_indels, 298)
+
+        window = choose_hc_window(2400, "A", "T", INTERVALS[2], INTERVALS, 1)
+        self.assertListEqual(window.intervals, INTERVALS[1:4])
+        self.assertEqual((window.padding_around_snps, window.padding_around_indels), (300, 300))
+
+        window = choose_hc_window(2400, "A", "T", INTERVALS[2], INTERVALS, MAX_WINDOW_LEVEL)
+        self.assertListEqual(window.intervals, INTERVALS)
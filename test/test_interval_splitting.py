@@ -0,0 +1,35 @@
+import unittest
+from utils.interval_splitting import split_intervals_by_size, split_intervals_by_workload
+
+
+def _to_tuples(intervals):
+    return [(i["chrom"], i["start_pos"], i["end_pos"]) for i in intervals]
+
+
+class TestIntervalSplitting(unittest.TestCase):
+
+    def test_split_intervals_by_size(self):
+        intervals = [{"chrom": "1", "start_pos": 1, "end_pos": 250}, {"chrom": "2", "start_pos": 10, "end_pos": 20}]
+        self.assertListEqual(_to_tuples(split_intervals_by_size(intervals, 100)),
+            [("1", 1, 100), ("1", 101, 200), ("1", 201, 250), ("2", 10, 20)])
+
+    def test_split_intervals_by_workload(self):
+        intervals = [
+            {"chrom": "1", "start_pos": 1, "end_pos": 100},
+            {"chrom": "1", "start_pos": 201, "end_pos": 300},
+            {"chrom": "1", "start_pos": 301, "end_pos": 400},
+            {"chrom": "2", "start_pos": 1, "end_pos": 100},
+        ]
+        workload_by_position = {
+            "1": ([10, 20, 30, 250], [4, 4, 4, 1]),
+            "2": ([50], [100]),
+        }
+
+        # intervals with too much work are split between positions, and ones with little work are merged
+        actual = split_intervals_by_workload(intervals, workload_by_position, 8, max_interval_size=1000)
+        self.assertListEqual(_to_tuples(actual), [("1", 1, 29), ("1", 30, 400), ("2", 1, 100)])
+        self.assertListEqual([i["workload"] for i in actual], [8, 5, 100])
+
+        # merging stops at max_interval_size
+        actual = split_intervals_by_workload(intervals, workload_by_position, 8, max_interval_size=300)
+        self.assertListEqual(_to_tuples(actual), [("1", 1, 29), ("1", 30, 300), ("1", 301, 400), ("2", 1, 100)])
@@ -0,0 +1,61 @@
+import datetime
+import peewee
+import unittest
+from playhouse.test_utils import test_database
+from utils.leases import compute_lease_expiration, is_claimable, release_lease, get_fields_to_save, \
+    mark_unclaimed_records, unclaim_records, UNCLAIMED_LEASE_EXPIRATION
+
+test_db = peewee.SqliteDatabase(':memory:')
+
+
+class LeasedRecord(peewee.Model):
+    name = peewee.CharField()
+    started = peewee.BooleanField(default=0)
+    finished = peewee.BooleanField(default=0)
+    lease_expires = peewee.DateTimeField(default=UNCLAIMED_LEASE_EXPIRATION, null=True)
+
+    def save(self, *args, **kwargs):
+        if self.id is not None and not kwargs.get("only"):
+            kwargs["only"] = get_fields_to_save(self)
+        return super(LeasedRecord, self).save(*args, **kwargs)
+
+
+class TestLeases(unittest.TestCase):
+
+    def test_is_claimable(self):
+        with test_database(test_db, (LeasedRecord,)):
+            an_hour_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+            LeasedRecord.create(name="not started")
+            LeasedRecord.create(name="finished", started=1, finished=1)
+            LeasedRecord.create(name="running", started=1, lease_expires=compute_lease_expiration(10))
+            LeasedRecord.create(name="worker died", started=1, lease_expires=an_hour_ago)
+            r = LeasedRecord.create(name="failed", started=1, lease_expires=compute_lease_expiration(10))
+            release_lease(LeasedRecord, r.id)
+
+            claimable = [r.name for r in LeasedRecord.select().where(is_claimable(LeasedRecord)).order_by(LeasedRecord.id)]
+            self.assertListEqual(claimable, ["not started", "worker died"])
+
+    def test_mark_unclaimed_records(self):
+        with test_database(test_db, (LeasedRecord,)):
+            LeasedRecord.create(name="reset", lease_expires=None)
+            r = LeasedRecord.create(name="stopped early", started=1, lease_expires=compute_lease_expiration(10))
+            LeasedRecord.create(name="failed", started=1, lease_expires=None)
+            self.assertEqual(mark_unclaimed_records(LeasedRecord), 1)
+            unclaim_records(LeasedRecord, [r.id])
+
+            claimable = [r.name for r in LeasedRecord.select().where(is_claimable(LeasedRecord)).order_by(LeasedRecord.id)]
+            self.assertListEqual(claimable, ["reset", "stopped early"])
+
+    def test_save_does_not_overwrite_lease(self):
+        with test_database(test_db, (LeasedRecord,)):
+            r = LeasedRecord.create(name="a", started=1, lease_expires=compute_lease_expiration(1))
+
+            renewed_lease = compute_lease_expiration(10)
+            LeasedRecord.update(lease_expires=renewed_lease).where(LeasedRecord.id == r.id).execute()
+
+            r.name = "b"
+            r.save()
+
+            r = LeasedRecord.get(LeasedRecord.id == r.id)
+            self.assertEqual(r.name, "b")
+            self.assertEqual(r.lease_expires, renewed_lease)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from utils.load_aware_concurrency import get_free_memory_gb, compute_target_concurrency, compute_num_workers
+
+
+class TestLoadAwareConcurrency(unittest.TestCase):
+
+    def test_get_free_memory_gb(self):
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write("MemTotal:       16777216 kB\nMemFree:         1048576 kB\nMemAvailable:    4194304 kB\n")
+            f.flush()
+            self.assertEqual(get_free_memory_gb(f.name), 4)
+
+        self.assertIsNone(get_free_memory_gb(os.path.join(tempfile.gettempdir(), "does_not_exist")))
+
+    def test_compute_target_concurrency(self):
+        # idle machine with lots of memory
+        self.assertEqual(compute_target_concurrency(2, 0, 4, load_average=1, num_cpus=8, free_memory_gb=32, memory_per_command_gb=8), 3)
+        self.assertEqual(compute_target_concurrency(4, 0, 4, load_average=1, num_cpus=8, free_memory_gb=32, memory_per_command_gb=8), 4)
+
+        # recently-started commands will use most of the free memory
+        self.assertEqual(compute_target_concurrency(2, 2, 4, load_average=1, num_cpus=8, free_memory_gb=20, memory_per_command_gb=8), 2)
+
+        # overloaded
+        self.assertEqual(compute_target_concurrency(3, 0, 4, load_average=9, num_cpus=8, free_memory_gb=32, memory_per_command_gb=8), 2)
+        self.assertEqual(compute_target_concurrency(1, 0, 4, load_average=20, num_cpus=8, free_memory_gb=32, memory_per_command_gb=8), 1)
+
+        # unknown free memory
+        self.assertEqual(compute_target_concurrency(1, 0, 4, load_average=0, num_cpus=8, free_memory_gb=None, memory_per_command_gb=8), 1)
+
+    def test_compute_num_workers(self):
+        # limited by memory
+        self.assertEqual(compute_num_workers(None, num_cpus=16, free_memory_gb=60, memory_per_worker_gb=8), 7)
+
+        # limited by cpus or max_workers
+        self.assertEqual(compute_num_workers(None, num_cpus=4, free_memory_gb=60, memory_per_worker_gb=8), 4)
+        self.assertEqual(compute_num_workers(2, num_cpus=16, free_memory_gb=60, memory_per_worker_gb=8), 2)
+
+        # always at least 1
+        self.assertEqual(compute_num_workers(None, num_cpus=16, free_memory_gb=4, memory_per_worker_gb=8), 1)
+        self.assertEqual(compute_num_workers(None, num_cpus=16, free_memory_gb=None, memory_per_worker_gb=8), 1)
@@ -1,5 +1,51 @@
+import os
+import shutil
+import tempfile
 import unittest
-from utils.postprocess_reassembled_bam import do_intervals_intersect, interval_union
+import pysam
+from utils.postprocess_reassembled_bam import do_intervals_intersect, interval_union, slice_reassembled_bam
+
+
+# a HC -bamout of a batched run on two variants (see utils/haplotype_caller.py run_haplotype_caller_batch(..)). Each
+# artificial haplotype has an HC tag, and the reads assigned to it have the same HC tag.
+# (read name, read group, HC tag, 0-based start, length)
+BATCH_BAMOUT_RECORDS = [
+    ("haplotype1", "ArtificialHaplotype", 1, 1000, 200),
+    ("read1a", "sample1", 1, 1050, 50),
+    ("read1b", "sample1", 1, 1100, 50),
+    ("haplotype3", "ArtificialHaplotype", 3, 4200, 100),  # reassembled near, but not within, the 2nd variant's window
+    ("read3a", "sample1", 3, 4220, 50),
+    ("haplotype2", "ArtificialHaplotype", 2, 5000, 200),
+    ("read2a", "sample1", 2, 5050, 50),
+]
+
+
+def write_bamout(bam_path, records=BATCH_BAMOUT_RECORDS):
+    """Writes an indexed HC bamout on chromosome 1 with the given records (see BATCH_BAMOUT_RECORDS)"""
+    header = {
+        "HD": {"VN": "1.0", "SO": "coordinate"},
+        "SQ": [{"SN": "1", "LN": 10000}],
+        "RG": [{"ID": read_group, "SM": read_group} for read_group in sorted(set(r[1] for r in records))],
+    }
+    bam = pysam.AlignmentFile(bam_path, "wb", header=header)
+    for read_name, read_group, haplotype_id, start, length in records:
+        r = pysam.AlignedSegment()
+        r.query_name = read_name
+        r.query_sequence = "A" * length
+        r.flag = 0
+        r.reference_id = 0
+        r.reference_start = start
+        r.mapping_quality = 60
+        r.cigartuples = [(0, length)]
+        r.tags = [("RG", read_group), ("HC", haplotype_id)]
+        bam.write(r)
+    bam.close()
+    pysam.index(bam_path)
+
+
+def read_names(bam_path):
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        return [r.query_name for r in bam.fetch(until_eof=True)]
 
 
 class TestPostProcess(unittest.TestCase):
@@ -16,3 +62,33 @@ class TestPostProcess(unittest.TestCase):
         self.assertFalse(do_intervals_intersect((5,8), (1,5)))
 
         self.assertTrue(do_intervals_intersect((6,8), (1,10)))
+
+
+class TestSliceReassembledBam(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bamout_path = os.path.join(self.temp_dir, "batch.bam")
+        write_bamout(self.bamout_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_slice_reassembled_bam(self):
+        # each variant's bam only gets its own haplotypes and the reads assigned to them
+        output_bam_path = os.path.join(self.temp_dir, "variant1.bam")
+        self.assertEqual(slice_reassembled_bam(self.bamout_path, output_bam_path, "1", 1001, 1200), 3)
+        self.assertListEqual(read_names(output_bam_path), ["haplotype1", "read1a", "read1b"])
+
+        output_bam_path = os.path.join(self.temp_dir, "variant2.bam")
+        self.assertEqual(slice_reassembled_bam(self.bamout_path, output_bam_path, "1", 5001, 5200), 2)
+        self.assertListEqual(read_names(output_bam_path), ["haplotype2", "read2a"])
+
+        # the header is kept, so the sliced bam can be postprocessed like a bamout
+        with pysam.AlignmentFile(output_bam_path, "rb") as bam:
+            self.assertListEqual(sorted(rg["ID"] for rg in bam.header["RG"]), ["ArtificialHaplotype", "sample1"])
+
+    def test_slice_without_haplotypes(self):
+        output_bam_path = os.path.join(self.temp_dir, "variant.bam")
+        self.assertEqual(slice_reassembled_bam(self.bamout_path, output_bam_path, "1", 8001, 8200), 0)
+        self.assertListEqual(read_names(output_bam_path), [])
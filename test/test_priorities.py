@@ -0,0 +1,72 @@
+import os
+import peewee
+import tempfile
+import unittest
+from playhouse.test_utils import test_database
+from utils.priorities import read_top_intervals, overlaps_top_interval, compute_priority, \
+    pick_highest_priority_record, assign_sample_priorities, get_priority_ordering
+
+test_db = peewee.SqliteDatabase(':memory:')
+
+
+class PrioritizedSample(peewee.Model):
+    chrom = peewee.CharField()
+    pos = peewee.IntegerField()
+    sample_id = peewee.CharField()
+    finished = peewee.BooleanField(default=0)
+    priority = peewee.IntegerField(default=0, null=True)
+
+
+class TestPriorities(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.top_intervals_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("gene1\t1\t100\t200\n")
+            f.write("gene1 duplicate\t1\t150\t250\n")
+            f.write("gene2\tX\t1000\t2000\n")
+        self.top_intervals = read_top_intervals(self.top_intervals_path)
+
+    def tearDown(self):
+        os.remove(self.top_intervals_path)
+
+    def test_overlaps_top_interval(self):
+        self.assertTrue(overlaps_top_interval(self.top_intervals, "1", 50, 100))
+        self.assertTrue(overlaps_top_interval(self.top_intervals, "1", 240, 300))
+        self.assertTrue(overlaps_top_interval(self.top_intervals, "X", 1, 10**6))
+        self.assertFalse(overlaps_top_interval(self.top_intervals, "1", 251, 300))
+        self.assertFalse(overlaps_top_interval(self.top_intervals, "1", 1, 99))
+        self.assertFalse(overlaps_top_interval(self.top_intervals, "2", 100, 200))
+
+    def test_compute_priority(self):
+        self.assertEqual(compute_priority(self.top_intervals, "1", 120, 120), -1)
+        self.assertEqual(compute_priority(self.top_intervals, "1", 120, 120, is_tcga_sample=True), 0)
+        self.assertEqual(compute_priority(self.top_intervals, "2", 120, 120), 0)
+        self.assertEqual(compute_priority(self.top_intervals, "2", 120, 120, is_tcga_sample=True), 1)
+
+    def test_pick_highest_priority_record(self):
+        records = [PrioritizedSample(id=i, priority=p) for i, p in enumerate([-1, -1, 0, 0])]
+        self.assertEqual(pick_highest_priority_record(records).id, 1)
+        self.assertEqual(pick_highest_priority_record(records[2:]).id, 3)
+
+    def test_get_priority_ordering(self):
+        with test_database(test_db, (PrioritizedSample,)):
+            for sample_id, priority in [("a", None), ("b", 1), ("c", -1), ("d", 0)]:
+                PrioritizedSample.create(chrom="1", pos=100, sample_id=sample_id, priority=priority)
+
+            actual = [r.sample_id for r in PrioritizedSample.select().order_by(*get_priority_ordering(PrioritizedSample))]
+            self.assertListEqual(actual, ["c", "d", "b", "a"])
+
+    def test_assign_sample_priorities(self):
+        with test_database(test_db, (PrioritizedSample,)):
+            PrioritizedSample.create(chrom="1", pos=160, sample_id="a")
+            PrioritizedSample.create(chrom="1", pos=160, sample_id="tcga")
+            PrioritizedSample.create(chrom="1", pos=500, sample_id="tcga")
+            PrioritizedSample.create(chrom="1", pos=500, sample_id="b", priority=None)
+            PrioritizedSample.create(chrom="1", pos=160, sample_id="done", finished=1, priority=5)
+
+            assign_sample_priorities(PrioritizedSample, self.top_intervals, set(["tcga"]))
+            assign_sample_priorities(PrioritizedSample, self.top_intervals, set(["tcga"]))  # should be idempotent
+
+            actual = [r.priority for r in PrioritizedSample.select().order_by(PrioritizedSample.id)]
+            self.assertListEqual(actual, [-1, 0, 1, 0, 5])
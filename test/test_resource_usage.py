@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+from utils.resource_usage import run_command_with_usage, read_proc_usage, subtract_usage, recommend_jvm_settings
+
+
+class TestResourceUsage(unittest.TestCase):
+
+    def test_run_command_with_usage(self):
+        script = "import sys; x = bytearray(100 * 1024 * 1024); print('done'); sys.exit(3)"
+        returncode, output, usage = run_command_with_usage([sys.executable, "-c", script], shell=False)
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(output.strip(), "done")
+        self.assertGreaterEqual(usage.peak_rss_mb, 100)
+        self.assertGreaterEqual(usage.cpu_seconds, 0)
+
+    def test_read_proc_usage(self):
+        if not os.path.isdir("/proc/self"):
+            self.skipTest("/proc not available")
+
+        usage_before = read_proc_usage(os.getpid())
+        sum(range(10**6))
+        usage = subtract_usage(read_proc_usage(os.getpid()), usage_before)
+
+        self.assertGreater(usage.peak_rss_mb, 0)
+        self.assertGreaterEqual(usage.cpu_seconds, 0)
+        self.assertIsNone(subtract_usage(None, usage_before))
+
+    def test_recommend_jvm_settings(self):
+        recommendation = recommend_jvm_settings(
+            peak_rss_mb_values=[1000] * 99 + [2000], cpu_utilization_values=[0.5, 0.5],
+            node_memory_gb=16, num_cpus=4, jvm_overhead_mb=500, percentile=99, safety_margin=0.25)
+
+        self.assertEqual(recommendation["max_heap_mb"], 750)
+        self.assertEqual(recommendation["memory_per_command_mb"], 1250)
+        self.assertEqual(recommendation["num_concurrent_by_memory"], 13)
+        self.assertEqual(recommendation["num_concurrent_by_cpu"], 8)
+        self.assertEqual(recommendation["num_concurrent"], 8)
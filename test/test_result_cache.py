@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from utils.result_cache import compute_result_key, ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bam_path = os.path.join(self.temp_dir, "sample.bam")
+        self.gvcf_path = os.path.join(self.temp_dir, "sample.g.vcf.gz")
+        self.jar_path = os.path.join(self.temp_dir, "GenomeAnalysisTK.jar")
+        for path in (self.bam_path, self.gvcf_path, self.gvcf_path + ".tbi", self.jar_path):
+            with open(path, "w") as f:
+                f.write("x")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def compute_key(self, **kwargs):
+        args = dict(original_bam_path=self.bam_path, original_gvcf_path=self.gvcf_path, calling_intervals=["1:100-200"], gatk_jar_path=self.jar_path,
+                    hc_args=["-T", "HaplotypeCaller"], chrom="1", pos=150, ref="A", alt="T")
+        args.update(kwargs)
+        return compute_result_key(**args)
+
+    def test_compute_result_key(self):
+        key = self.compute_key()
+        self.assertEqual(key, self.compute_key())
+
+        symlink_path = os.path.join(self.temp_dir, "link.bam")
+        os.symlink(self.bam_path, symlink_path)
+        self.assertEqual(key, self.compute_key(original_bam_path=symlink_path))
+
+        self.assertNotEqual(key, self.compute_key(calling_intervals=["1:100-300"]))
+        self.assertNotEqual(key, self.compute_key(hc_args=["-T", "HaplotypeCaller", "--minPruning", "3"]))
+        self.assertNotEqual(key, self.compute_key(alt="G"))
+
+        os.utime(self.bam_path, (0, 0))
+        self.assertNotEqual(key, self.compute_key())
+
+    def test_compute_result_key_depends_on_gvcf(self):
+        key = self.compute_key()
+
+        # a replaced GVCF might not match the cached bam
+        os.utime(self.gvcf_path, (0, 0))
+        gvcf_replaced_key = self.compute_key()
+        self.assertNotEqual(key, gvcf_replaced_key)
+
+        # the cached is_missing_original_gvcf is wrong once the GVCF or its index is removed
+        os.remove(self.gvcf_path + ".tbi")
+        self.assertNotEqual(gvcf_replaced_key, self.compute_key())
+        os.remove(self.gvcf_path)
+        self.assertNotEqual(gvcf_replaced_key, self.compute_key())
+
+    def test_result_cache(self):
+        cache = ResultCache(os.path.join(self.temp_dir, "cache"))
+        key = self.compute_key()
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, self.bam_path, {"hc_n_artificial_haplotypes": 2})
+        self.assertEqual(cache.get(key), {"hc_n_artificial_haplotypes": 2, "bam_size": 1})
+
+        output_bam_path = os.path.join(self.temp_dir, "output.bam")
+        cache.link(key, output_bam_path)
+        with open(output_bam_path) as f:
+            self.assertEqual(f.read(), "x")
+
+        # entries whose bam doesn't match the recorded size are ignored
+        with open(output_bam_path, "a") as f:
+            f.write("y")
+        self.assertIsNone(cache.get(key))
@@ -0,0 +1,51 @@
+import datetime
+import unittest
+from utils.runtime_prediction import compute_percentile, predict_runtime, will_next_unit_fit, get_runtimes_in_seconds, \
+    compute_eta
+
+
+class TestRuntimePrediction(unittest.TestCase):
+
+    def test_compute_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(compute_percentile(values, 50), 50)
+        self.assertEqual(compute_percentile(values, 90), 90)
+        self.assertEqual(compute_percentile(values, 100), 100)
+        self.assertEqual(compute_percentile(values, 0), 1)
+        self.assertEqual(compute_percentile([7], 90), 7)
+
+    def test_predict_runtime(self):
+        self.assertIsNone(predict_runtime([1, 2, 3], min_runtimes=10))
+        self.assertEqual(predict_runtime([10]*9 + [100], percentile=90, min_runtimes=10), 10)
+        self.assertEqual(predict_runtime([10]*9 + [100], percentile=100, min_runtimes=10), 100)
+
+    def test_will_next_unit_fit(self):
+        runtimes = [60]*20
+        self.assertTrue(will_next_unit_fit(100, 200, runtimes))
+        self.assertFalse(will_next_unit_fit(150, 200, runtimes))
+        self.assertTrue(will_next_unit_fit(150, 200, runtimes[:5]))  # not enough data to predict
+        self.assertFalse(will_next_unit_fit(250, 200, []))
+
+    def test_get_runtimes_in_seconds(self):
+        t = datetime.datetime(2016, 1, 1)
+        actual = get_runtimes_in_seconds([
+            (t, t + datetime.timedelta(minutes=2)),
+            (t, None),
+            (None, t),
+            (t + datetime.timedelta(minutes=1), t),
+        ])
+        self.assertListEqual(actual, [120.0])
+
+    def test_compute_eta(self):
+        # 30 finished in the last 60 minutes, 90 remaining, 10 in progress that take 20 minutes each
+        self.assertEqual(compute_eta(90, 30, 60, 10, 1200), (30.0, 3.0, 3.0))
+
+        # nothing finished recently, so there's no rate to estimate an ETA from
+        self.assertEqual(compute_eta(90, 0, 60, 10, None), (0.0, None, None))
+        self.assertEqual(compute_eta(90, 0, 60, 0, None), (0.0, None, None))
+
+        # nothing remaining
+        self.assertEqual(compute_eta(0, 0, 60), (0.0, 0.0, 0.0))
+
+        # sums from MySQL are None for empty tables
+        self.assertEqual(compute_eta(None, 0, 60, None, None), (0.0, 0.0, 0.0))
@@ -0,0 +1,17 @@
+import unittest
+from utils.sample_indexes import compute_sample_indexes
+
+
+class TestSampleIndexes(unittest.TestCase):
+
+    def test_compute_sample_indexes(self):
+        rows = [
+            (1, ("1", 100, "A", "T", "het"), None),
+            (4, ("1", 100, "A", "T", "het"), 1),
+            (7, ("1", 100, "A", "T", "het"), None),
+            (2, ("1", 100, "A", "T", "hom"), None),
+            (3, ("1", 200, "C", "G", "het"), 0),
+            (5, ("1", 200, "C", "G", "het"), None),
+        ]
+
+        self.assertListEqual(list(compute_sample_indexes(rows)), [(1, 0), (7, 2), (2, 0), (5, 1)])
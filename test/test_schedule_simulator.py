@@ -0,0 +1,45 @@
+import unittest
+from utils.schedule_simulator import retile_interval_runtimes, simulate_schedule
+
+
+class TestScheduleSimulator(unittest.TestCase):
+
+    def test_retile_interval_runtimes(self):
+        intervals = [
+            {"chrom": "1", "start_pos": 1, "end_pos": 100, "runtime": 110},
+            {"chrom": "1", "start_pos": 101, "end_pos": 200, "runtime": 30},
+            {"chrom": "1", "start_pos": 301, "end_pos": 350, "runtime": 60},
+        ]
+        self.assertListEqual(retile_interval_runtimes(intervals, 50, per_interval_overhead_seconds=10),
+            [60, 60, 20, 20, 60])
+        self.assertListEqual(retile_interval_runtimes(intervals, 200, per_interval_overhead_seconds=10),
+            [130, 60])
+
+    def test_simulate_schedule(self):
+        # 1 task, no collisions or time limit
+        result = simulate_schedule([10]*6, 1, time_limit_seconds=1000, exit_after_seconds=1000, claim_seconds=0)
+        self.assertEqual(result.makespan_seconds, 60)
+        self.assertEqual(result.useful_seconds, 60)
+        self.assertEqual(result.num_collisions, 0)
+
+        # tasks stop claiming after 25 seconds and are replaced after 5 seconds
+        result = simulate_schedule([10]*6, 1, time_limit_seconds=1000, exit_after_seconds=25, claim_seconds=0,
+                                   resubmit_delay_seconds=5)
+        self.assertEqual(result.makespan_seconds, 65)
+        self.assertEqual(result.num_tasks, 2)
+
+        # the 2nd interval doesn't fit before the time limit, so it's killed and redone by a new task
+        result = simulate_schedule([40, 40], 1, time_limit_seconds=50, exit_after_seconds=50, claim_seconds=0,
+                                   lease_seconds=100, resubmit_delay_seconds=5)
+        self.assertEqual(result.num_killed, 1)
+        self.assertEqual(result.killed_seconds, 10)
+        self.assertEqual(result.makespan_seconds, 190)
+
+        # intervals that can never finish
+        result = simulate_schedule([40, 60], 1, time_limit_seconds=50, exit_after_seconds=50, claim_seconds=0)
+        self.assertEqual(result.num_unfinished, 1)
+
+        # many tasks claiming from few intervals collide
+        result = simulate_schedule([10]*100, 50, time_limit_seconds=1000, exit_after_seconds=1000, claim_seconds=1)
+        self.assertGreater(result.num_collisions, 0)
+        self.assertEqual(result.useful_seconds, 1000)
@@ -0,0 +1,29 @@
+import unittest
+from utils.stage_timing import timed_stage, add_stage_seconds, reset_stage_timings, format_stage_timings, \
+    STAGE_TIMING_FIELDS
+
+
+class Record(object):
+    def __init__(self):
+        for field_name in STAGE_TIMING_FIELDS:
+            setattr(self, field_name, None)
+
+
+class TestStageTiming(unittest.TestCase):
+
+    def test_stage_timing(self):
+        record = Record()
+        add_stage_seconds(record, "claim", 0.5)
+        add_stage_seconds(record, "hc", 10)
+        add_stage_seconds(record, "hc", 2)
+        with timed_stage(record, "postprocess"):
+            pass
+
+        self.assertEqual(record.hc_seconds, 12)
+        self.assertGreaterEqual(record.postprocess_seconds, 0)
+        self.assertIsNone(record.gvcf_check_seconds)
+        self.assertEqual(format_stage_timings(record), "claim=0.5s hc=12.0s postprocess=0.0s")
+
+        reset_stage_timings(record)
+        self.assertEqual(record.claim_seconds, 0.5)
+        self.assertIsNone(record.hc_seconds)
@@ -0,0 +1,239 @@
+"""
+Utility methods for copying the regions of an original bam that HaplotypeCaller will need into a small local bam
+before HC runs. The original bams are on slow network filesystems, so the next samples' regions are copied in a
+background thread while HC is running on the current sample.
+"""
+
+import logging
+import os
+import threading
+import pysam
+
+from utils.downsampling import choose_reads_to_keep
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # python2
+
+# HC reads within the -L intervals plus --paddingAroundSNPs / --paddingAroundIndels (300bp), and the reads that
+# overlap them can extend further, so copy this much more on each side.
+STAGED_REGION_MARGIN = 1000
+
+
+def merge_regions(regions, margin=0, contig_order=None):
+    """Sorts and merges overlapping (chrom, start, end) regions after adding margin to each side.
+
+    Args:
+        regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates
+        margin: number of bases to add on each side
+        contig_order: (optional) list of contig names in the order they should be sorted in (eg. the references in
+            a bam header). Contigs that aren't in the list are sorted after the others by name. If not specified,
+            contigs are sorted by name.
+    Return:
+        sorted list of non-overlapping (chrom, start, end) tuples
+    """
+    contig_indexes = dict((chrom, i) for i, chrom in enumerate(contig_order or []))
+    regions = sorted((chrom, max(1, start - margin), end + margin) for chrom, start, end in regions)
+    regions.sort(key=lambda region: contig_indexes.get(region[0], len(contig_indexes)))
+
+    merged = []
+    for chrom, start, end in regions:
+        if merged and merged[-1][0] == chrom and start <= merged[-1][2] + 1:
+            merged[-1] = (chrom, merged[-1][1], max(merged[-1][2], end))
+        else:
+            merged.append((chrom, start, end))
+    return merged
+
+
+def stage_bam_regions(input_bam_path, output_bam_path, regions, margin=STAGED_REGION_MARGIN):
+    """Copies the reads that overlap the given regions from input_bam_path to a new indexed bam.
+
+    Args:
+        input_bam_path: indexed bam
+        output_bam_path: output bam path
+        regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates
+        margin: number of bases to add on each side of each region
+    Return:
+        the number of reads copied
+    """
+    ibam = pysam.AlignmentFile(input_bam_path, "rb")
+    obam = pysam.AlignmentFile(output_bam_path, "wb", template=ibam)
+
+    # the regions are copied in the order of the bam header so that the output bam is sorted and can be indexed
+    reads_copied = 0
+    previous_region = None
+    for chrom, start, end in merge_regions(regions, margin, contig_order=ibam.references):
+        for r in ibam.fetch(chrom, start - 1, end):
+            # reads that start within the previous region were already copied
+            if previous_region is not None and previous_region[0] == chrom and r.reference_start < previous_region[2]:
+                continue
+            obam.write(r)
+            reads_copied += 1
+        previous_region = (chrom, start, end)
+
+    obam.close()
+    ibam.close()
+    pysam.index(output_bam_path)
+
+    return reads_copied
+
+
+def downsample_bam_regions(input_bam_path, output_bam_path, regions, max_depth, seed, variant_regions=(),
+                           margin=STAGED_REGION_MARGIN):
+    """Like stage_bam_regions(..), but only copies enough reads to cover each position at most max_depth times (see
+    utils/downsampling.py).
+
+    Args:
+        input_bam_path: indexed bam
+        output_bam_path: output bam path
+        regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates
+        max_depth: max read depth in the output bam
+        seed: string that determines which reads are chosen (eg. the sample id and variants)
+        variant_regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates. Reads that span a
+            variant are chosen first.
+        margin: number of bases to add on each side of each region
+    Return:
+        2-tuple (the number of reads copied, list of (chrom, start, end) tuples with the 0-based half-open alignment
+            coordinates of the reads that were left out)
+    """
+    ibam = pysam.AlignmentFile(input_bam_path, "rb")
+
+    reads = []
+    previous_region = None
+    for chrom, start, end in merge_regions(regions, margin, contig_order=ibam.references):
+        for r in ibam.fetch(chrom, start - 1, end):
+            # reads that start within the previous region were already read
+            if previous_region is not None and previous_region[0] == chrom and r.reference_start < previous_region[2]:
+                continue
+            reads.append(r)
+        previous_region = (chrom, start, end)
+
+    reads_to_keep = choose_reads_to_keep([
+        (r.query_name, r.reference_name, None, None) if r.is_unmapped else
+        (r.query_name, r.reference_name, r.reference_start, r.reference_end) for r in reads
+    ], max_depth, seed, variant_regions)
+
+    obam = pysam.AlignmentFile(output_bam_path, "wb", template=ibam)
+    for read_i, r in enumerate(reads):
+        if read_i in reads_to_keep:
+            obam.write(r)
+
+    obam.close()
+    ibam.close()
+    pysam.index(output_bam_path)
+
+    reads_left_out = [(r.reference_name, r.reference_start, r.reference_end) for read_i, r in enumerate(reads)
+                      if read_i not in reads_to_keep]
+
+    return len(reads_to_keep), reads_left_out
+
+
+class BamPrefetcher(object):
+    """Copies bam regions into local bams in a background thread.
+
+    Example:
+        prefetcher = BamPrefetcher("/tmp")
+        prefetcher.prefetch("sample1", "/network/sample1.bam", [("1", 12345, 12400)])
+        ...
+        local_bam_path = prefetcher.get("sample1")  # waits for the copy to finish. None if it failed.
+        ...
+        prefetcher.release("sample1")  # deletes the local bam
+        ...
+        prefetcher.stop()  # stops the background thread and deletes local bams that weren't released
+    """
+
+    def __init__(self, scratch_dir, region_cache=None):
+        """
+        Args:
+            scratch_dir: local directory for the copies
+            region_cache: optional BamRegionCache (see utils/bam_region_cache.py) to get the copies from
+        """
+        self.scratch_dir = scratch_dir
+        self.region_cache = region_cache
+        self._requests = queue.Queue()
+        self._results = {}  # maps key to local bam path (or None if staging failed)
+        self._done = {}  # maps key to threading.Event
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._thread = threading.Thread(target=self._run, name="BamPrefetcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prefetch(self, key, bam_path, regions):
+        """Starts copying the given regions of bam_path into a local bam.
+
+        Args:
+            key: used to get(..) the local bam
+            bam_path: original bam
+            regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates
+        """
+        with self._lock:
+            self._counter += 1
+            local_bam_path = os.path.join(self.scratch_dir, "prefetched.%s.%s.bam" % (os.getpid(), self._counter))
+            self._done[key] = threading.Event()
+        self._requests.put((key, bam_path, regions, local_bam_path))
+
+    def get(self, key):
+        """Waits for the prefetch(..) with this key to finish.
+
+        Return:
+            the local bam path, or None if the key wasn't prefetched or copying failed
+        """
+        done = self._done.get(key)
+        if done is None:
+            return None
+        done.wait()
+        return self._results.get(key)
+
+    def release(self, key):
+        """Deletes the local bam for the given key"""
+        local_bam_path = self.get(key)
+        with self._lock:
+            self._done.pop(key, None)
+            self._results.pop(key, None)
+        if local_bam_path is not None and self.region_cache is not None:
+            self.region_cache.release(local_bam_path)
+        elif local_bam_path is not None:
+            for path in (local_bam_path, local_bam_path + ".bai"):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def stop(self):
+        """Waits for the prefetch(..) that's running (if any) to finish, then stops the background thread and
+        releases all local bams. Requests that haven't started yet are dropped."""
+        while True:
+            try:
+                key, _, _, _ = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            self._done[key].set()  # so that release(..) doesn't wait for it
+
+        self._requests.put(None)
+        self._thread.join()
+
+        for key in list(self._done.keys()):
+            self.release(key)
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return  # see stop()
+            key, bam_path, regions, local_bam_path = request
+            try:
+                if self.region_cache is not None:
+                    self._results[key] = self.region_cache.get(bam_path, regions)
+                    continue
+
+                reads_copied = stage_bam_regions(bam_path, local_bam_path, regions)
+                logging.info("prefetched %s reads from %s to %s" % (reads_copied, bam_path, local_bam_path))
+                self._results[key] = local_bam_path
+            except Exception as e:
+                logging.warning("couldn't prefetch %s: %s" % (bam_path, e))
+                for path in (local_bam_path, local_bam_path + ".bai"):
+                    if os.path.isfile(path):
+                        os.remove(path)
+                self._results[key] = None
+            finally:
+                self._done[key].set()
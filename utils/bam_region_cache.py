@@ -0,0 +1,125 @@
+"""
+Node-local cache of bams that contain only the regions of an original bam that HaplotypeCaller needs (see
+utils/bam_prefetcher.py). The same sample is often reassembled at several nearby variants, so a region copied for one
+variant can be reused for the next ones instead of reading the original bam from the network filesystem again.
+
+Cached bams are keyed by the original bam's resolved path and modification time, so a cached copy is never used after
+the original bam is replaced. When the cache is larger than its size limit, the least recently used bams are deleted.
+"""
+
+import collections
+import logging
+import os
+import threading
+
+from utils.bam_prefetcher import merge_regions, stage_bam_regions, STAGED_REGION_MARGIN
+
+
+def are_regions_covered(regions, cached_regions):
+    """Returns True if each (chrom, start, end) region in regions is contained in one of the cached_regions"""
+    for chrom, start, end in regions:
+        if not any(c == chrom and s <= start and end <= e for c, s, e in cached_regions):
+            return False
+    return True
+
+
+class BamRegionCache(object):
+    """Size-bounded LRU cache of local bams. Thread-safe.
+
+    Example:
+        cache = BamRegionCache("/local/scratch", max_bytes=10*1024**3)
+        local_bam_path = cache.get("/network/sample1.bam", [("1", 12345, 12400)])
+        ... run HC on local_bam_path ...
+        cache.release(local_bam_path)
+    """
+
+    def __init__(self, cache_dir, max_bytes, margin=STAGED_REGION_MARGIN):
+        """
+        Args:
+            cache_dir: local directory for the cached bams
+            max_bytes: max total size of cached bams. Bams that are in use are never deleted, so the cache can
+                temporarily be larger than this.
+            margin: number of bases to add on each side of each region
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.margin = margin
+        self._entries = collections.OrderedDict()  # maps local bam path to entry dict, least recently used first
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.hits = self.misses = 0
+
+    def get(self, bam_path, regions):
+        """Returns a local bam that contains the reads of bam_path in the given regions, copying them if they're not
+        cached yet. The returned bam won't be deleted until it's passed to release(..).
+
+        Args:
+            bam_path: original bam
+            regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates
+        Return:
+            local bam path
+        """
+        resolved_bam_path = os.path.realpath(bam_path)
+        key = (resolved_bam_path, os.path.getmtime(resolved_bam_path))
+        requested_regions = merge_regions(regions, self.margin)
+
+        with self._lock:
+            for local_bam_path, entry in self._entries.items():
+                if entry["key"] == key and are_regions_covered(requested_regions, entry["regions"]):
+                    entry["in_use"] += 1
+                    self._entries[local_bam_path] = self._entries.pop(local_bam_path)  # move to the end
+                    self.hits += 1
+                    return local_bam_path
+
+            self.misses += 1
+            self._counter += 1
+            local_bam_path = os.path.join(self.cache_dir, "cached.%s.%s.bam" % (os.getpid(), self._counter))
+
+        try:
+            stage_bam_regions(resolved_bam_path, local_bam_path, regions, self.margin)
+        except Exception:
+            for path in (local_bam_path, local_bam_path + ".bai"):
+                if os.path.isfile(path):
+                    os.remove(path)
+            raise
+        size = sum(os.path.getsize(path) for path in (local_bam_path, local_bam_path + ".bai") if os.path.isfile(path))
+
+        with self._lock:
+            self._entries[local_bam_path] = {"key": key, "regions": requested_regions, "size": size, "in_use": 1}
+            self._evict()
+
+        return local_bam_path
+
+    def release(self, local_bam_path):
+        """Lets the given bam be deleted when the cache is full"""
+        with self._lock:
+            entry = self._entries.get(local_bam_path)
+            if entry is not None:
+                entry["in_use"] -= 1
+            self._evict()
+
+    def clear(self):
+        """Deletes all cached bams"""
+        with self._lock:
+            for local_bam_path in list(self._entries):
+                self._delete(local_bam_path)
+        logging.info("bam region cache: %s hits, %s misses" % (self.hits, self.misses))
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def _evict(self):
+        total_bytes = self.total_bytes()
+        for local_bam_path, entry in list(self._entries.items()):
+            if total_bytes <= self.max_bytes:
+                break
+            if entry["in_use"] > 0:
+                continue
+            total_bytes -= entry["size"]
+            self._delete(local_bam_path)
+
+    def _delete(self, local_bam_path):
+        del self._entries[local_bam_path]
+        for path in (local_bam_path, local_bam_path + ".bai"):
+            if os.path.isfile(path):
+                os.remove(path)
@@ -0,0 +1,257 @@
+"""
+Executors for submitting parallelize.py array jobs and counting how many of their tasks are still alive, plus a
+supervisor loop that uses them to keep a target number of tasks running until all the work is done.
+
+SGEExecutor and LSFExecutor submit to the cluster. LocalExecutor is a stand-in that launches each array job task as a
+local subprocess, for testing the supervisor without a cluster.
+"""
+
+import abc
+import logging
+import os
+import re
+import subprocess
+import time
+
+
+# how long an array job task can run in each queue before the scheduler kills it
+QUEUE_TIME_LIMIT_HOURS = {
+    "SGE": {"short": 4},
+    "LSF": {"hour": 1},
+}
+DEFAULT_QUEUES = {"SGE": "short", "LSF": "hour"}  # the queues that SGEExecutor and LSFExecutor submit to
+
+
+def get_queue_time_limit_hours(environ=None):
+    """Returns the time limit of the cluster queue that this process is running in, based on the environment
+    variables set by the scheduler.
+
+    Args:
+        environ: dict of environment variables (default: os.environ)
+    Return:
+        the time limit in hours, or None if this process isn't running in a cluster job (eg. with --run-local). If
+        the queue isn't known, the limit of the queue that the executors submit to by default is returned.
+    """
+    environ = os.environ if environ is None else environ
+    if environ.get("LSB_JOBID"):
+        scheduler, queue = "LSF", environ.get("LSB_QUEUE")
+    elif environ.get("JOB_ID"):
+        scheduler, queue = "SGE", environ.get("QUEUE")
+    else:
+        return None
+
+    limits = QUEUE_TIME_LIMIT_HOURS[scheduler]
+    return limits.get(queue, limits[DEFAULT_QUEUES[scheduler]])
+
+
+def get_array_job_task_id(environ=None):
+    """Returns the task id of the array job task that this process is running in, based on the environment variables
+    set by the scheduler.
+
+    Args:
+        environ: dict of environment variables (default: os.environ)
+    Return:
+        the task id as a string, or None if this process isn't running in an array job task. SGE sets SGE_TASK_ID to
+        'undefined' and LSF sets LSB_JOBINDEX to 0 in jobs that aren't array jobs.
+    """
+    environ = os.environ if environ is None else environ
+    if environ.get("SGE_TASK_ID") not in (None, "", "undefined"):
+        return environ["SGE_TASK_ID"]
+    if environ.get("LSB_JOBINDEX") not in (None, "", "0"):
+        return environ["LSB_JOBINDEX"]
+    return None
+
+
+# base class with abc.ABCMeta as its metaclass, in a way that works in both python 2 and 3
+_AbstractBase = abc.ABCMeta("_AbstractBase", (object,), {})
+
+
+class ClusterExecutor(_AbstractBase):
+    """Interface for submitting array jobs and checking on their tasks."""
+
+    @abc.abstractmethod
+    def submit_array_job(self, task_command, num_tasks, log_dir):
+        """Submits an array job that runs task_command in num_tasks tasks.
+
+        Args:
+            task_command: the command each array job task should run
+            num_tasks: number of array job tasks
+            log_dir: directory for the tasks' log files
+        Return:
+            the job id
+        """
+
+    @abc.abstractmethod
+    def count_live_tasks(self, job_ids):
+        """Returns the total number of pending or running tasks in the given array jobs."""
+
+
+def parse_sge_task_ids(task_ids):
+    """Returns the number of tasks in an SGE ja-task-ID column value like '7', '1-10:1' or '3,5-9:2'."""
+    num_tasks = 0
+    for task_range in task_ids.split(","):
+        match = re.match(r"^(\d+)(?:-(\d+)(?::(\d+))?)?$", task_range)
+        if not match:
+            raise ValueError("Unexpected SGE task id: %s" % task_ids)
+        first, last, step = match.groups()
+        if last is None:
+            num_tasks += 1
+        else:
+            num_tasks += (int(last) - int(first)) // int(step or 1) + 1
+
+    return num_tasks
+
+
+class SGEExecutor(ClusterExecutor):
+
+    def __init__(self, queue=DEFAULT_QUEUES["SGE"], memory="4g"):
+        self.queue = queue
+        self.memory = memory
+
+    def submit_array_job(self, task_command, num_tasks, log_dir):
+        cmd = ("qsub -q %(queue)s "
+            "-t 1-%(num_tasks)s "
+            "-cwd "
+            "-l h_vmem=%(memory)s -l m_mem_free=%(memory)s "
+            "-o %(log_dir)s "
+            "-e %(log_dir)s "
+            "-j y -V "
+            "./run_python.sh %(task_command)s") % {
+                "queue": self.queue, "num_tasks": num_tasks, "memory": self.memory, "log_dir": log_dir,
+                "task_command": task_command}
+
+        logging.info("Running: %s" % cmd)
+        output = subprocess.check_output(cmd, shell=True).decode()
+
+        # eg. 'Your job-array 1234567.1-10:1 ("run_python.sh") has been submitted'
+        match = re.search(r"Your job(?:-array)? (\d+)", output)
+        if not match:
+            raise ValueError("Couldn't parse job id from qsub output: %s" % output)
+        return match.group(1)
+
+    def count_live_tasks(self, job_ids):
+        job_ids = set(str(job_id) for job_id in job_ids)
+        output = subprocess.check_output("qstat", shell=True).decode()
+
+        num_live_tasks = 0
+        for line in output.split("\n"):
+            fields = line.split()
+            if not fields or fields[0] not in job_ids:
+                continue
+            # pending tasks of an array job are listed together in the last column (eg. '1-10:1')
+            num_live_tasks += parse_sge_task_ids(fields[-1])
+
+        return num_live_tasks
+
+
+class LSFExecutor(ClusterExecutor):
+
+    def __init__(self, queue=DEFAULT_QUEUES["LSF"], job_name="prog"):
+        self.queue = queue
+        self.job_name = job_name
+
+    def submit_array_job(self, task_command, num_tasks, log_dir):
+        cmd = "bsub -N -J %(job_name)s[1-%(num_tasks)s] -o %(log_dir)s -q %(queue)s %(task_command)s" % {
+            "job_name": self.job_name, "num_tasks": num_tasks, "log_dir": log_dir, "queue": self.queue,
+            "task_command": task_command}
+
+        logging.info("Running: %s" % cmd)
+        output = subprocess.check_output(cmd, shell=True).decode()
+
+        # eg. 'Job <1234567> is submitted to queue <hour>.'
+        match = re.search(r"Job <(\d+)>", output)
+        if not match:
+            raise ValueError("Couldn't parse job id from bsub output: %s" % output)
+        return match.group(1)
+
+    def count_live_tasks(self, job_ids):
+        if not job_ids:
+            return 0
+
+        # bjobs prints one line per array job element: JOBID USER STAT QUEUE ...
+        output = subprocess.check_output("bjobs -noheader %s 2>/dev/null; true" % " ".join(map(str, job_ids)),
+                                         shell=True).decode()
+        num_live_tasks = 0
+        for line in output.split("\n"):
+            fields = line.split()
+            if len(fields) > 2 and fields[2] not in ("DONE", "EXIT"):
+                num_live_tasks += 1
+
+        return num_live_tasks
+
+
+class LocalExecutor(ClusterExecutor):
+    """Runs each array job task as a local subprocess, with the same environment variables an SGE task would get."""
+
+    def __init__(self):
+        self.processes_by_job_id = {}
+        self._next_job_id = 1
+
+    def submit_array_job(self, task_command, num_tasks, log_dir):
+        job_id = "%s%03d" % (os.getpid(), self._next_job_id)
+        self._next_job_id += 1
+
+        processes = []
+        for task_id in range(1, num_tasks + 1):
+            env = dict(os.environ)
+            env["JOB_ID"] = job_id
+            env["SGE_TASK_ID"] = str(task_id)
+            log_path = os.path.join(log_dir, "local_job%s.%s.log" % (job_id, task_id))
+            with open(log_path, "w") as log_file:
+                processes.append(subprocess.Popen(task_command, shell=True, env=env, stdout=log_file,
+                                                  stderr=subprocess.STDOUT))
+
+        logging.info("Launched %s local tasks for job %s: %s" % (num_tasks, job_id, task_command))
+        self.processes_by_job_id[job_id] = processes
+        return job_id
+
+    def count_live_tasks(self, job_ids):
+        return sum(1 for job_id in job_ids for process in self.processes_by_job_id.get(job_id, [])
+                   if process.poll() is None)
+
+
+def compute_num_tasks_to_submit(num_claimable, num_live_tasks, target_num_tasks):
+    """Returns how many new tasks to submit to get back up to target_num_tasks, without launching more tasks than
+    there is unclaimed work for.
+    """
+    return max(0, min(target_num_tasks - num_live_tasks, num_claimable))
+
+
+def run_supervisor(executor, task_command, target_num_tasks, log_dir, get_progress, poll_interval_seconds=300,
+                   job_ids=(), should_stop=lambda: False):
+    """Keeps target_num_tasks array job tasks alive until there's no work left, resubmitting tasks as they exit
+    (eg. after reaching the queue time limit). Intervals from tasks that died are released by their expired leases,
+    so they just show up as claimable work.
+
+    Args:
+        executor: ClusterExecutor
+        task_command: the command each array job task should run
+        target_num_tasks: how many tasks should be running at a time
+        log_dir: directory for the tasks' log files
+        get_progress: function that returns a 2-tuple (num_claimable, num_in_progress) with the current number of
+            units of work that can be claimed, and that are claimed and currently being processed
+        poll_interval_seconds: how often to check progress
+        job_ids: ids of previously-submitted array jobs whose tasks count towards target_num_tasks
+        should_stop: function that returns True if the supervisor should exit (eg. after Ctrl-C)
+    Return:
+        list of all job ids submitted by or passed to the supervisor
+    """
+    job_ids = list(job_ids)
+    while not should_stop():
+        num_claimable, num_in_progress = get_progress()
+        num_live_tasks = executor.count_live_tasks(job_ids)
+        logging.info("supervisor: %s claimable, %s in progress, %s live tasks" % (
+            num_claimable, num_in_progress, num_live_tasks))
+
+        if num_claimable == 0 and num_in_progress == 0:
+            logging.info("supervisor: all work is done. Exiting..")
+            break
+
+        num_tasks_to_submit = compute_num_tasks_to_submit(num_claimable, num_live_tasks, target_num_tasks)
+        if num_tasks_to_submit > 0:
+            logging.info("supervisor: submitting %s new tasks" % num_tasks_to_submit)
+            job_ids.append(executor.submit_array_job(task_command, num_tasks_to_submit, log_dir))
+
+        time.sleep(poll_interval_seconds)
+
+    return job_ids
@@ -0,0 +1,67 @@
+"""
+Utility methods for running a long-running command while streaming its output into the log, instead of buffering
+all of it in memory like subprocess.check_output(..) does.
+"""
+
+import collections
+import logging
+import subprocess
+
+
+def run_command_and_stream_output(cmd_args, markers=(), tail_lines=200, log_prefix="      "):
+    """Runs the given command, logging each line of its stdout and stderr as soon as it's printed. Only the last
+    tail_lines lines are kept in memory.
+
+    Args:
+        cmd_args: list of command-line args (eg. ['python', 'some_script.py', '--chrom', 'X'])
+        markers: strings to look for in the output (eg. completion messages)
+        tail_lines: how many of the last lines of output to keep
+        log_prefix: prepended to each line in the log
+    Return:
+        3-tuple (returncode, output_tail, markers_seen) where output_tail is a string with the last tail_lines
+        lines of output and markers_seen is the set of markers that appeared in the output.
+    """
+    process = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        lines = (line.decode("utf-8", "replace") for line in iter(process.stdout.readline, b""))
+        output_tail, markers_seen = scan_output_lines(lines, markers, tail_lines, log_prefix=log_prefix)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    return returncode, output_tail, markers_seen
+
+
+def read_output_tail(output_path, markers=(), tail_lines=200):
+    """Reads a command's output from a log file without loading the whole file into memory.
+
+    Return:
+        2-tuple (output_tail, markers_seen) - see run_command_and_stream_output(..)
+    """
+    with open(output_path) as f:
+        return scan_output_lines(f, markers, tail_lines)
+
+
+def scan_output_lines(lines, markers=(), tail_lines=200, log_prefix=None):
+    """Goes through the given lines of output, keeping the last tail_lines lines and checking for markers.
+
+    Args:
+        lines: iterable over lines of output
+        markers: strings to look for
+        tail_lines: how many of the last lines to keep
+        log_prefix: if not None, log each line with this prefix
+    Return:
+        2-tuple (output_tail, markers_seen)
+    """
+    output_tail = collections.deque(maxlen=tail_lines)
+    markers_seen = set()
+    for line in lines:
+        line = line.rstrip()
+        if log_prefix is not None:
+            logging.info("%s%s" % (log_prefix, line))
+        output_tail.append(line)
+        for marker in markers:
+            if marker in line:
+                markers_seen.add(marker)
+
+    return "\n".join(output_tail), markers_seen
@@ -13,6 +13,23 @@ BIN_DIR_PREFIX = os.path.join(DATA_DIR_PREFIX, 'bin')
 BAM_OUTPUT_DIR = "/humgen/atgu1/fs03/weisburd/exac_readviz_output/"
 
 EXIT_UGER_JOB_AFTER_N_HOURS = 0.5    # if running a processing loop in a UGER job, exit after this many hours to avoid getting killed by the short queue time limit.
+UGER_SHORT_QUEUE_TIME_LIMIT_HOURS = 4  # UGER short queue jobs get killed after running this long
+RUNTIME_PREDICTION_PERCENTILE = 90  # only start the next interval or sample if this percentile of previous runtimes fits in the remaining time
+
+# workers renew the lease on the interval or sample they're processing every CLAIM_HEARTBEAT_INTERVAL_MINUTES. If a
+# worker dies, its interval or sample can be claimed by another worker once the lease expires.
+CLAIM_LEASE_DURATION_MINUTES = 10
+CLAIM_HEARTBEAT_INTERVAL_MINUTES = 2
+
+# a sample that's been claimed this many times without a result (eg. because processing it raises an unexpected
+# exception or kills the worker every time) is marked as failed instead of being claimed again
+MAX_CLAIM_ATTEMPTS = 3
+
+# with parallelize.py --max-concurrent-intervals, only start another interval command if there's this much free memory
+MEMORY_PER_INTERVAL_COMMAND_GB = 8  # HaplotypeCaller runs with -Xmx7500m
+
+HC_MAX_HEAP_SIZE_MB = 7500  # HaplotypeCaller -Xmx
+HC_JVM_OVERHEAD_MB = 500  # memory used by a HaplotypeCaller JVM in addition to its heap
 
 # how many samples to show per het, hom-alt or hemizygous variant in the exac browser.
 MAX_SAMPLES_TO_SHOW_PER_VARIANT = 5
@@ -45,6 +62,9 @@ GATK_JAR_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__f
 #    "bin/GATK_noMQ0sInBamout_fixRealign.jar"))
      "bin/GATK_readVizFix_071116.jar"))
 
+# java/GatkWorker.java compiled with: javac -cp <GATK_JAR_PATH> -d bin/gatk_worker java/GatkWorker.java
+GATK_WORKER_CLASS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "bin/gatk_worker"))
+
 TCGA_NEW_BAM_PATHS = os.path.join(DATA_DIR_PREFIX, "TCGA_external_cghublink_all.tsv")
 
 # used for igv screenshots
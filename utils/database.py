@@ -1,7 +1,10 @@
+import datetime
 import logging
 import peewee
+import playhouse.migrate
 import playhouse.pool
 from utils.constants import MAX_ALLELE_SIZE, MAX_VCF_SAMPLE_ID_SIZE, DB_HOST, DB_PORT, DB_USER
+from utils.leases import get_fields_to_save, UNCLAIMED_LEASE_EXPIRATION
 
 # disable peewee warning messages
 logging.getLogger('peewee').setLevel(logging.ERROR)
@@ -100,6 +103,8 @@ class Sample(_SharedVariantFields):
 
     calling_interval_start = peewee.IntegerField(default=None, null=True)
     calling_interval_end = peewee.IntegerField(default=None, null=True)
+    hc_window_level = peewee.IntegerField(default=None, null=True)  # see utils/hc_window.py
+    input_reads_dropped = peewee.IntegerField(default=None, null=True)  # see enable_downsampling(..) in utils/haplotype_caller.py
 
     hc_error_code = peewee.IntegerField(default=None, index=True, null=True)
     hc_error_text = peewee.TextField(default=None, null=True)
@@ -108,6 +113,25 @@ class Sample(_SharedVariantFields):
     hc_n_artificial_haplotypes = peewee.IntegerField(default=None, index=True, null=True)
     hc_n_artificial_haplotypes_deleted = peewee.IntegerField(default=None, index=True, null=True)
 
+    # wall time of each stage of processing the sample (see utils/stage_timing.py), and the runtime GATK reported.
+    # For batched HC runs, the HC run's time is split evenly between its samples.
+    claim_seconds = peewee.FloatField(default=None, null=True)
+    interval_lookup_seconds = peewee.FloatField(default=None, null=True)
+    hc_seconds = peewee.FloatField(default=None, null=True)
+    gatk_runtime_seconds = peewee.FloatField(default=None, null=True)
+    gvcf_check_seconds = peewee.FloatField(default=None, null=True)
+    postprocess_seconds = peewee.FloatField(default=None, null=True)
+    db_save_seconds = peewee.FloatField(default=None, null=True)
+
+    # backup samples (sample_i >= MAX_SAMPLES_TO_SHOW_PER_VARIANT) start out inactive, and are only claimed once they're
+    # activated because one of the variant's other samples failed (see utils/sample_indexes.py)
+    is_inactive_backup = peewee.BooleanField(default=0)
+
+    # while a sample is being processed, the worker keeps renewing this lease. If the worker dies, the lease expires
+    # and the sample can be claimed again (see utils/leases.py)
+    lease_expires = peewee.DateTimeField(default=UNCLAIMED_LEASE_EXPIRATION, null=True, index=True)
+    claim_attempts = peewee.IntegerField(default=0)  # see MAX_CLAIM_ATTEMPTS
+
     #screenshot_started = peewee.BooleanField(default=0)
     #screenshot_finished = peewee.BooleanField(default=0)
 
@@ -116,8 +140,37 @@ class Sample(_SharedVariantFields):
             (('started', 'finished'), False),
             (('chrom', 'started', 'finished'), False),
             (('chrom', 'pos', 'ref', 'alt', 'het_or_hom_or_hemi', 'sample_id'), True), # True means unique index
+            (('finished', 'priority'), False),  # for claiming samples in priority order
         )
 
+    def save(self, *args, **kwargs):
+        # don't overwrite lease_expires since it may have been renewed by a heartbeat after this record was loaded
+        if self.id is not None and not kwargs.get("only"):
+            kwargs["only"] = get_fields_to_save(self)
+        return super(Sample, self).save(*args, **kwargs)
+
+
+# resources used by each run of a JVM child process (eg. a HaplotypeCaller run, or Picard SortSam for a combine_bams
+# bin), for tuning heap sizes and concurrency (see scripts/recommend_jvm_settings.py)
+class ChildProcessUsage(_SharedMeta):
+    program = peewee.CharField(max_length=30, index=True)  # eg. "HaplotypeCaller" or "SortSam"
+    label = peewee.CharField(max_length=100, null=True)  # what it ran on (eg. Sample record ids, or a bin)
+    num_samples = peewee.IntegerField(null=True)
+    hostname = peewee.CharField(max_length=100, null=True)
+    max_heap_mb = peewee.IntegerField(null=True)  # the -Xmx setting, if known
+    num_concurrent = peewee.IntegerField(null=True)  # how many commands were running in the same process
+
+    wall_seconds = peewee.FloatField(null=True)
+    cpu_seconds = peewee.FloatField(null=True)
+    peak_rss_mb = peewee.FloatField(null=True)
+    # if the command ran in a long-lived GATK worker (see utils/gatk_worker.py), peak_rss_mb is the worker's peak
+    # over all commands it ran so far, not this command's
+    ran_in_worker = peewee.BooleanField(default=0)
+    read_mb = peewee.FloatField(null=True)
+    write_mb = peewee.FloatField(null=True)
+
+    created_time = peewee.DateTimeField(default=datetime.datetime.now, index=True)
+
 
 def _create_table(model, fail_silently=True):
     """Utility method for creating a database table and indexes that is a
@@ -156,10 +209,53 @@ def _create_table(model, fail_silently=True):
         db.execute_sql(q)
 
 
+def add_missing_columns(model):
+    """Adds columns (and their indexes) for any fields that were added to the model after its table was created.
+
+    Args:
+      model: subclass of peewee.Model whose table already exists
+    """
+    db = model._meta.database
+    table_name = model._meta.db_table
+    existing_columns = set(column.name for column in db.get_columns(table_name))
+
+    migrator = playhouse.migrate.MySQLMigrator(db)
+    for field in model._meta.sorted_fields:
+        if field.db_column in existing_columns:
+            continue
+        logging.info("%s: adding column %s" % (table_name, field.db_column))
+        operations = [migrator.add_column(table_name, field.db_column, field)]
+        if field.index:
+            operations.append(migrator.add_index(table_name, (field.db_column,), field.unique))
+        playhouse.migrate.migrate(*operations)
+
+
+def add_missing_indexes(model):
+    """Creates any compound indexes from the model's Meta.indexes that were added after its table was created.
+
+    Args:
+      model: subclass of peewee.Model whose table already exists
+    """
+    db = model._meta.database
+    table_name = model._meta.db_table
+    existing_indexes = set(tuple(index.columns) for index in db.get_indexes(table_name))
+
+    for columns, unique in model._meta.indexes:
+        if tuple(columns) in existing_indexes:
+            continue
+        logging.info("%s: adding index on %s" % (table_name, ", ".join(columns)))
+        db.create_index(model, [model._meta.fields[c] for c in columns], unique)
+
+
 def init_db():
     _create_table(ExacCallingInterval, fail_silently=True)
     _create_table(Variant, fail_silently=True)
     _create_table(Sample, fail_silently=True)
+    _create_table(ChildProcessUsage, fail_silently=True)
+
+    add_missing_columns(Sample)
+    add_missing_indexes(Sample)
+    add_missing_columns(ChildProcessUsage)
 
     #_readviz_db.connect()
 
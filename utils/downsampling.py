@@ -0,0 +1,76 @@
+"""
+Utility methods for capping the read depth of HaplotypeCaller's input at ultra-deep loci. Some exome targets have
+thousands of reads per sample, which makes HC much slower than usual, while the browser only shows a few of the reads.
+
+Reads are chosen deterministically: each read gets a pseudo-random score from a hash of its name and a seed (eg. the
+sample and variant), so re-running HC on the same sample and variant gives the same reads. Both mates of a pair are
+kept or left out together. Reads that span the variant are chosen first. The GVCF check (see utils/check_gvcf.py) still
+catches genotype changes caused by downsampling.
+"""
+
+import hashlib
+
+
+def get_read_score(seed, read_name):
+    """Returns a pseudo-random integer for the given read that only depends on seed and read_name"""
+    return int(hashlib.md5(("%s:%s" % (seed, read_name)).encode("utf-8")).hexdigest()[:12], 16)
+
+
+def is_spanning_read(chrom, start, end, variant_regions):
+    """Returns True if the read covers all bases of one of the variant_regions.
+
+    Args:
+        chrom, start, end: read alignment with 0-based half-open coordinates
+        variant_regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates
+    """
+    return any(c == chrom and start < s and end >= e for c, s, e in variant_regions)
+
+
+def choose_reads_to_keep(reads, max_depth, seed, variant_regions=()):
+    """Chooses which reads to keep so that no position is covered by more than max_depth of the kept reads. Reads with
+    the same name (eg. both mates of a pair) are kept or left out together.
+
+    Args:
+        reads: list of (read_name, chrom, start, end) tuples with 0-based half-open alignment coordinates. start and
+            end are None for unaligned reads, which are always kept since they don't add to the depth.
+        max_depth: max number of kept reads that cover any position
+        seed: string that determines the choice of reads (eg. the sample id and variant)
+        variant_regions: list of (chrom, start, end) tuples with 1-based inclusive coordinates. Reads that span a
+            variant are chosen before other reads.
+    Return:
+        set of the indexes of the reads to keep
+    """
+    kept = set()
+    fragments = {}  # maps read name to the indexes of its aligned reads
+    is_spanning = set()  # names of the fragments that have a read that spans a variant
+    bounds = {}  # maps chrom to the (min start, max end) of its reads
+    for read_i, (read_name, chrom, start, end) in enumerate(reads):
+        if start is None or end is None:
+            kept.add(read_i)
+            continue
+        fragments.setdefault(read_name, []).append(read_i)
+        if is_spanning_read(chrom, start, end, variant_regions):
+            is_spanning.add(read_name)
+        min_start, max_end = bounds.get(chrom, (start, end))
+        bounds[chrom] = (min(min_start, start), max(max_end, end))
+
+    candidates = [(read_name not in is_spanning, get_read_score(seed, read_name), read_indexes)
+                  for read_name, read_indexes in fragments.items()]
+
+    depth = dict((chrom, [0] * (max_end - min_start + 1)) for chrom, (min_start, max_end) in bounds.items())
+    for _, _, read_indexes in sorted(candidates):
+        # the depth that the fragment's reads would add at each position. Overlapping mates both count.
+        added_depth = {}
+        for read_i in read_indexes:
+            _, chrom, start, end = reads[read_i]
+            offset = bounds[chrom][0]
+            for i in range(start - offset, end - offset):
+                added_depth[(chrom, i)] = added_depth.get((chrom, i), 0) + 1
+
+        if any(depth[chrom][i] + n > max_depth for (chrom, i), n in added_depth.items()):
+            continue
+        for (chrom, i), n in added_depth.items():
+            depth[chrom][i] += n
+        kept.update(read_indexes)
+
+    return kept
@@ -1,4 +1,5 @@
 import os
+import shutil
 import time
 
 
@@ -32,3 +33,51 @@ def does_file_exist(file_path, num_retries=3, use_cache=True):
         if use_cache:
             _missing_files_cache.add(file_path)
         return False
+
+
+def publish_file(source_path, destination_path):
+    """Moves source_path to destination_path so that the file appears at destination_path all at once, even if
+    source_path is on a different filesystem (eg. node-local scratch vs. NFS). The file is first copied to a temp
+    file next to destination_path, and then renamed.
+    """
+    if os.path.dirname(os.path.abspath(source_path)) == os.path.dirname(os.path.abspath(destination_path)):
+        os.rename(source_path, destination_path)
+        return
+
+    temp_destination_path = "%s.tmp%s" % (destination_path, os.getpid())
+    try:
+        shutil.copy(source_path, temp_destination_path)
+        os.rename(temp_destination_path, destination_path)
+    except Exception:
+        if os.path.isfile(temp_destination_path):
+            os.remove(temp_destination_path)
+        raise
+    os.remove(source_path)
+
+
+def link_file(source_path, destination_path):
+    """Makes destination_path a hard link to source_path (or a copy, if they're on filesystems that can't link them),
+    replacing destination_path atomically if it already exists. Unlike publish_file(..), source_path is kept.
+    """
+    temp_destination_path = "%s.tmp%s" % (destination_path, os.getpid())
+    try:
+        try:
+            os.link(source_path, temp_destination_path)
+        except OSError:
+            shutil.copy(source_path, temp_destination_path)
+        os.rename(temp_destination_path, destination_path)
+    except Exception:
+        if os.path.isfile(temp_destination_path):
+            os.remove(temp_destination_path)
+        raise
+
+
+def create_dir(dir_path):
+    """Creates dir_path and any missing parent directories, unless it already exists. Raises OSError if it can't be
+    created.
+    """
+    try:
+        os.makedirs(dir_path)
+    except OSError:
+        if not os.path.isdir(dir_path):  # another process may have created it in the meantime
+            raise
@@ -0,0 +1,163 @@
+"""
+Utility classes for running GATK commands in long-lived JVMs (see java/GatkWorker.java) instead of launching a new
+JVM for every HaplotypeCaller run. For short HC runs, JVM startup and JIT warmup are a large part of the runtime.
+
+If a worker can't be started or dies, commands fall back to running in a new JVM (see run_gatk(..) in
+utils/haplotype_caller.py).
+"""
+
+import collections
+import logging
+import re
+import shlex
+import subprocess
+import threading
+import time
+
+from utils.command_output import scan_output_lines
+from utils.resource_usage import read_proc_usage, subtract_usage
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # python2
+
+DONE_MARKER = "GATK_WORKER_DONE"
+TOTAL_RUNTIME_MARKER = "Total runtime"
+
+# the result of running a GATK command
+GatkResult = collections.namedtuple("GatkResult", [
+    "succeeded",
+    "returncode",
+    "error_message",  # None if the command succeeded
+    "seconds",  # wall time, including JVM startup for commands that didn't run in a worker
+    "gatk_runtime_seconds",  # the runtime GATK printed at the end of its output, or None
+    "usage",  # ProcessUsage (see utils/resource_usage.py) of the JVM, or None. For commands that ran in a worker,
+              # peak_rss_mb is the worker's peak so far.
+    "num_concurrent",  # how many GATK commands were running in this process when it started, or None
+    "ran_in_worker",  # True if the command ran in a GatkWorker
+])
+
+
+def parse_total_runtime(output):
+    """Returns the number of seconds from the last 'Total runtime 41.77 secs, 0.70 min, 0.01 hours' line that GATK
+    printed in the given output, or None if there isn't one."""
+    matches = re.findall(TOTAL_RUNTIME_MARKER + r" ([0-9.]+) secs", output)
+    return float(matches[-1]) if matches else None
+
+
+def get_gatk_args(gatk_command_line):
+    """Returns the args that follow "-jar <GATK jar>" in the given java command line"""
+    args = shlex.split(gatk_command_line)
+    return args[args.index("-jar") + 2:]
+
+
+class GatkWorker(object):
+    """Client for one worker process"""
+
+    def __init__(self, worker_command, max_commands=100):
+        """
+        Args:
+            worker_command: list of args that start the worker process
+            max_commands: restart the worker after it's run this many commands, in case GATK leaks memory or state
+        """
+        self.worker_command = worker_command
+        self.max_commands = max_commands
+        self.process = None
+        self.num_commands = 0
+
+    def start(self):
+        logging.info("starting GATK worker: %s" % " ".join(self.worker_command))
+        # ignore Ctrl-C in the worker, so that it finishes its current command. This is done by the shell rather
+        # than with preexec_fn, which isn't safe to use when other threads are running.
+        self.process = subprocess.Popen(["sh", "-c", "trap '' INT; exec \"$@\"", "sh"] + self.worker_command,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.num_commands = 0
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait()
+        except Exception as e:
+            logging.warning("couldn't stop GATK worker: %s" % e)
+            self.process.kill()
+        self.process = None
+
+    def run(self, gatk_command_line):
+        """Runs the given GATK command in the worker process.
+
+        Args:
+            gatk_command_line: command that runs GATK with "java ... -jar <GATK jar> <args>". Only the args are
+                sent to the worker, so the java options are the worker's.
+        Return:
+            GatkResult, or None if the worker couldn't be started or died while running the command.
+        """
+        start_time = time.time()
+        if self.process is not None and (self.process.poll() is not None or self.num_commands >= self.max_commands):
+            self.stop()
+        try:
+            if self.process is None:
+                self.start()
+            usage_before = read_proc_usage(self.process.pid)
+
+            self.process.stdin.write(("\t".join(get_gatk_args(gatk_command_line)) + "\n").encode("utf-8"))
+            self.process.stdin.flush()
+        except (OSError, IOError) as e:
+            logging.warning("couldn't send command to GATK worker: %s" % e)
+            self.stop()
+            return None
+
+        self.num_commands += 1
+
+        done_line = []
+        def read_lines_until_done():
+            for line in iter(self.process.stdout.readline, b""):
+                line = line.decode("utf-8", "replace")
+                if line.startswith(DONE_MARKER):
+                    done_line.append(line)
+                    return
+                yield line
+
+        output_tail, markers_seen = scan_output_lines(read_lines_until_done(), markers=(TOTAL_RUNTIME_MARKER,),
+                                                      log_prefix="      ")
+        if not done_line:
+            logging.warning("GATK worker died")
+            self.stop()
+            return None
+
+        returncode = int(done_line[0].split()[1])
+        seconds = time.time() - start_time
+        usage = subtract_usage(read_proc_usage(self.process.pid), usage_before)
+        if returncode == 0 and TOTAL_RUNTIME_MARKER in markers_seen:
+            return GatkResult(True, 0, None, seconds, parse_total_runtime(output_tail), usage, None, True)
+
+        error_message = ("%s\n"
+            "return code: %s\n"
+            "output: %s") % (gatk_command_line, returncode or 100, output_tail.strip())
+        return GatkResult(False, returncode or 100, error_message, seconds, None, usage, None, True)
+
+
+class GatkWorkerPool(object):
+    """Runs GATK commands in up to num_workers worker processes, so that it can be used from several threads"""
+
+    def __init__(self, worker_command, num_workers=1, max_commands_per_worker=100):
+        self.idle_workers = queue.Queue()
+        self.workers = [GatkWorker(worker_command, max_commands_per_worker) for _ in range(num_workers)]
+        for worker in self.workers:
+            self.idle_workers.put(worker)
+        self._lock = threading.Lock()
+
+    def run(self, gatk_command_line):
+        """Runs the given command in the next idle worker. See GatkWorker.run(..)"""
+        worker = self.idle_workers.get()
+        try:
+            return worker.run(gatk_command_line)
+        finally:
+            self.idle_workers.put(worker)
+
+    def stop(self):
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
@@ -1,19 +1,35 @@
 """
 Launch HC to compute the reassembled bam.
 """
+import collections
 import datetime
 import getpass
 import itertools
 import logging
 import os
+import re
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 
-from utils.postprocess_reassembled_bam import postprocess_bam
+from utils.bam_prefetcher import downsample_bam_regions
+from utils.postprocess_reassembled_bam import postprocess_bam, slice_reassembled_bam
 from utils.check_gvcf import check_gvcf
-from utils.database import Sample
+from utils.database import Sample, ChildProcessUsage
 from utils.exac_calling_intervals import get_adjacent_calling_intervals
-from utils.constants import NUM_OUTPUT_DIRECTORIES_L1, INCLUDE_N_ADJACENT_CALLING_REGIONS, MAX_ALLELE_SIZE, GATK_JAR_PATH
-from utils.file_utils import does_file_exist, retry_if_IOError
+from utils.constants import NUM_OUTPUT_DIRECTORIES_L1, INCLUDE_N_ADJACENT_CALLING_REGIONS, MAX_ALLELE_SIZE, GATK_JAR_PATH, \
+    HC_MAX_HEAP_SIZE_MB, MAX_SAMPLES_TO_SHOW_PER_VARIANT, GATK_WORKER_CLASS_DIR
+from utils.file_utils import does_file_exist, retry_if_IOError, publish_file, link_file
+from utils.gatk_worker import GatkResult, GatkWorkerPool, parse_total_runtime
+from utils.hc_window import choose_hc_window, get_initial_window_level, MAX_WINDOW_LEVEL, DEFAULT_PADDING
+from utils.leases import release_lease
+from utils.priorities import read_tcga_sample_ids
+from utils.resource_usage import run_command_with_usage
+from utils.result_cache import compute_result_key, ResultCache
+from utils.sample_indexes import activate_backup_samples
+from utils.stage_timing import timed_stage, add_stage_seconds, reset_stage_timings, format_stage_timings
 
 from utils.constants import TCGA_NEW_BAM_PATHS
 
@@ -22,9 +38,17 @@ ERROR_ORIGINAL_BAM_NOT_FOUND = 1000
 ERROR_HC_CRASHED = 2000
 ERROR_GVCF_MISMATCH = 3000
 ERROR_REASSEMBLED_BAM_IS_EMPTY = 4000
+ERROR_TOO_MANY_CLAIM_ATTEMPTS = 5000  # see MAX_CLAIM_ATTEMPTS
 
 MAX_LINUX_FILENAME_LENGTH = 260
 
+_gatk_worker_pool = None  # set by start_gatk_workers(..)
+_result_cache = None  # set by enable_result_cache(..)
+_downsample_to_depth = None  # set by enable_downsampling(..)
+_tcga_sample_ids = None  # loaded from TCGA_NEW_BAM_PATHS by is_tcga_sample(..)
+_num_running_gatk_commands = 0  # see run_gatk(..)
+_num_running_gatk_commands_lock = threading.Lock()
+
 
 def run_haplotype_caller(
         chrom,
@@ -38,6 +62,9 @@ def run_haplotype_caller(
         sample_i,
         all_bam_output_dir = None,
         only_choose_samples = False,
+        input_bam_path = None,
+        scratch_dir = None,
+        window_level = None,
     ):
     """Runs HC and does pre/post-processing on the given variant.
 
@@ -51,12 +78,365 @@ def run_haplotype_caller(
         sample_i: if this sample passes all criteria, it would be sample number i to be shown for this variant
         all_bam_output_dir: top-level output dir for all reassembled bams
         only_choose_samples: if True, then don't actually run haplotype caller. just
+        input_bam_path: (optional) local copy of the relevant regions of original_bam_path to run HC on instead
+            (see utils/bam_prefetcher.py)
+        scratch_dir: (optional) node-local directory for intermediate files. If not specified, they're written to
+            all_bam_output_dir. Either way, only the final bam is written to all_bam_output_dir, with an atomic rename.
+        window_level: (optional) the smallest window level to run HC on (see utils/hc_window.py). By default, it
+            depends on the variant. If the GVCF check fails, HC is run again on the next larger window. If it still
+            fails on the largest window and the input was downsampled, HC is run once more on all reads.
     Return:
         2-tuple (x,y) where
             x = True if HC succeeded (or False otherwise)
             y = the reassembled bam path (or None)
     """
 
+    sr, output_bam_path, result = _start_sample(chrom, pos, ref, alt, het_or_hom_or_hemi, original_bam_path,
+        original_gvcf_path, sample_id, sample_i, only_choose_samples)
+    if result is not None:
+        return result
+
+    calling_window = _get_calling_window(sr)
+
+    if not only_choose_samples:
+        result = _reuse_cached_result(sr, output_bam_path, calling_window, all_bam_output_dir)
+        if result is not None:
+            return result
+
+    if window_level is None:
+        window_level = get_initial_window_level(sr.ref, sr.alt)
+
+    # each attempt is a 2-tuple (window level, input bam path)
+    attempts = [(level, input_bam_path) for level in range(window_level, MAX_WINDOW_LEVEL + 1)]
+
+    downsampled_bam_path = None
+    if _downsample_to_depth is not None and not only_choose_samples:
+        downsampled_bam_path = _compute_downsampled_bam_path(
+            os.path.splitext(os.path.basename(output_bam_path))[0], scratch_dir)
+        if _downsample_input_bam(input_bam_path or original_bam_path, downsampled_bam_path, [sr], [calling_window]):
+            # if the GVCF doesn't match on the largest window, try once more with all reads before failing the sample
+            attempts = [(level, downsampled_bam_path) for level, _ in attempts] + [(MAX_WINDOW_LEVEL, input_bam_path)]
+
+    try:
+        for attempt_i, (level, attempt_input_bam_path) in enumerate(attempts):
+            window = _get_hc_window(sr, calling_window, level)
+            if downsampled_bam_path is not None and attempt_input_bam_path != downsampled_bam_path:
+                sr.input_reads_dropped = 0
+
+            # first, output to temp files to avoid partially-finished files if HC crashes or is killed
+            temp_output_bam_path, temp_output_gvcf_path = _compute_temp_output_paths(all_bam_output_dir, output_bam_path, scratch_dir)
+            files_to_delete_on_error = [temp_output_bam_path, temp_output_gvcf_path, temp_output_gvcf_path+".idx"]
+
+            gatk_cmd = build_gatk_command(attempt_input_bam_path or original_bam_path, temp_output_bam_path, temp_output_gvcf_path,
+                                          window.intervals, padding_around_snps=window.padding_around_snps,
+                                          padding_around_indels=window.padding_around_indels)
+
+            sr.hc_command_line = " ".join(gatk_cmd)
+            with timed_stage(sr, "db_save"):
+                sr.save()
+
+            if only_choose_samples:
+                logging.info("%s-%s-%s-%s %s - %s %s - %s" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id, " finished choosing sample"))
+                return (True, output_bam_path)
+
+            logging.info("%s-%s-%s-%s %s - %s %s - launching HC on window level %s" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id, level))
+            logging.info(sr.hc_command_line)
+            hc_result = run_gatk(sr.hc_command_line)
+            _add_hc_timings(sr, hc_result, 1)
+            _save_hc_usage(hc_result, [sr])
+            if not hc_result.succeeded:
+                # add the return code to the ERROR_CODE so that different types of crashes have a different error code
+                hc_failed(ERROR_HC_CRASHED + abs(hc_result.returncode) % 500, hc_result.error_message, sr, files_to_delete_on_error)
+                logging.error("ERROR: HC failed: return code %s." % hc_result.returncode)
+                logging.error("ERROR: GATK output:")
+                logging.error("\t %s" % sr.hc_error_text)
+                return (False, None)
+
+            result = _check_gvcf_and_postprocess(sr, output_bam_path, temp_output_bam_path, temp_output_gvcf_path,
+                                                 all_bam_output_dir, window=window, allow_retry=attempt_i < len(attempts) - 1)
+
+            run("rm -f %s" % temp_output_gvcf_path)
+            run("rm -f %s" % (temp_output_gvcf_path+".idx"))
+
+            if result is not None:
+                return result
+    finally:
+        if downsampled_bam_path is not None:
+            run("rm -f %s %s" % (downsampled_bam_path, downsampled_bam_path + ".bai"))
+
+
+def run_haplotype_caller_batch(sample_records, all_bam_output_dir, input_bam_path=None, scratch_dir=None):
+    """Runs HC once on all the given samples, which must have the same original_bam_path (eg. the same sample at
+    different variants), instead of launching a separate HC run for each one. This avoids paying the JVM startup,
+    GATK initialization and bam index loading costs for every variant. The bamout is then split into per-variant bams,
+    and each variant is checked against the original GVCF and postprocessed the same way as in run_haplotype_caller.
+
+    Variants with the same calling window (eg. the alleles of a multi-allelic site) all reuse the same reassembled bam.
+
+    If the batched HC run fails, HC is run on each sample separately so that one bad region doesn't fail all of them.
+
+    Args:
+        sample_records: list of Sample records with sample_i, original_bam_path and original_gvcf_path already set
+        all_bam_output_dir: top-level output dir for all reassembled bams
+        input_bam_path: (optional) local copy of the relevant regions of the original bam - see run_haplotype_caller(..)
+        scratch_dir: (optional) node-local directory for intermediate files - see run_haplotype_caller(..)
+    Return:
+        list with a 2-tuple (x,y) for each sample record - see run_haplotype_caller(..)
+    """
+    job = prepare_haplotype_caller_batch(sample_records, all_bam_output_dir, input_bam_path=input_bam_path,
+                                         scratch_dir=scratch_dir)
+    results = job.results
+
+    jobs = collections.deque([job] if job.hc_command_line is not None else [])
+    while jobs:
+        job = jobs.popleft()
+        try:
+            logging.info(job.hc_command_line)
+            hc_result = run_gatk(job.hc_command_line)
+
+            finish_haplotype_caller_batch(job, hc_result, jobs)
+        finally:
+            _delete_batch_files(job)  # in case run_gatk(..) raised an exception
+
+    return results
+
+
+# a batched HC run that's been prepared by prepare_haplotype_caller_batch(..)
+HaplotypeCallerJob = collections.namedtuple("HaplotypeCallerJob", [
+    "hc_command_line",  # None if HC doesn't need to be run (eg. all samples were already done)
+    "results",  # list with a 2-tuple for each sample record - see run_haplotype_caller(..) - or None if not known yet
+    "samples_to_run",  # list of (index in results, Sample record, output_bam_path, HcWindow)
+    "batch_bam_path",
+    "batch_gvcf_path",
+    "all_bam_output_dir",
+    "scratch_dir",
+    "downsampled_bam_path",  # None if the input bam wasn't downsampled (see enable_downsampling(..))
+])
+
+_batch_counter = itertools.count(1)  # makes the batch file names unique within this process
+
+
+def prepare_haplotype_caller_batch(sample_records, all_bam_output_dir, input_bam_path=None, scratch_dir=None):
+    """Marks the given samples as started and builds the HC command for them, without running it. The command can
+    then be run with run_gatk(..) (eg. in a separate thread), and its result passed to finish_haplotype_caller_batch(..).
+    See run_haplotype_caller_batch(..) for details.
+
+    Return:
+        HaplotypeCallerJob
+    """
+    original_bam_paths = set(s.original_bam_path for s in sample_records)
+    assert len(original_bam_paths) == 1, "Expected all samples to have the same bam. Got: %s" % ", ".join(original_bam_paths)
+    original_bam_path = original_bam_paths.pop()
+
+    results = [None] * len(sample_records)
+    samples_to_run = []
+    calling_windows = []
+    for sample_record_i, s in enumerate(sample_records):
+        sr, output_bam_path, result = _start_sample(s.chrom, s.pos, s.ref, s.alt, s.het_or_hom_or_hemi,
+            s.original_bam_path, s.original_gvcf_path, s.sample_id, s.sample_i)
+        if result is None:
+            calling_window = _get_calling_window(sr)
+            result = _reuse_cached_result(sr, output_bam_path, calling_window, all_bam_output_dir)
+        if result is not None:
+            results[sample_record_i] = result
+        else:
+            window = _get_hc_window(sr, calling_window, get_initial_window_level(sr.ref, sr.alt))
+            samples_to_run.append((sample_record_i, sr, output_bam_path, window))
+            calling_windows.append(calling_window)
+
+    if not samples_to_run:
+        return HaplotypeCallerJob(None, results, [], None, None, all_bam_output_dir, scratch_dir, None)
+
+    return _build_haplotype_caller_job(results, samples_to_run, calling_windows, original_bam_path, input_bam_path,
+                                       all_bam_output_dir, scratch_dir)
+
+
+def _prepare_retry_job(job, sample_record_i, sr, output_bam_path, window_level, downsample=True):
+    """Returns a HaplotypeCallerJob that runs HC again on one of the samples of the given job, on the given window
+    level. Unlike run_haplotype_caller(..), this doesn't mark the sample as started again, so its stage timings,
+    comments and started_time are kept.
+
+    Args:
+        downsample: if False, HC is run on all reads even if downsampling is enabled (see enable_downsampling(..))
+    """
+    calling_window = _get_calling_window(sr)
+    window = _get_hc_window(sr, calling_window, window_level)
+    if not downsample:
+        sr.input_reads_dropped = 0
+    return _build_haplotype_caller_job(job.results, [(sample_record_i, sr, output_bam_path, window)],
+                                       [calling_window], sr.original_bam_path, None, job.all_bam_output_dir,
+                                       job.scratch_dir, downsample=downsample)
+
+
+def _build_haplotype_caller_job(results, samples_to_run, calling_windows, original_bam_path, input_bam_path,
+                                all_bam_output_dir, scratch_dir, downsample=True):
+    """Builds the HC command for samples that were already started. See prepare_haplotype_caller_batch(..)
+
+    Args:
+        results: list that the results of samples_to_run will be set in
+        samples_to_run: list of (index in results, Sample record, output_bam_path, HcWindow)
+        calling_windows: 2-tuple returned by _get_calling_window(..) for each of samples_to_run
+        original_bam_path: the samples' original bam
+        input_bam_path: (optional) local copy of the relevant regions of the original bam
+        downsample: if False, HC is run on all reads even if downsampling is enabled (see enable_downsampling(..))
+    Return:
+        HaplotypeCallerJob
+    """
+    # merge the windows of all variants. HC merges overlapping intervals, and the padding has to be enough for
+    # every variant.
+    all_calling_intervals = {}
+    for _, _, _, window in samples_to_run:
+        for calling_interval in window.intervals:
+            all_calling_intervals[str(calling_interval)] = calling_interval
+    all_calling_intervals = sorted(all_calling_intervals.values(), key=lambda i: (i.chrom, i.start, i.end))
+    padding_around_snps = max(window.padding_around_snps for _, _, _, window in samples_to_run)
+    padding_around_indels = max(window.padding_around_indels for _, _, _, window in samples_to_run)
+
+    batch_name = "tmp.batch_%s_%s" % (os.getpid(), next(_batch_counter))
+    batch_dir = scratch_dir or os.path.join(all_bam_output_dir, "tmp")
+    if not os.path.isdir(batch_dir):
+        run("mkdir -p %(batch_dir)s; chmod 777 %(batch_dir)s" % locals())
+    batch_bam_path = os.path.join(batch_dir, batch_name + ".bam")
+    batch_gvcf_path = os.path.join(batch_dir, batch_name + ".gvcf")
+
+    job = HaplotypeCallerJob(None, results, samples_to_run, batch_bam_path, batch_gvcf_path, all_bam_output_dir,
+                             scratch_dir, None)
+    try:
+        if _downsample_to_depth is not None and downsample:
+            job = job._replace(downsampled_bam_path=_compute_downsampled_bam_path(batch_name, scratch_dir))
+            if _downsample_input_bam(input_bam_path or original_bam_path, job.downsampled_bam_path,
+                                     [sr for _, sr, _, _ in samples_to_run], calling_windows):
+                input_bam_path = job.downsampled_bam_path
+            else:
+                job = job._replace(downsampled_bam_path=None)  # _downsample_input_bam(..) already deleted it
+
+        # the bamout needs to be indexed so that it can be split by region
+        gatk_cmd = build_gatk_command(input_bam_path or original_bam_path, batch_bam_path, batch_gvcf_path,
+                                      all_calling_intervals, index_bamout=True, padding_around_snps=padding_around_snps,
+                                      padding_around_indels=padding_around_indels)
+    except Exception:
+        _delete_batch_files(job)
+        raise
+
+    logging.info("%s - prepared HC run on %s variants" % (original_bam_path, len(samples_to_run)))
+    return job._replace(hc_command_line=" ".join(gatk_cmd))
+
+
+def finish_haplotype_caller_batch(job, hc_result, retry_jobs):
+    """Checks and postprocesses the outputs of a batched HC run.
+
+    Samples that need another HC run - because the batched run failed, or because their GVCF didn't match on the
+    window HC was run on - aren't run here. Instead, a HaplotypeCallerJob for each of them is appended to retry_jobs,
+    which should be run and finished the same way as this job. Their results are then set in job.results.
+
+    Args:
+        job: HaplotypeCallerJob from prepare_haplotype_caller_batch(..)
+        hc_result: the GatkResult returned by run_gatk(job.hc_command_line)
+        retry_jobs: list (or deque) that HaplotypeCallerJobs for the samples that need another HC run are added to
+    Return:
+        list with a 2-tuple (x,y) for each sample record - see run_haplotype_caller(..) - which is None for samples
+        that are in retry_jobs
+    """
+    try:
+        return _finish_haplotype_caller_batch(job, hc_result, retry_jobs)
+    finally:
+        _delete_batch_files(job)
+
+
+def _delete_batch_files(job):
+    """Deletes the intermediate files of a batched HC run"""
+    batch_files = [job.batch_bam_path, os.path.splitext(job.batch_bam_path)[0] + ".bai", job.batch_gvcf_path, job.batch_gvcf_path+".idx"]
+    if job.downsampled_bam_path is not None:
+        batch_files += [job.downsampled_bam_path, job.downsampled_bam_path + ".bai"]
+    for path in batch_files:
+        run("rm -f %s" % path)
+
+
+def _finish_haplotype_caller_batch(job, hc_result, retry_jobs):
+    results = job.results
+    all_bam_output_dir = job.all_bam_output_dir
+
+    _save_hc_usage(hc_result, [sr for _, sr, _, _ in job.samples_to_run])
+
+    if not hc_result.succeeded and len(job.samples_to_run) > 1:
+        # the time of the failed batched run isn't included in the samples' hc_seconds
+        logging.info("%s - batched HC run failed with return code %s. Running HC on each variant separately." % (
+            job.batch_bam_path, hc_result.returncode))
+        _delete_batch_files(job)
+        for sample_record_i, sr, output_bam_path, window in job.samples_to_run:
+            retry_jobs.append(_prepare_retry_job(job, sample_record_i, sr, output_bam_path, window.level))
+        return results
+
+    if not hc_result.succeeded:
+        sample_record_i, sr, _, _ = job.samples_to_run[0]
+        sr.hc_command_line = job.hc_command_line
+        _add_hc_timings(sr, hc_result, 1)
+        # add the return code to the ERROR_CODE so that different types of crashes have a different error code
+        hc_failed(ERROR_HC_CRASHED + abs(hc_result.returncode) % 500, hc_result.error_message, sr)
+        logging.error("ERROR: HC failed: return code %s." % hc_result.returncode)
+        logging.error("ERROR: GATK output:")
+        logging.error("\t %s" % sr.hc_error_text)
+        results[sample_record_i] = (False, None)
+        return results
+
+    all_calling_intervals = set()
+    for _, _, _, window in job.samples_to_run:
+        all_calling_intervals.update(str(i) for i in window.intervals)
+    all_paddings = set((w.padding_around_snps, w.padding_around_indels) for _, _, _, w in job.samples_to_run)
+
+    for sample_record_i, sr, output_bam_path, window in job.samples_to_run:
+        sr.hc_command_line = job.hc_command_line
+        _add_hc_timings(sr, hc_result, len(job.samples_to_run))
+        temp_output_bam_path, _ = _compute_temp_output_paths(all_bam_output_dir, output_bam_path, job.scratch_dir)
+
+        with timed_stage(sr, "postprocess"):
+            if set(str(i) for i in window.intervals) == all_calling_intervals and len(all_paddings) == 1:
+                # HC was run on exactly this variant's window, so the bamout is the same as for a separate HC run.
+                # It's only read and then deleted, so a hard link is enough instead of a copy for each variant.
+                link_file(job.batch_bam_path, temp_output_bam_path)
+            else:
+                # split out the reads that HC reassembled within this variant's calling intervals
+                retry_if_IOError(slice_reassembled_bam, job.batch_bam_path, temp_output_bam_path, sr.chrom,
+                                 window.intervals[0].start, window.intervals[-1].end)
+
+        is_downsampled = job.downsampled_bam_path is not None
+        result = _check_gvcf_and_postprocess(sr, output_bam_path, temp_output_bam_path, job.batch_gvcf_path,
+            all_bam_output_dir, is_gvcf_shared=True, window=window,
+            allow_retry=window.level < MAX_WINDOW_LEVEL or is_downsampled)
+        if result is None and window.level < MAX_WINDOW_LEVEL:
+            # the GVCF didn't match on this window, so run HC on this variant again on a larger window
+            retry_jobs.append(_prepare_retry_job(job, sample_record_i, sr, output_bam_path, window.level + 1))
+            continue
+        if result is None:
+            # the GVCF didn't match on the largest window, so try once more with all reads before failing the sample
+            retry_jobs.append(_prepare_retry_job(job, sample_record_i, sr, output_bam_path, window.level,
+                                                 downsample=False))
+            continue
+        results[sample_record_i] = result
+
+    return results
+
+
+def is_tcga_sample(sample_id, original_bam_path):
+    """Returns True if the sample is listed in the TCGA_NEW_BAM_PATHS table, or its bam is a TCGA bam. The table's
+    sample ids are read the first time this is called.
+    """
+    global _tcga_sample_ids
+    if _tcga_sample_ids is None:
+        _tcga_sample_ids = read_tcga_sample_ids(TCGA_NEW_BAM_PATHS)
+
+    return sample_id in _tcga_sample_ids or "tcga" in original_bam_path.lower()
+
+
+def _start_sample(chrom, pos, ref, alt, het_or_hom_or_hemi, original_bam_path, original_gvcf_path, sample_id,
+                  sample_i, only_choose_samples=False):
+    """Looks up the Sample record and marks it as started.
+
+    Return:
+        3-tuple (sample record, output_bam_path, result) where result is None if HC should be run on this sample,
+        or the 2-tuple to return from run_haplotype_caller(..) if the sample is already done or its bam is missing.
+    """
+
     # if finished already, just return
     sr, created = Sample.get_or_create(
         chrom=chrom,
@@ -69,12 +449,15 @@ def run_haplotype_caller(
     output_bam_path = compute_output_bam_path(chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i)
     if sr.finished and sr.output_bam_path == output_bam_path:
         #logging.info("%s-%s-%s-%s - %s - already done " % (chrom, pos, ref, alt, sample_id))
-        return (sr.hc_succeeded, sr.output_bam_path)
+        return sr, output_bam_path, (sr.hc_succeeded, sr.output_bam_path)
+
+    reset_stage_timings(sr)  # claim_seconds was saved when the sample was claimed
 
     sr.variant_id = "%s-%s-%s-%s" % (chrom, pos, ref, alt)
     sr.sample_i = sample_i
     sr.original_bam_path = str(original_bam_path)
-    if sample_id in TCGA_NEW_BAM_PATHS or "tcga" in original_bam_path.lower():
+    sr.original_gvcf_path = str(original_gvcf_path)
+    if is_tcga_sample(sample_id, original_bam_path):
         sr.priority = 1
 
     if not only_choose_samples:
@@ -82,7 +465,8 @@ def run_haplotype_caller(
         sr.started = 1
         sr.comments = str(sr.comments or "")+"_s"  # started - used to check that started only once
         sr.started_time = datetime.datetime.now()
-    sr.save()
+    with timed_stage(sr, "db_save"):
+        sr.save()
 
     logging.info("%s-%s-%s-%s %s - %s %s - start " % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id))
     # TODO check if original bam path in set of missing bams (pre-compute missing files cache)
@@ -97,9 +481,47 @@ def run_haplotype_caller(
             sr.hc_error_text = error_text
             sr.save()
 
-        return (False, None)
+        return sr, output_bam_path, (False, None)
+
+    return sr, output_bam_path, None
+
+
+def _get_calling_window(sr):
+    """Looks up the exac calling intervals around the given Sample record's variant (see get_calling_window(..)).
+
+    Return:
+        2-tuple (the calling interval that spans the variant, sorted list of all the calling intervals)
+    """
+    with timed_stage(sr, "interval_lookup"):
+        i, calling_intervals = get_calling_window(sr.chrom, sr.pos)
+
+    sr.calling_interval_start = i.start
+    sr.calling_interval_end = i.end
+
+    return i, calling_intervals
+
+
+def _get_hc_window(sr, calling_window, level):
+    """Returns the HcWindow to run HC on for the given Sample record at the given window level (see
+    utils/hc_window.py), and records the level in the Sample record.
+
+    Args:
+        sr: Sample record
+        calling_window: 2-tuple returned by _get_calling_window(sr)
+        level: window level
+    """
+    overlapping_interval, calling_intervals = calling_window
+    sr.hc_window_level = level
+    return choose_hc_window(sr.pos, sr.ref, sr.alt, overlapping_interval, calling_intervals, level)
+
+
+def get_calling_window(chrom, pos):
+    """Returns the exac calling intervals that HC is run on for a variant at the given position - the calling
+    interval that spans the variant, as well as INCLUDE_N_ADJACENT_CALLING_REGIONS adjacent intervals on either side.
 
-    # look up the exac calling interval that spans this variant, as well as its 2 adjacent intervals on either side
+    Return:
+        2-tuple (the calling interval that spans the variant, sorted list of all the calling intervals)
+    """
     left_i, i, right_i = get_adjacent_calling_intervals(
                             chrom,
                             pos,
@@ -108,39 +530,114 @@ def run_haplotype_caller(
 
     assert chrom == i.chrom, "%s chrom doesn't match %s" % (str(i), chrom)
 
-    sr.calling_interval_start = i.start
-    sr.calling_interval_end = i.end
-    sr.original_gvcf_path = str(original_gvcf_path)
+    return i, left_i + [i] + right_i
 
-    # first, output to temp files to avoid partially-finished files if HC crashes or is killed
-    relative_output_dir = os.path.dirname(output_bam_path)
-    temp_output_bam_path = os.path.join(all_bam_output_dir, relative_output_dir, "tmp." + os.path.basename(output_bam_path))
 
-    files_to_delete_on_error = [temp_output_bam_path]
-    temp_output_gvcf_path = os.path.join(all_bam_output_dir, relative_output_dir, "tmp." + os.path.basename(output_bam_path.replace(".bam", "") + ".gvcf"))
-    files_to_delete_on_error += [temp_output_gvcf_path, temp_output_gvcf_path+".idx"]
+def _compute_temp_output_paths(all_bam_output_dir, output_bam_path, scratch_dir=None):
+    """Returns a 2-tuple (temp_output_bam_path, temp_output_gvcf_path) for the given output bam, and makes sure the
+    output directory exists.
+
+    Args:
+        all_bam_output_dir: top-level output dir for all reassembled bams
+        output_bam_path: output bam path relative to all_bam_output_dir
+        scratch_dir: if specified, the temp files are in this directory instead of next to the output bam
+    """
+    relative_output_dir = os.path.dirname(output_bam_path)
+    if scratch_dir:
+        # include the process id since several tasks on the same node may share the scratch dir
+        temp_dir = scratch_dir
+        temp_prefix = "tmp.%s." % os.getpid()
+    else:
+        temp_dir = os.path.join(all_bam_output_dir, relative_output_dir)
+        temp_prefix = "tmp."
+    temp_output_bam_path = os.path.join(temp_dir, temp_prefix + os.path.basename(output_bam_path))
+    temp_output_gvcf_path = os.path.join(temp_dir, temp_prefix + os.path.basename(output_bam_path.replace(".bam", "") + ".gvcf"))
 
     # make sure output directory exists
-    absolute_output_dir = os.path.dirname(temp_output_bam_path)
+    absolute_output_dir = os.path.join(all_bam_output_dir, relative_output_dir)
     if not os.path.isdir(absolute_output_dir):
         logging.debug("creating directory: %s" % absolute_output_dir)
         run("mkdir -p %(absolute_output_dir)s; chmod 777 %(absolute_output_dir)s %(absolute_output_dir)s/.. " % locals())
 
-    dash_L_intervals = list(itertools.chain.from_iterable(
-        [('-L', str(interval)) for interval in left_i + [i] + right_i]))
+    return temp_output_bam_path, temp_output_gvcf_path
 
-    # see https://www.broadinstitute.org/gatk/guide/article?id=5484  for details on using -bamout
-    gatk_cmd = [
+
+def get_java_command():
+    """Returns the java command and JVM options used to run GATK, as a list of args"""
+    return [
        "java",
         "-XX:+UseSerialGC",
         "-XX:+ReduceSignalUsage",
-        "-XX:+UseSerialGC",
         "-XX:CICompilerCount=1",
         "-XX:+DisableAttachMechanism",
-        "-XX:MaxHeapSize=1000m",
+        "-Xmx%sm" % HC_MAX_HEAP_SIZE_MB,  # see scripts/recommend_jvm_settings.py
+    ]
+
+
+def start_gatk_workers(num_workers):
+    """Starts using long-lived GATK processes (see utils/gatk_worker.py) to run HC commands, instead of starting a new
+    JVM for each one. Does nothing if the workers were already started.
+
+    Args:
+        num_workers: number of worker processes - should be the number of HC commands that can run at the same time
+    Return:
+        True if the workers will be used, or False if java/GatkWorker.java hasn't been compiled into
+        GATK_WORKER_CLASS_DIR
+    """
+    global _gatk_worker_pool
+    if _gatk_worker_pool is not None:
+        return True
+    if not os.path.isfile(os.path.join(GATK_WORKER_CLASS_DIR, "GatkWorker.class")):
+        logging.warning("%s/GatkWorker.class not found. Running each GATK command in a new JVM." % GATK_WORKER_CLASS_DIR)
+        return False
+
+    worker_command = get_java_command() + ['-cp', GATK_JAR_PATH + os.pathsep + GATK_WORKER_CLASS_DIR, 'GatkWorker']
+    _gatk_worker_pool = GatkWorkerPool(worker_command, num_workers)
+    return True
+
+
+def stop_gatk_workers():
+    global _gatk_worker_pool
+    if _gatk_worker_pool is not None:
+        _gatk_worker_pool.stop()
+        _gatk_worker_pool = None
+
+
+def build_gatk_command(input_bam_path, bamout_path, gvcf_path, calling_intervals, index_bamout=False,
+                       padding_around_snps=DEFAULT_PADDING, padding_around_indels=DEFAULT_PADDING):
+    """Returns the HaplotypeCaller command as a list of args.
+
+    Args:
+        input_bam_path: original bam
+        bamout_path: where to write the reassembled bam
+        gvcf_path: where to write the GVCF
+        calling_intervals: list of ExacCallingInterval records to pass to -L
+        index_bamout: whether HaplotypeCaller should index the reassembled bam
+        padding_around_snps: --paddingAroundSNPs
+        padding_around_indels: --paddingAroundIndels
+    """
+    dash_L_intervals = list(itertools.chain.from_iterable(
+        [('-L', str(interval)) for interval in calling_intervals]))
+
+    # see https://www.broadinstitute.org/gatk/guide/article?id=5484  for details on using -bamout
+    gatk_cmd = get_java_command() + [
         #'-jar', './gatk-protected/target/executable/GenomeAnalysisTK.jar',
-        "-Xmx7500m",
         '-jar', GATK_JAR_PATH,
+    ] + get_hc_args(padding_around_snps, padding_around_indels) + [
+        '-I', input_bam_path,
+        '-bamout', bamout_path,
+    ] + ([] if index_bamout else ['--disable_bam_indexing']) + [
+        '-o', gvcf_path,
+        #'-et', 'NO_ET',
+
+    ] + list(dash_L_intervals)
+
+    return gatk_cmd
+
+
+def get_hc_args(padding_around_snps=DEFAULT_PADDING, padding_around_indels=DEFAULT_PADDING):
+    """Returns the HaplotypeCaller args that don't depend on the input and output paths or intervals, as a list"""
+    return [
         '-T', 'HaplotypeCaller',
         '-R', "/seq/references/Homo_sapiens_assembly19/v1/Homo_sapiens_assembly19.fasta",
         '--disable_auto_index_creation_and_locking_when_reading_rods',
@@ -155,49 +652,128 @@ def run_haplotype_caller(
         #'--forceActive',
         '--variant_index_type', 'LINEAR',
         '--variant_index_parameter', '128000',
-        '--paddingAroundSNPs', ' 300',
-        '--paddingAroundIndels', '300',
-        '-I', original_bam_path,
-        '-bamout', temp_output_bam_path,
-        '--disable_bam_indexing',
-        '-o', temp_output_gvcf_path,
-        #'-et', 'NO_ET',
+        '--paddingAroundSNPs', str(padding_around_snps),
+        '--paddingAroundIndels', str(padding_around_indels),
+    ]
 
-    ] + list(dash_L_intervals)
 
-    sr.hc_command_line = " ".join(gatk_cmd)
-    sr.save()
+def run_gatk(hc_command_line, ignore_sigint=False):
+    """Runs the given GATK command.
 
-    if only_choose_samples:
-        logging.info("%s-%s-%s-%s %s - %s %s - %s" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id, " finished choosing sample"))
-        return (True, output_bam_path)
+    Args:
+        hc_command_line: the command
+        ignore_sigint: if True, GATK won't be killed by Ctrl-C, so that a worker pool can let running commands finish
+    Return:
+        GatkResult
+    """
+    global _num_running_gatk_commands
+    with _num_running_gatk_commands_lock:
+        _num_running_gatk_commands += 1
+        num_concurrent = _num_running_gatk_commands
 
     try:
-        logging.info("%s-%s-%s-%s %s - %s %s - launching HC" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id))
-        logging.info(sr.hc_command_line)
+        if _gatk_worker_pool is not None:
+            result = _gatk_worker_pool.run(hc_command_line)
+            if result is not None:
+                return result._replace(num_concurrent=num_concurrent)
+            logging.info("Running GATK in a new JVM instead")
+
+        if ignore_sigint:
+            # the shell ignores SIGINT before exec'ing java, and the JVM inherits that. A preexec_fn would do the
+            # same, but it isn't safe to use when other threads are running.
+            hc_command_line = "trap '' INT; exec " + hc_command_line
+        start_time = time.time()
         #os.system(" ".join(gatk_cmd))
-        cmd_output = subprocess.check_output(sr.hc_command_line, stderr=subprocess.STDOUT, shell=True).decode()
+        returncode, cmd_output, usage = run_command_with_usage(hc_command_line)
+        seconds = time.time() - start_time
         logging.info("Output:\n"+cmd_output)
-        if "Total runtime" not in cmd_output:
-            raise subprocess.CalledProcessError(100, sr.hc_command_line, cmd_output)
-    except subprocess.CalledProcessError as e:
+        if returncode == 0 and "Total runtime" in cmd_output:
+            return GatkResult(True, 0, None, seconds, parse_total_runtime(cmd_output), usage, num_concurrent, False)
+
         error_message = ("%s\n"
             "return code: %s\n"
-            "output: %s") % (sr.hc_command_line, e.returncode, e.output.strip())
-        # add the return code to the ERROR_CODE so that different types of crashes have a different error code
-        hc_failed(ERROR_HC_CRASHED + abs(e.returncode) % 500, error_message, sr, files_to_delete_on_error)
-        logging.error("ERROR: HC failed: return code %s." % e.returncode)
-        logging.error("ERROR: GATK output:")
-        logging.error("\t %s" % sr.hc_error_text)
-        return (False, None)
+            "output: %s") % (hc_command_line, returncode or 100, cmd_output.strip())
+        return GatkResult(False, returncode or 100, error_message, seconds, None, usage, num_concurrent, False)
+    finally:
+        with _num_running_gatk_commands_lock:
+            _num_running_gatk_commands -= 1
+
+
+def _save_hc_usage(hc_result, sample_records):
+    """Saves the resources used by a HC run on the given Sample records (see utils/resource_usage.py)"""
+    if hc_result.usage is None:
+        return
+
+    try:
+        ChildProcessUsage.create(
+            program="HaplotypeCaller",
+            label=",".join(str(sr.id) for sr in sample_records)[:100],
+            num_samples=len(sample_records),
+            hostname=socket.gethostname()[:100],
+            max_heap_mb=HC_MAX_HEAP_SIZE_MB,
+            num_concurrent=hc_result.num_concurrent,
+            wall_seconds=hc_result.seconds,
+            cpu_seconds=hc_result.usage.cpu_seconds,
+            peak_rss_mb=hc_result.usage.peak_rss_mb,
+            ran_in_worker=hc_result.ran_in_worker,
+            read_mb=hc_result.usage.read_mb,
+            write_mb=hc_result.usage.write_mb)
+    except Exception as e:
+        logging.warning("couldn't save HC resource usage: %s" % e)
+
+
+def _add_hc_timings(sr, hc_result, num_samples):
+    """Adds this sample's share of a HC run's wall time and GATK-reported runtime to the Sample record"""
+    add_stage_seconds(sr, "hc", hc_result.seconds / num_samples)
+    if hc_result.gatk_runtime_seconds is not None:
+        sr.gatk_runtime_seconds = hc_result.gatk_runtime_seconds / num_samples
+
+
+def _check_gvcf_and_postprocess(sr, output_bam_path, temp_output_bam_path, temp_output_gvcf_path, all_bam_output_dir,
+                                is_gvcf_shared=False, window=None, allow_retry=False):
+    """Checks the GVCF generated by HC against the original GVCF call, and then postprocesses the reassembled bam
+    into its final location.
+
+    Args:
+        sr: Sample record
+        output_bam_path: final output bam path relative to all_bam_output_dir
+        temp_output_bam_path: reassembled bam generated by HC
+        temp_output_gvcf_path: GVCF generated by HC
+        all_bam_output_dir: top-level output dir for all reassembled bams
+        is_gvcf_shared: True if the GVCF also contains other variants (eg. from a batched HC run), so it should be
+            copied rather than moved when saving it for debugging.
+        window: the HcWindow that HC was run on for this variant. If specified, the postprocessed bam is added to
+            the result cache (see enable_result_cache(..)).
+        allow_retry: if True and the GVCF doesn't match the original call, the temp files are deleted and None is
+            returned so that HC can be run again (on a larger window, or without downsampling) instead of marking the
+            sample as failed.
+    Return:
+        2-tuple - see run_haplotype_caller(..) - or None if the GVCF didn't match and allow_retry is True
+    """
+    chrom, pos, ref, alt, het_or_hom_or_hemi = sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi
+    sample_i, sample_id = sr.sample_i, sr.sample_id
+    original_bam_path, original_gvcf_path = sr.original_bam_path, sr.original_gvcf_path
+    relative_output_dir = os.path.dirname(output_bam_path)
+
+    files_to_delete_on_error = [temp_output_bam_path]
+    if not is_gvcf_shared:
+        files_to_delete_on_error += [temp_output_gvcf_path, temp_output_gvcf_path+".idx"]
 
     # check GVCF against original GVCF call
     sr.is_missing_original_gvcf = not does_file_exist(sr.original_gvcf_path) or not does_file_exist(sr.original_gvcf_path + ".tbi")
 
     if not sr.is_missing_original_gvcf:
         logging.info("%s-%s-%s-%s %s - %s %s - checking gvcfs" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id))
-        gvcf_calls_matched, mismatch_error_code, mismatch_error_text = retry_if_IOError(
-            check_gvcf, sr.original_gvcf_path, temp_output_gvcf_path, chrom, pos)
+        with timed_stage(sr, "gvcf_check"):
+            gvcf_calls_matched, mismatch_error_code, mismatch_error_text = retry_if_IOError(
+                check_gvcf, sr.original_gvcf_path, temp_output_gvcf_path, chrom, pos)
+
+        if not gvcf_calls_matched and allow_retry:
+            logging.info("%s-%s-%s-%s %s - %s %s - gvcfs mismatch on window level %s: %s. Retrying." % (
+                chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id, window.level, mismatch_error_text))
+            for path in files_to_delete_on_error:
+                run("rm -f %s" % path)
+            return None
 
         if not gvcf_calls_matched:
             sr.finished = 1
@@ -214,17 +790,21 @@ def run_haplotype_caller(
 
             igv_tracks = []
             for file_to_save_for_debugging in files_to_delete_on_error:
-                destination_path = os.path.join(absolute_debug_dir, os.path.basename(file_to_save_for_debugging).replace("tmp.", ""))
+                destination_path = os.path.join(absolute_debug_dir, _strip_temp_prefix(os.path.basename(file_to_save_for_debugging)))
                 run("mv -f %s %s" % (file_to_save_for_debugging, destination_path))
                 if destination_path.endswith(".bam"):
                     igv_tracks.append(destination_path)
 
+            if is_gvcf_shared:
+                destination_path = os.path.join(absolute_debug_dir, _strip_temp_prefix(os.path.basename(temp_output_bam_path).replace(".bam", "")) + ".gvcf")
+                run("cp -f %s %s" % (temp_output_gvcf_path, destination_path))
+
             # create symlinks to original bam and gvcf
-            symlink_path = os.path.join(absolute_debug_dir, os.path.basename(temp_output_bam_path).replace(".bam", "").replace("tmp.", "") + ".original.bam")
+            symlink_path = os.path.join(absolute_debug_dir, _strip_temp_prefix(os.path.basename(temp_output_bam_path).replace(".bam", "")) + ".original.bam")
             run("ln -s -f %s %s" % (original_bam_path, symlink_path))
             run("ln -s -f %s %s" % (original_bam_path.replace(".bam", ".bai"), symlink_path + ".bai"))
 
-            symlink_path = os.path.join(absolute_debug_dir, os.path.basename(temp_output_bam_path).replace(".bam", "").replace("tmp.", "") + ".original.gvcf.gz")
+            symlink_path = os.path.join(absolute_debug_dir, _strip_temp_prefix(os.path.basename(temp_output_bam_path).replace(".bam", "")) + ".original.gvcf.gz")
             run("ln -s -f %s %s" % (original_gvcf_path, symlink_path))
             run("ln -s -f %s %s" % (original_gvcf_path + ".tbi", symlink_path + ".tbi"))
 
@@ -233,20 +813,22 @@ def run_haplotype_caller(
 
             return (False, None)
 
-    run("rm -f %s" % temp_output_gvcf_path)
-    run("rm -f %s" % (temp_output_gvcf_path+".idx"))
-
     logging.info("%s-%s-%s-%s %s - %s %s - post-processing bams" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id))
     # postprocess and move output bam from temp_output_bam_path to output_bam_path
     # strip out read groups, read ids, tags, etc. to remove any sensitive info and reduce bam size
     final_output_bam_path = os.path.join(all_bam_output_dir, output_bam_path)
 
-    run("rm -f %s" % final_output_bam_path)
-    (is_reassembled_bam_empty, sr.hc_n_artificial_haplotypes, sr.hc_n_artificial_haplotypes_deleted) = retry_if_IOError(
-        postprocess_bam, temp_output_bam_path, final_output_bam_path, chrom, pos, ref, alt)
+    # postprocess next to the temp bam, and then publish the result to final_output_bam_path with an atomic rename so
+    # that readers never see a partially-written bam
+    postprocessed_bam_path = os.path.join(os.path.dirname(temp_output_bam_path),
+                                          "postprocessed." + os.path.basename(temp_output_bam_path))
+    files_to_delete_on_error.append(postprocessed_bam_path)
+
+    with timed_stage(sr, "postprocess"):
+        (is_reassembled_bam_empty, sr.hc_n_artificial_haplotypes, sr.hc_n_artificial_haplotypes_deleted) = retry_if_IOError(
+            postprocess_bam, temp_output_bam_path, postprocessed_bam_path, chrom, pos, ref, alt)
 
     run("rm -f %s" % temp_output_bam_path)
-    run("chmod 666 %s" % final_output_bam_path)  # in case different users run this script
 
     if is_reassembled_bam_empty:
         logging.info("%s-%s-%s-%s - %s - %s" % (chrom, pos, ref, alt, sample_id, "reassembled bam is empty"))
@@ -257,22 +839,150 @@ def run_haplotype_caller(
         hc_failed(ERROR_REASSEMBLED_BAM_IS_EMPTY, "reassembled bam is empty", sr, files_to_delete_on_error)
         return (False, None)
     else:
-        pass
-        #run("mv -f %s %s" % (temp_output_bam_path.replace(".bam", ".bai"), final_output_bam_path.replace(".bam", ".bai")))
+        os.chmod(postprocessed_bam_path, 0o666)  # in case different users run this script
+        with timed_stage(sr, "postprocess"):
+            retry_if_IOError(publish_file, postprocessed_bam_path, final_output_bam_path)
         #run("samtools index %s" % output_bam_path)
 
-    sr.comments = str(sr.comments or "") + "_succeeded"
+    if _result_cache is not None and window is not None:
+        try:
+            _result_cache.put(_compute_result_key(sr, window), final_output_bam_path, {
+                "hc_n_artificial_haplotypes": sr.hc_n_artificial_haplotypes,
+                "hc_n_artificial_haplotypes_deleted": sr.hc_n_artificial_haplotypes_deleted,
+                "is_missing_original_gvcf": bool(sr.is_missing_original_gvcf),
+            })
+        except Exception as e:
+            logging.warning("%s-%s-%s-%s %s - couldn't add bam to the result cache: %s" % (chrom, pos, ref, alt, sample_id, e))
+
+    return _hc_succeeded(sr, output_bam_path)
+
+
+def _hc_succeeded(sr, output_bam_path, comment="_succeeded"):
+    """Marks the Sample record as finished after its bam was written to output_bam_path"""
+    sr.comments = str(sr.comments or "") + comment
     sr.finished = 1
     sr.finished_time = datetime.datetime.now()
     sr.output_bam_path = output_bam_path
-    sr.sample_i = sample_i
     sr.hc_succeeded = 1
     sr.save()
+    release_lease(Sample, sr.id)
 
-    logging.info("%s-%s-%s-%s %s - %s %s - %s" % (chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, sample_id, "done!"))
+    logging.info("%s-%s-%s-%s %s - %s %s - done! %s" % (sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi,
+        sr.sample_i, sr.sample_id, format_stage_timings(sr)))
     return (True, sr.output_bam_path)
 
 
+def enable_result_cache(cache_dir):
+    """Starts reusing previously-computed bams from cache_dir, and adding new ones to it (see utils/result_cache.py)"""
+    global _result_cache
+    _result_cache = ResultCache(cache_dir)
+
+
+def enable_downsampling(max_depth):
+    """Starts capping the read depth of HC's input bam at max_depth (see utils/downsampling.py)"""
+    global _downsample_to_depth
+    _downsample_to_depth = max_depth
+
+
+def _downsample_input_bam(input_bam_path, downsampled_bam_path, sample_records, calling_windows):
+    """Copies the reads that HC needs for the given Sample records from input_bam_path to downsampled_bam_path,
+    leaving out reads at positions where the depth is more than the max set by enable_downsampling(..). The reads
+    are chosen based on the sample and variants, and reads that span a variant are chosen first.
+
+    Args:
+        input_bam_path: original bam, or a local copy of its regions (see utils/bam_prefetcher.py)
+        downsampled_bam_path: output bam path
+        sample_records: Sample records with the same original bam
+        calling_windows: 2-tuple returned by _get_calling_window(..) for each Sample record
+    Return:
+        True if downsampled_bam_path was created, or False if HC should be run on input_bam_path instead
+    """
+    regions = [(i.chrom, i.start, i.end) for _, calling_intervals in calling_windows for i in calling_intervals]
+    variant_regions = [(sr.chrom, sr.pos, sr.pos + len(sr.ref) - 1) for sr in sample_records]
+    seed = "%s %s" % (sample_records[0].sample_id, ",".join(sorted(sr.variant_id for sr in sample_records)))
+    try:
+        reads_kept, reads_left_out = retry_if_IOError(downsample_bam_regions, input_bam_path, downsampled_bam_path,
+                                                      regions, _downsample_to_depth, seed, variant_regions)
+    except Exception as e:
+        logging.warning("%s - couldn't downsample %s: %s" % (seed, input_bam_path, e))
+        run("rm -f %s %s" % (downsampled_bam_path, downsampled_bam_path + ".bai"))
+        return False
+
+    logging.info("%s - downsampled to depth %s: kept %s reads, left out %s" % (
+        seed, _downsample_to_depth, reads_kept, len(reads_left_out)))
+
+    # only count the reads that were left out within each sample's own calling window
+    for sr, (_, calling_intervals) in zip(sample_records, calling_windows):
+        sr.input_reads_dropped = sum(1 for chrom, start, end in reads_left_out if any(
+            i.chrom == chrom and start < i.end and end >= i.start for i in calling_intervals))
+    return True
+
+
+def _compute_downsampled_bam_path(name, scratch_dir):
+    """Returns the path for a downsampled input bam. It's written to scratch_dir or the system temp dir, not to the
+    output dir on shared storage.
+
+    Args:
+        name: file name prefix that's unique within this process
+        scratch_dir: (optional) node-local directory for intermediate files
+    """
+    return os.path.join(scratch_dir or tempfile.gettempdir(), "%s.%s.downsampled_input.bam" % (name, os.getpid()))
+
+
+def _compute_result_key(sr, window):
+    hc_args = get_hc_args(window.padding_around_snps, window.padding_around_indels)
+    if _downsample_to_depth is not None:
+        hc_args += ["downsample_to_depth=%s" % _downsample_to_depth]
+    return compute_result_key(sr.original_bam_path, sr.original_gvcf_path, window.intervals, GATK_JAR_PATH, hc_args,
+                              sr.chrom, sr.pos, sr.ref, sr.alt)
+
+
+def _reuse_cached_result(sr, output_bam_path, calling_window, all_bam_output_dir):
+    """If the result cache has a bam for the same inputs as this sample - on any window level - links it to
+    output_bam_path instead of running HC again.
+
+    Args:
+        calling_window: 2-tuple returned by _get_calling_window(sr)
+    Return:
+        2-tuple to return from run_haplotype_caller(..), or None if HC should be run on this sample
+    """
+    if _result_cache is None:
+        return None
+
+    overlapping_interval, calling_intervals = calling_window
+    try:
+        for level in range(get_initial_window_level(sr.ref, sr.alt), MAX_WINDOW_LEVEL + 1):
+            # unlike _get_hc_window(..), this doesn't set sr.hc_window_level unless the cache has a bam for the level
+            window = choose_hc_window(sr.pos, sr.ref, sr.alt, overlapping_interval, calling_intervals, level)
+            key = _compute_result_key(sr, window)
+            info = _result_cache.get(key)
+            if info is not None:
+                break
+        else:
+            return None
+
+        _compute_temp_output_paths(all_bam_output_dir, output_bam_path)  # makes sure the output directory exists
+        retry_if_IOError(_result_cache.link, key, os.path.join(all_bam_output_dir, output_bam_path))
+    except Exception as e:
+        logging.warning("%s-%s-%s-%s %s - couldn't use the result cache: %s" % (
+            sr.chrom, sr.pos, sr.ref, sr.alt, sr.sample_id, e))
+        return None
+
+    sr.hc_window_level = level
+
+    logging.info("%s-%s-%s-%s %s - %s %s - reusing cached bam %s" % (
+        sr.chrom, sr.pos, sr.ref, sr.alt, sr.het_or_hom_or_hemi, sr.sample_i, sr.sample_id, key))
+    sr.hc_n_artificial_haplotypes = info["hc_n_artificial_haplotypes"]
+    sr.hc_n_artificial_haplotypes_deleted = info["hc_n_artificial_haplotypes_deleted"]
+    sr.is_missing_original_gvcf = info["is_missing_original_gvcf"]
+    return _hc_succeeded(sr, output_bam_path, comment="_cached")
+
+
+def _strip_temp_prefix(filename):
+    """Removes the prefix added by _compute_temp_output_paths(..) (eg. 'tmp.' or 'tmp.<pid>.') from a file name"""
+    return re.sub("^tmp[.]([0-9]+[.])?", "", filename)
+
+
 def compute_output_bam_path(chrom, pos, ref, alt, het_or_hom_or_hemi, sample_i, suffix=""):
     """Computes the reassembled bam output path"""
 
@@ -308,6 +1018,8 @@ def hc_failed(error_code, message, sample_record, files_to_delete=None):
     sample_record.output_bam_path = None
     sample_record.comments = str(sample_record.comments or "") + "_error"+str(error_code)
     sample_record.save()
+    release_lease(Sample, sample_record.id)  # don't automatically retry samples that failed
+    activate_backup_samples(Sample, sample_record, MAX_SAMPLES_TO_SHOW_PER_VARIANT)  # run HC on a backup instead
 
     if files_to_delete:
         for path in files_to_delete:
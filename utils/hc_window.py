@@ -0,0 +1,84 @@
+"""
+Utility methods for choosing the window that HaplotypeCaller is run on for a variant. HC's runtime grows with the
+size of its -L intervals and padding, so each variant is first run on the smallest window that usually reproduces
+its original call, and the window is only widened if the GVCF check fails (see run_haplotype_caller(..)).
+
+Window levels, from smallest to largest:
+    0: the calling interval that spans the variant, plus the adjacent calling intervals that are within the padding
+       distance of the variant. The padding depends on the variant type and indel length.
+    1: the spanning calling interval plus one adjacent interval on each side, with the default padding
+    2: all the calling intervals from get_calling_window(..) - INCLUDE_N_ADJACENT_CALLING_REGIONS on each side - with
+       the default padding. This is the window that was used for every variant before window levels were added.
+"""
+
+import collections
+
+MAX_WINDOW_LEVEL = 2
+
+DEFAULT_PADDING = 300  # --paddingAroundSNPs and --paddingAroundIndels at levels 1 and 2
+MIN_PADDING = 100  # padding for SNVs at level 0. Indels get more, depending on their length.
+
+# indels at least this long start at level 1, since their reads are often soft-clipped or misaligned far from the
+# variant
+LONG_INDEL_LENGTH = 20
+
+# the -L intervals and padding to run HC with
+HcWindow = collections.namedtuple("HcWindow", [
+    "level",
+    "intervals",  # sorted list of calling intervals
+    "padding_around_snps",
+    "padding_around_indels",
+])
+
+
+def get_indel_length(ref, alt):
+    """Returns the number of inserted or deleted bases, or 0 for SNVs and MNPs"""
+    return abs(len(ref) - len(alt))
+
+
+def get_initial_window_level(ref, alt):
+    """Returns the window level to run HC on first for the given minrep'ed alleles"""
+    return 1 if get_indel_length(ref, alt) >= LONG_INDEL_LENGTH else 0
+
+
+def get_padding(ref, alt, level):
+    """Returns the number of bases of padding that HC needs around the given variant at the given window level"""
+    if level > 0:
+        return DEFAULT_PADDING
+    return min(DEFAULT_PADDING, MIN_PADDING + 2 * get_indel_length(ref, alt))
+
+
+def choose_hc_window(pos, ref, alt, overlapping_interval, calling_intervals, level):
+    """Returns the window to run HC on for the given variant.
+
+    Args:
+        pos, ref, alt: minrep'ed variant
+        overlapping_interval: the calling interval that spans the variant
+        calling_intervals: sorted list of calling intervals that includes overlapping_interval and the adjacent
+            intervals on either side (see get_calling_window(..))
+        level: window level between 0 and MAX_WINDOW_LEVEL
+    Return:
+        HcWindow
+    """
+    i = [str(interval) for interval in calling_intervals].index(str(overlapping_interval))
+    left_intervals, right_intervals = calling_intervals[:i], calling_intervals[i+1:]
+
+    padding = get_padding(ref, alt, level)
+    if level >= MAX_WINDOW_LEVEL:
+        intervals = calling_intervals
+    elif level == 1:
+        intervals = left_intervals[-1:] + [overlapping_interval] + right_intervals[:1]
+    else:
+        # only include adjacent intervals that HC's padding around the variant would reach
+        variant_start, variant_end = pos - padding, pos + len(ref) - 1 + padding
+        intervals = [interval for interval in left_intervals if interval.end >= variant_start] + \
+            [overlapping_interval] + [interval for interval in right_intervals if interval.start <= variant_end]
+
+    if level == 0:
+        # other indels in the window still get the default padding
+        padding_around_snps = MIN_PADDING
+        padding_around_indels = padding if get_indel_length(ref, alt) > 0 else DEFAULT_PADDING
+    else:
+        padding_around_snps = padding_around_indels = DEFAULT_PADDING
+
+    return HcWindow(level, intervals, padding_around_snps, padding_around_indels)
@@ -0,0 +1,73 @@
+"""
+Utility methods for breaking up genomic intervals into the units of work processed by parallelize.py
+"""
+import bisect
+
+
+def split_intervals_by_size(intervals, max_interval_size):
+    """Splits intervals so that none of them are bigger than max_interval_size.
+
+    Args:
+        intervals: list of dicts with "chrom", "start_pos", "end_pos" keys (1-based inclusive coordinates)
+        max_interval_size: integer max interval size
+    Return:
+        list of dicts with "chrom", "start_pos", "end_pos" keys
+    """
+    final_intervals = []
+    for interval in intervals:
+        chrom, start, end = interval["chrom"], interval["start_pos"], interval["end_pos"]
+        while end - start > max_interval_size:
+            final_intervals.append({"chrom": chrom,
+                                    "start_pos": start,
+                                    "end_pos": start + max_interval_size-1})
+            start = start + max_interval_size
+
+        final_intervals.append({"chrom": chrom, "start_pos": start, "end_pos": end})
+
+    return final_intervals
+
+
+def split_intervals_by_workload(intervals, workload_by_position, max_workload_per_interval, max_interval_size):
+    """Merges and splits intervals so that each one contains roughly max_workload_per_interval units of work
+    (eg. unfinished Sample records). Adjacent intervals on the same chromosome are merged until they contain enough
+    work or span more than max_interval_size, and intervals that contain too much work are split between the
+    positions that have work. A single position is never split, so an interval may still exceed
+    max_workload_per_interval if one position has more work than that.
+
+    Args:
+        intervals: list of dicts with "chrom", "start_pos", "end_pos" keys (1-based inclusive coordinates), sorted
+            by chrom and start_pos, and each no bigger than max_interval_size (see split_intervals_by_size)
+        workload_by_position: dict that maps each chrom to a 2-tuple of lists (positions, workloads) where
+            positions is sorted and workloads[i] is the amount of work at positions[i]
+        max_workload_per_interval: target amount of work per interval
+        max_interval_size: merged intervals will span at most this many base pairs
+    Return:
+        list of dicts with "chrom", "start_pos", "end_pos", "workload" keys
+    """
+    final_intervals = []
+    current = None
+    for interval in intervals:
+        chrom, start, end = interval["chrom"], interval["start_pos"], interval["end_pos"]
+        if current is not None and (current["chrom"] != chrom or end - current["start_pos"] + 1 > max_interval_size):
+            final_intervals.append(current)
+            current = None
+
+        if current is None:
+            current = {"chrom": chrom, "start_pos": start, "end_pos": end, "workload": 0}
+
+        positions, workloads = workload_by_position.get(chrom, ([], []))
+        i = bisect.bisect_left(positions, start)
+        j = bisect.bisect_right(positions, end)
+        for pos, workload in zip(positions[i:j], workloads[i:j]):
+            if current["workload"] > 0 and current["workload"] + workload > max_workload_per_interval:
+                current["end_pos"] = pos - 1
+                final_intervals.append(current)
+                current = {"chrom": chrom, "start_pos": pos, "end_pos": end, "workload": 0}
+            current["workload"] += workload
+
+        current["end_pos"] = end
+
+    if current is not None:
+        final_intervals.append(current)
+
+    return final_intervals
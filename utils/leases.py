@@ -0,0 +1,132 @@
+"""
+Utility methods for claiming database records (eg. intervals or samples) with a lease that is periodically renewed
+by the worker processing the record. If the worker dies (eg. it's killed by the queue time limit or the node fails),
+the lease expires and the record becomes claimable again without having to reset it manually.
+
+Models that use these methods must have started, finished and lease_expires fields. lease_expires is set when a
+record is claimed, renewed by LeaseHeartbeat, and set to NULL by release_lease(..) when the worker records a result
+for the record - success or a known error - so that records that failed in a known way are not retried automatically.
+Records that haven't been claimed yet have an already-expired lease (UNCLAIMED_LEASE_EXPIRATION), so that all
+claimable records can be selected with a range condition on the lease_expires index.
+"""
+
+import contextlib
+import datetime
+import logging
+import threading
+
+
+UNCLAIMED_LEASE_EXPIRATION = datetime.datetime(2000, 1, 1)
+
+
+def compute_lease_expiration(lease_duration_minutes):
+    """Returns the datetime when a lease that starts now would expire"""
+    return datetime.datetime.now() + datetime.timedelta(minutes=lease_duration_minutes)
+
+
+def is_claimable(model):
+    """Returns a where-clause that selects records that are either not started, or were started by a worker
+    whose lease has since expired.
+    """
+    return (model.lease_expires < datetime.datetime.now()) & (model.finished == 0)
+
+
+def mark_unclaimed_records(model, where_condition=None, batch_size=1000):
+    """Gives records that were added or reset without a lease (eg. with started=0 and lease_expires=NULL) an expired
+    lease, so that is_claimable(..) selects them.
+
+    The records are first selected using the lease_expires index, and then updated by id, so that calling this on a
+    region where all records already have a lease is a read-only query instead of an update that locks the region.
+
+    Args:
+        model: the leased model
+        where_condition: optional where-clause that limits which records are marked (eg. a genomic region)
+        batch_size: max number of record ids per update query
+    Return:
+        the number of records updated
+    """
+    condition = model.lease_expires.is_null() & (model.started == 0) & (model.finished == 0)
+    if where_condition is not None:
+        condition = condition & where_condition
+
+    ids = [row[0] for row in model.select(model.id).where(condition).tuples()]
+
+    num_updated = 0
+    for batch_start in range(0, len(ids), batch_size):
+        num_updated += model.update(lease_expires=UNCLAIMED_LEASE_EXPIRATION).where(
+            (model.id << ids[batch_start:batch_start + batch_size]) & condition).execute()
+    return num_updated
+
+
+def unclaim_records(model, record_ids):
+    """Makes the given claimed records claimable again right away (eg. when a worker exits before processing them)"""
+    model.update(started=0, lease_expires=UNCLAIMED_LEASE_EXPIRATION).where(
+        (model.id << list(record_ids)) & (model.finished == 0)).execute()
+
+
+def release_lease(model, record_id):
+    """Clears the lease on the given record so that it won't be re-claimed when the lease would have expired."""
+    model.update(lease_expires=None).where(model.id == record_id).execute()
+
+
+def get_fields_to_save(record):
+    """Returns all fields of the given record except its primary key and lease_expires. Leased models pass this to
+    save(only=..) so that saving a record doesn't overwrite a lease that's been renewed since the record was loaded.
+    """
+    return [field for field in record._meta.sorted_fields
+            if field.name != "lease_expires" and field is not record._meta.primary_key]
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Background thread that periodically renews the lease on a claimed record, or on a list of claimed records
+    that are being processed together. The heartbeat stops once all their leases have been released.
+    """
+
+    def __init__(self, model, record_id, lease_duration_minutes, heartbeat_interval_minutes):
+        threading.Thread.__init__(self, name="LeaseHeartbeat-%s-%s" % (model.__name__, record_id))
+        self.daemon = True
+        self.model = model
+        self.record_id = record_id
+        self.record_ids = list(record_id) if isinstance(record_id, (list, tuple)) else [record_id]
+        self.lease_duration_minutes = lease_duration_minutes
+        self.heartbeat_interval_minutes = heartbeat_interval_minutes
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.wait(self.heartbeat_interval_minutes * 60):
+                try:
+                    rows_updated = self.model.update(
+                        lease_expires=compute_lease_expiration(self.lease_duration_minutes)
+                    ).where(
+                        (self.model.id << self.record_ids) & (self.model.lease_expires.is_null(False))
+                    ).execute()
+                except Exception as e:
+                    logging.warning("%s %s - couldn't renew lease: %s" % (self.model.__name__, self.record_id, e))
+                    continue
+
+                if rows_updated == 0:
+                    logging.warning("%s %s - lease was released. Stopping heartbeat." % (self.model.__name__, self.record_id))
+                    break
+        finally:
+            self.model._meta.database.close()  # close this thread's connection
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def keep_lease_alive(model, record_id, lease_duration_minutes, heartbeat_interval_minutes):
+    """Context manager that renews the lease on the given record for as long as the with-block is running"""
+    heartbeat = LeaseHeartbeat(model, record_id, lease_duration_minutes, heartbeat_interval_minutes)
+    heartbeat.start()
+    try:
+        yield heartbeat
+    finally:
+        heartbeat.stop()
+
+
+def keep_leases_alive(model, record_ids, lease_duration_minutes, heartbeat_interval_minutes):
+    """Context manager that renews the leases on all the given records for as long as the with-block is running"""
+    return keep_lease_alive(model, list(record_ids), lease_duration_minutes, heartbeat_interval_minutes)
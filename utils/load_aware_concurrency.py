@@ -0,0 +1,91 @@
+"""
+Utility methods for deciding how many commands (eg. interval commands that run GATK) to run at the same time on a
+shared machine, based on its current load average and free memory.
+"""
+
+import logging
+import multiprocessing
+import os
+
+
+def get_free_memory_gb(meminfo_path="/proc/meminfo"):
+    """Returns the amount of memory available for new processes in GB, or None if it can't be determined."""
+    meminfo = {}
+    try:
+        with open(meminfo_path) as f:
+            for line in f:
+                fields = line.split()
+                meminfo[fields[0].rstrip(":")] = int(fields[1])  # in kB
+    except (IOError, OSError, ValueError, IndexError) as e:
+        logging.warning("Couldn't read %s: %s" % (meminfo_path, e))
+        return None
+
+    if "MemAvailable" in meminfo:
+        free_kb = meminfo["MemAvailable"]
+    else:
+        # older kernels
+        free_kb = meminfo.get("MemFree", 0) + meminfo.get("Buffers", 0) + meminfo.get("Cached", 0)
+
+    return free_kb / (1024.0 * 1024.0)
+
+
+def get_machine_load():
+    """Returns a 3-tuple: (1-minute load average, number of cpus, free memory in GB)"""
+    return os.getloadavg()[0], multiprocessing.cpu_count(), get_free_memory_gb()
+
+
+def compute_target_concurrency(num_running, num_starting, max_concurrency, load_average, num_cpus, free_memory_gb,
+                               memory_per_command_gb, max_load_per_cpu=1.0):
+    """Decides how many commands should be running.
+
+    Commands are added one at a time (the load average takes a while to reflect new commands), and only if the
+    machine has a free cpu and enough free memory for another command. If the machine is overloaded, the target is
+    reduced by one so that the next command to finish isn't replaced.
+
+    Args:
+        num_running: number of commands currently running
+        num_starting: how many of the running commands started recently enough that they may not have allocated
+            their full memory yet
+        max_concurrency: upper bound on the number of commands
+        load_average: the machine's current 1-minute load average
+        num_cpus: the machine's number of cpus
+        free_memory_gb: the machine's currently free memory, or None if unknown
+        memory_per_command_gb: how much memory each command eventually uses (eg. the GATK heap size plus overhead)
+        max_load_per_cpu: the machine counts as overloaded when load_average > max_load_per_cpu * num_cpus
+    Return:
+        the target number of commands, between 1 and max_concurrency
+    """
+    max_load = max_load_per_cpu * num_cpus
+
+    target = num_running
+    if load_average > max_load:
+        target = num_running - 1
+    elif load_average + 1 <= max_load:
+        # memory that recently-started commands will use soon isn't reflected in free_memory_gb yet
+        if free_memory_gb is not None and free_memory_gb - num_starting * memory_per_command_gb >= memory_per_command_gb:
+            target = num_running + 1
+
+    return max(1, min(max_concurrency, target))
+
+
+def compute_num_workers(max_workers, num_cpus, free_memory_gb, memory_per_worker_gb):
+    """Decides how many commands to run at the same time on this machine, based on how many of them fit into its
+    cpus and currently free memory.
+
+    Args:
+        max_workers: upper bound on the number of workers, or None for no bound
+        num_cpus: the machine's number of cpus
+        free_memory_gb: the machine's currently free memory, or None if unknown
+        memory_per_worker_gb: how much memory each command uses (eg. the GATK heap size plus JVM overhead)
+    Return:
+        the number of workers - at least 1
+    """
+    num_workers = num_cpus
+    if max_workers is not None:
+        num_workers = min(num_workers, max_workers)
+    if free_memory_gb is None:
+        num_workers = 1
+    else:
+        num_workers = min(num_workers, int(free_memory_gb // memory_per_worker_gb))
+
+    return max(1, num_workers)
@@ -168,6 +168,43 @@ def postprocess_bam(input_bam_path, output_bam_path, chrom, pos, ref, alt):
     return (is_bam_empty, artificial_haplotype_counter, artificial_haplotypes_deleted_counter)
 
 
+def slice_reassembled_bam(input_bam_path, output_bam_path, chrom, start, end, max_read_distance=1000):
+    """Copies the part of an indexed HaplotypeCaller -bamout bam that was reassembled within the given region - the
+    artificial haplotypes that overlap the region and the reads assigned to them. This is used to split the bamout of
+    a batched HaplotypeCaller run that covered many variants into per-variant bams for postprocess_bam(..).
+
+    Args:
+        input_bam_path: indexed -bamout bam
+        output_bam_path: output bam path
+        chrom: chromosome (eg. '1' or 'X')
+        start: 1-based inclusive region start
+        end: 1-based inclusive region end
+        max_read_distance: reads assigned to a haplotype can extend this far past the region
+
+    Return:
+        the number of records written to the output bam
+    """
+    ibam = pysam.AlignmentFile(input_bam_path, "rb")
+    records = list(ibam.fetch(chrom, max(0, start - 1 - max_read_distance), end + max_read_distance))
+
+    haplotype_ids = set()
+    for r in records:
+        tags = dict(r.tags)
+        if tags.get('RG') == "ArtificialHaplotype" and r.reference_start < end and r.reference_end > start - 1:
+            haplotype_ids.add(tags['HC'])
+
+    records_written = 0
+    obam = pysam.AlignmentFile(output_bam_path, "wb", template=ibam)
+    for r in records:
+        if dict(r.tags).get('HC') in haplotype_ids:
+            obam.write(r)
+            records_written += 1
+    obam.close()
+    ibam.close()
+
+    return records_written
+
+
 if __name__ == "__main__":
     p = argparse.ArgumentParser("Takes an HC output bam and discards non-essential header fields and tags, obfuscates read names, etc.")
     p.add_argument("-i", "--input-bam", help=".bam output from HaplotypeCaller", required=True)
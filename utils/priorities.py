@@ -0,0 +1,147 @@
+"""
+Utility methods for assigning processing priorities to intervals and samples so that the ones in important genes are
+claimed first. Like the priority fields themselves, lower values are processed first.
+
+A record's priority is the sum of the adjustments for each rule that applies to it:
+   - overlaps an interval in scripts/data/top_intervals.txt: PRIORITY_ADJUSTMENT_FOR_TOP_INTERVALS
+   - is a TCGA sample (whose bams are slow to access): PRIORITY_ADJUSTMENT_FOR_TCGA_SAMPLES
+"""
+
+import bisect
+import collections
+import logging
+import os
+
+DEFAULT_PRIORITY = 0
+PRIORITY_ADJUSTMENT_FOR_TOP_INTERVALS = -1
+PRIORITY_ADJUSTMENT_FOR_TCGA_SAMPLES = 1
+
+TOP_INTERVALS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "scripts", "data", "top_intervals.txt")
+
+
+def read_top_intervals(top_intervals_path=TOP_INTERVALS_PATH):
+    """Parses a file of important intervals with tab-separated columns: name, chrom, start, end.
+
+    Return:
+        dict that maps each chrom to a list of (start, end) tuples sorted by start
+    """
+    top_intervals = collections.defaultdict(list)
+    with open(top_intervals_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            name, chrom, start, end = line.strip("\n").split("\t")
+            top_intervals[chrom].append((int(start), int(end)))
+
+    for intervals in top_intervals.values():
+        intervals.sort()
+
+    logging.info("Loaded %s top intervals from %s" % (sum(map(len, top_intervals.values())), top_intervals_path))
+    return dict(top_intervals)
+
+
+def read_tcga_sample_ids(tcga_bam_paths_table):
+    """Returns the set of sample ids in the first column of the TCGA_NEW_BAM_PATHS table"""
+    with open(tcga_bam_paths_table) as f:
+        return set(line.strip("\n").split("\t")[0] for line in f if line.strip())
+
+
+def overlaps_top_interval(top_intervals, chrom, start, end):
+    """Returns True if the region chrom:start-end (inclusive) overlaps any of the top_intervals"""
+    intervals = top_intervals.get(chrom, [])
+    # only intervals that start at or before 'end' can overlap
+    i = bisect.bisect_right(intervals, (end, float("inf")))
+    return any(interval_end >= start for _, interval_end in intervals[:i])
+
+
+def compute_priority(top_intervals, chrom, start, end, is_tcga_sample=False):
+    """Returns the priority of a record (interval or sample) that covers the region chrom:start-end"""
+    priority = DEFAULT_PRIORITY
+    if overlaps_top_interval(top_intervals, chrom, start, end):
+        priority += PRIORITY_ADJUSTMENT_FOR_TOP_INTERVALS
+    if is_tcga_sample:
+        priority += PRIORITY_ADJUSTMENT_FOR_TCGA_SAMPLES
+    return priority
+
+
+def get_priority_ordering(model):
+    """Returns the order_by(..) args that sort records by priority, lowest first. Records with a NULL priority (eg.
+    loaded before priorities were assigned) are sorted as if they had the lowest priority rather than first, which is
+    where MySQL puts NULLs.
+    """
+    return (model.priority.is_null(), model.priority)
+
+
+def pick_highest_priority_record(records):
+    """Given records retrieved in priority order (eg. the first N claimable records), returns the last record that
+    has the same priority as the first one. Picking the last record (rather than the first) reduces collisions between
+    tasks that are claiming at the same time, while never skipping ahead to lower-priority records.
+    """
+    records = [r for r in records if r.priority == records[0].priority]
+    return records[-1]
+
+
+def assign_interval_priorities(interval_model, top_intervals):
+    """Sets the priority field of all unfinished records in an intervals table (eg. parallelize.py's
+    ParallelIntervals). The model must have chrom, start_pos, end_pos, finished and priority fields.
+    """
+    logging.info("%s: assigning priorities" % interval_model._meta.db_table)
+    interval_model.update(priority=DEFAULT_PRIORITY).where(interval_model.finished == 0).execute()
+
+    for chrom, intervals in top_intervals.items():
+        for start, end in intervals:
+            interval_model.update(
+                priority=DEFAULT_PRIORITY + PRIORITY_ADJUSTMENT_FOR_TOP_INTERVALS
+            ).where(
+                (interval_model.finished == 0) &
+                (interval_model.chrom == chrom) &
+                (interval_model.start_pos <= end) &
+                (interval_model.end_pos >= start)
+            ).execute()
+
+
+def assign_sample_priorities(sample_model, top_intervals, tcga_sample_ids, batch_size=1000):
+    """Sets the priority field of all unfinished records in the Sample table.
+
+    Args:
+        sample_model: the Sample model (or another model with chrom, pos, sample_id, finished and priority fields)
+        top_intervals: dict returned by read_top_intervals(..)
+        tcga_sample_ids: set of TCGA sample ids
+        batch_size: max number of sample ids per update query
+    """
+    logging.info("%s: assigning priorities" % sample_model._meta.db_table)
+    sample_model.update(priority=DEFAULT_PRIORITY).where(sample_model.finished == 0).execute()
+
+    tcga_sample_ids = sorted(tcga_sample_ids)
+    for batch_start in range(0, len(tcga_sample_ids), batch_size):
+        sample_model.update(
+            priority=sample_model.priority + PRIORITY_ADJUSTMENT_FOR_TCGA_SAMPLES
+        ).where(
+            (sample_model.finished == 0) &
+            (sample_model.sample_id << tcga_sample_ids[batch_start:batch_start + batch_size])
+        ).execute()
+
+    for chrom, intervals in top_intervals.items():
+        for start, end in _merge_overlapping(intervals):
+            sample_model.update(
+                priority=sample_model.priority + PRIORITY_ADJUSTMENT_FOR_TOP_INTERVALS
+            ).where(
+                (sample_model.finished == 0) &
+                (sample_model.chrom == chrom) &
+                (sample_model.pos >= start) &
+                (sample_model.pos <= end)
+            ).execute()
+
+
+def _merge_overlapping(intervals):
+    """Merges overlapping (start, end) tuples in a sorted list so that relative priority adjustments are only applied
+    once to each position.
+    """
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,144 @@
+"""
+Utility methods for measuring the peak memory, cpu time and I/O of child processes (eg. the JVMs that run GATK and
+Picard), and for recommending JVM heap sizes and concurrency from the measurements. See
+scripts/recommend_jvm_settings.py.
+"""
+
+import collections
+import logging
+import os
+import subprocess
+
+from utils.runtime_prediction import compute_percentile
+
+# resources used by a child process
+ProcessUsage = collections.namedtuple("ProcessUsage", [
+    "cpu_seconds",  # user + system cpu time
+    "peak_rss_mb",  # max resident set size
+    "read_mb",  # bytes read from storage. Doesn't include reads from NFS that were served by the page cache.
+    "write_mb",
+])
+
+
+def run_command_with_usage(command, shell=True):
+    """Runs the given command like subprocess.check_output(..), but also gets its resource usage from os.wait4(..).
+    With shell=True, the usage includes the shell's children (eg. the JVM).
+
+    Args:
+        command: command string (or list of args if shell=False)
+        shell: passed to subprocess.Popen
+    Return:
+        3-tuple (returncode, output, ProcessUsage) where output is the command's stdout and stderr as a string
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=shell)
+    try:
+        output = process.stdout.read().decode("utf-8", "replace")
+    finally:
+        process.stdout.close()
+        _, status, rusage = os.wait4(process.pid, 0)
+
+    # the process was reaped by os.wait4, so set its returncode the way Popen.wait() would
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    usage = ProcessUsage(
+        cpu_seconds=rusage.ru_utime + rusage.ru_stime,
+        peak_rss_mb=rusage.ru_maxrss / 1024.0,  # ru_maxrss is in KB on linux
+        read_mb=rusage.ru_inblock * 512 / 1024.0**2,  # in 512-byte blocks
+        write_mb=rusage.ru_oublock * 512 / 1024.0**2,
+    )
+
+    return process.returncode, output, usage
+
+
+def read_proc_usage(pid):
+    """Returns the resources used so far by the given running process, from /proc. peak_rss_mb is the peak since
+    the process started. Subtract the cpu and I/O fields of two calls to get the usage in between (see
+    subtract_usage(..)).
+
+    Return:
+        ProcessUsage, or None if /proc isn't available
+    """
+    try:
+        with open("/proc/%s/stat" % pid) as f:
+            # the command name in field 2 can contain spaces, so split after its closing parenthesis
+            stat_fields = f.read().rsplit(")", 1)[1].split()
+        clock_ticks = float(os.sysconf("SC_CLK_TCK"))
+        cpu_seconds = (int(stat_fields[11]) + int(stat_fields[12])) / clock_ticks  # utime and stime
+
+        peak_rss_kb = 0
+        with open("/proc/%s/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_rss_kb = int(line.split()[1])
+
+        io = {}
+        with open("/proc/%s/io" % pid) as f:
+            for line in f:
+                key, value = line.split(":")
+                io[key] = int(value)
+    except (IOError, OSError, ValueError, IndexError) as e:
+        logging.debug("couldn't read /proc usage for process %s: %s" % (pid, e))
+        return None
+
+    return ProcessUsage(
+        cpu_seconds=cpu_seconds,
+        peak_rss_mb=peak_rss_kb / 1024.0,
+        read_mb=io.get("read_bytes", 0) / 1024.0**2,
+        write_mb=io.get("write_bytes", 0) / 1024.0**2,
+    )
+
+
+def subtract_usage(usage_after, usage_before):
+    """Returns the cpu time and I/O between two read_proc_usage(..) calls, and the peak RSS as of the 2nd call"""
+    if usage_after is None or usage_before is None:
+        return None
+
+    return ProcessUsage(
+        cpu_seconds=usage_after.cpu_seconds - usage_before.cpu_seconds,
+        peak_rss_mb=usage_after.peak_rss_mb,
+        read_mb=usage_after.read_mb - usage_before.read_mb,
+        write_mb=usage_after.write_mb - usage_before.write_mb,
+    )
+
+
+def recommend_jvm_settings(peak_rss_mb_values, cpu_utilization_values, node_memory_gb, num_cpus, jvm_overhead_mb,
+                           percentile=99, safety_margin=0.25, min_heap_mb=512):
+    """Recommends a JVM heap size and how many commands to run at the same time on a node, based on the observed
+    peak RSS and cpu utilization of previous runs of the same command.
+
+    The heap is sized so that runs at the given percentile of peak RSS, plus safety_margin, still fit. Each command
+    is then assumed to use up to its heap plus jvm_overhead_mb, and the number of commands per node is limited by
+    both memory and cpus (commands that wait on I/O use less than one cpu each).
+
+    Args:
+        peak_rss_mb_values: non-empty list of peak RSS in MB of previous runs
+        cpu_utilization_values: non-empty list of cpu_seconds / wall_seconds of previous runs
+        node_memory_gb: memory available for the commands on each node
+        num_cpus: number of cpus on each node
+        jvm_overhead_mb: memory used by the JVM in addition to its heap
+        percentile: see above
+        safety_margin: fraction to add to the peak RSS percentile
+        min_heap_mb: never recommend a smaller heap than this
+    Return:
+        dict with max_heap_mb, memory_per_command_mb, num_concurrent, and the values it was based on
+    """
+    peak_rss_mb = compute_percentile(peak_rss_mb_values, percentile)
+    max_heap_mb = max(min_heap_mb, int(peak_rss_mb * (1 + safety_margin) - jvm_overhead_mb))
+    memory_per_command_mb = max_heap_mb + jvm_overhead_mb
+
+    cpu_utilization = max(0.05, sum(cpu_utilization_values) / float(len(cpu_utilization_values)))
+    num_concurrent_by_memory = int(node_memory_gb * 1024 // memory_per_command_mb)
+    num_concurrent_by_cpu = int(num_cpus / cpu_utilization)
+
+    return {
+        "peak_rss_mb_percentile": peak_rss_mb,
+        "avg_cpu_utilization": cpu_utilization,
+        "max_heap_mb": max_heap_mb,
+        "memory_per_command_mb": memory_per_command_mb,
+        "num_concurrent_by_memory": num_concurrent_by_memory,
+        "num_concurrent_by_cpu": num_concurrent_by_cpu,
+        "num_concurrent": max(1, min(num_concurrent_by_memory, num_concurrent_by_cpu)),
+    }
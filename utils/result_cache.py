@@ -0,0 +1,121 @@
+"""
+Content-addressed cache of postprocessed reassembled bams. After sample records are reset (eg. by
+scripts/reset_failed_db_records.py) or the sample table is rebuilt, HC would otherwise be re-run on inputs that
+haven't changed. Each bam that passed the GVCF check is saved under a digest of everything that determines its
+contents, and is linked into place instead of re-running HC when the same digest comes up again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from utils.file_utils import link_file
+
+
+def compute_result_key(original_bam_path, original_gvcf_path, calling_intervals, gatk_jar_path, hc_args, chrom, pos,
+                       ref, alt):
+    """Returns a digest of the inputs that determine the postprocessed reassembled bam for a variant.
+
+    Args:
+        original_bam_path: the original bam. Its resolved path and modification time are used, so that the key
+            changes if the bam is replaced.
+        original_gvcf_path: the original GVCF that the bam was checked against. Its resolved path and the
+            modification times of it and its .tbi index (or None if they don't exist) are used, so that a cached
+            entry isn't reused after the GVCF is added, removed or replaced.
+        calling_intervals: the intervals HC is run on (their string representations are used)
+        gatk_jar_path: GATK jar. Its resolved path, size and modification time are used.
+        hc_args: list of HaplotypeCaller arguments, excluding the input and output paths
+        chrom, pos, ref, alt: minrep'ed variant - postprocessing depends on it
+    Return:
+        hex digest string
+    """
+    resolved_bam_path = os.path.realpath(original_bam_path)
+    resolved_jar_path = os.path.realpath(gatk_jar_path)
+    jar_stat = os.stat(resolved_jar_path)
+
+    resolved_gvcf_path = os.path.realpath(original_gvcf_path)
+
+    inputs = [
+        resolved_bam_path, os.path.getmtime(resolved_bam_path),
+        resolved_gvcf_path, _get_mtime_if_exists(resolved_gvcf_path), _get_mtime_if_exists(resolved_gvcf_path + ".tbi"),
+        [str(i) for i in calling_intervals],
+        resolved_jar_path, jar_stat.st_size, jar_stat.st_mtime,
+        list(hc_args),
+        [str(chrom), int(pos), ref, alt],
+    ]
+    return hashlib.sha1(json.dumps(inputs).encode("utf-8")).hexdigest()
+
+
+def _get_mtime_if_exists(path):
+    """Returns the modification time of the given file, or None if it doesn't exist"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class ResultCache(object):
+    """Stores postprocessed bams as <cache_dir>/<key[:2]>/<key>.bam, along with a <key>.json file with the stats
+    that are saved in the Sample record. An entry is only valid if the json file exists and the bam has the size
+    recorded in it, so a partially-written entry is never used.
+
+    Example:
+        cache = ResultCache("/humgen/.../result_cache")
+        info = cache.get(key)
+        if info is not None:
+            cache.link(key, output_bam_path)
+        else:
+            ... run HC ...
+            cache.put(key, output_bam_path, {"hc_n_artificial_haplotypes": 2})
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get(self, key):
+        """Returns the info dict saved with the cached bam, or None if there's no valid entry for this key"""
+        bam_path, info_path = self._get_paths(key)
+        try:
+            with open(info_path) as f:
+                info = json.load(f)
+            if os.path.getsize(bam_path) != info["bam_size"]:
+                logging.warning("%s: size doesn't match %s. Ignoring it." % (bam_path, info_path))
+                return None
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return info
+
+    def link(self, key, destination_path):
+        """Hard-links (or copies) the cached bam to destination_path"""
+        bam_path, _ = self._get_paths(key)
+        link_file(bam_path, destination_path)
+
+    def put(self, key, bam_path, info):
+        """Adds bam_path to the cache.
+
+        Args:
+            key: see compute_result_key(..)
+            bam_path: postprocessed bam
+            info: dict of json-serializable values to save with the bam
+        """
+        cached_bam_path, info_path = self._get_paths(key)
+        cached_bam_dir = os.path.dirname(cached_bam_path)
+        if not os.path.isdir(cached_bam_dir):
+            try:
+                os.makedirs(cached_bam_dir)
+            except OSError:
+                if not os.path.isdir(cached_bam_dir):  # another task may have created it
+                    raise
+
+        link_file(bam_path, cached_bam_path)
+
+        info = dict(info, bam_size=os.path.getsize(cached_bam_path))
+        temp_info_path = "%s.tmp%s" % (info_path, os.getpid())
+        with open(temp_info_path, "w") as f:
+            json.dump(info, f)
+        os.rename(temp_info_path, info_path)
+
+    def _get_paths(self, key):
+        bam_path = os.path.join(self.cache_dir, key[:2], key + ".bam")
+        return bam_path, bam_path.replace(".bam", ".json")
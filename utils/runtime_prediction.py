@@ -0,0 +1,97 @@
+"""
+Utility methods for predicting how long the next unit of work (eg. an interval or a sample) will take based on
+how long previous units took, so that a task can avoid starting work it won't be able to finish before the queue
+time limit kills it.
+"""
+import math
+
+
+def compute_percentile(values, percentile):
+    """Returns the given percentile of values using the nearest-rank method.
+
+    Args:
+        values: non-empty list of numbers
+        percentile: number between 0 and 100
+    """
+    sorted_values = sorted(values)
+    rank = int(math.ceil(percentile * len(sorted_values) / 100.0))
+    return sorted_values[max(1, min(len(sorted_values), rank)) - 1]
+
+
+def predict_runtime(runtimes, percentile=90, min_runtimes=10):
+    """Predicts the runtime of the next unit of work.
+
+    Args:
+        runtimes: list of runtimes (in seconds) of previous units of work
+        percentile: predict this percentile of the previous runtimes, so that most (but not all) units finish within
+            the predicted time.
+        min_runtimes: if there are fewer than this many previous runtimes, don't make a prediction
+    Return:
+        predicted runtime in seconds, or None if there isn't enough data.
+    """
+    if len(runtimes) < min_runtimes:
+        return None
+
+    return compute_percentile(runtimes, percentile)
+
+
+def will_next_unit_fit(seconds_elapsed, seconds_limit, runtimes, percentile=90, min_runtimes=10):
+    """Returns True if the next unit of work is predicted to finish before the time limit. If there isn't enough
+    data to make a prediction, just checks that the time limit hasn't been reached yet.
+
+    Args:
+        seconds_elapsed: how long the task has been running so far
+        seconds_limit: the task's total time limit
+        runtimes: list of runtimes (in seconds) of previous units of work
+        percentile: see predict_runtime(..)
+        min_runtimes: see predict_runtime(..)
+    """
+    predicted_runtime = predict_runtime(runtimes, percentile=percentile, min_runtimes=min_runtimes)
+    if predicted_runtime is None:
+        predicted_runtime = 0
+
+    return seconds_elapsed + predicted_runtime <= seconds_limit
+
+
+def get_runtimes_in_seconds(started_and_finished_times):
+    """Converts an iterable of (started_time, finished_time) datetime 2-tuples to a list of runtimes in seconds,
+    skipping tuples where either time is missing.
+    """
+    return [(finished - started).total_seconds() for started, finished in started_and_finished_times
+            if started is not None and finished is not None and finished >= started]
+
+
+def compute_eta(num_remaining, num_finished_in_window, window_minutes, num_in_progress=0, recent_avg_runtime=None):
+    """Estimates the rate at which units of work are finishing, and how long the remaining units will take at that
+    rate (see scripts/print_progress_report.py).
+
+    Args:
+        num_remaining: number of units that haven't finished yet
+        num_finished_in_window: number of units that finished in the last window_minutes
+        window_minutes: how far back num_finished_in_window goes
+        num_in_progress: number of units that are being processed right now
+        recent_avg_runtime: avg runtime in seconds of the units that finished in the last window_minutes, or None
+            if none did
+    Return:
+        3-tuple (throughput_per_hour, eta_hours, eta_hours_from_runtime) where eta_hours is based on the throughput
+        and eta_hours_from_runtime is based on num_in_progress and recent_avg_runtime. Either ETA is None if it
+        can't be estimated (eg. if nothing finished in the window), and 0 if nothing is remaining.
+    """
+    num_remaining = int(num_remaining or 0)
+    num_in_progress = int(num_in_progress or 0)
+
+    throughput_per_hour = int(num_finished_in_window or 0) * 60.0 / window_minutes
+
+    eta_hours = None
+    if num_remaining == 0:
+        eta_hours = 0.0
+    elif throughput_per_hour > 0:
+        eta_hours = num_remaining / throughput_per_hour
+
+    eta_hours_from_runtime = None
+    if num_remaining == 0:
+        eta_hours_from_runtime = 0.0
+    elif num_in_progress > 0 and recent_avg_runtime:
+        eta_hours_from_runtime = num_remaining * float(recent_avg_runtime) / num_in_progress / 3600.0
+
+    return throughput_per_hour, eta_hours, eta_hours_from_runtime
@@ -0,0 +1,151 @@
+"""
+Utility methods for computing the sample_i field of Sample records in bulk. sample_i is the rank of a sample among
+all samples of the same variant and genotype (het, hom or hemi), ordered by id, and determines which samples are shown
+in the browser (see MAX_SAMPLES_TO_SHOW_PER_VARIANT) and which are backups.
+
+Backup samples are marked as inactive when their sample_i is assigned, so that HC is only run on them if it fails on
+enough of the variant's other samples (see activate_backup_samples(..)).
+"""
+
+import logging
+import operator
+from functools import reduce
+
+
+def compute_sample_indexes(rows):
+    """Computes sample_i for rows that don't have it yet.
+
+    Args:
+        rows: iterable over (id, variant_key, sample_i) tuples sorted by variant_key and then id, where variant_key
+            is any value that's the same for all samples of a variant and genotype (eg. (chrom, pos, ref, alt,
+            het_or_hom_or_hemi)), and sample_i is None for rows that need it.
+    Return:
+        generator of (id, sample_i) for the rows whose sample_i was None
+    """
+    previous_variant_key = None
+    i = 0
+    for record_id, variant_key, sample_i in rows:
+        if variant_key != previous_variant_key:
+            previous_variant_key = variant_key
+            i = 0
+        else:
+            i += 1
+
+        if sample_i is None:
+            yield record_id, i
+
+
+def assign_sample_indexes(sample_model, where_condition=None, num_primary_samples=None, batch_size=1000,
+                          variant_batch_size=100):
+    """Sets sample_i for all records in the Sample table (or the subset selected by where_condition) that don't have
+    it yet. The variants that have records without sample_i are selected first, and then only those variants' records
+    are read and updated, so that calling this on a region where most variants already have sample_i doesn't read the
+    whole region.
+
+    The result doesn't depend on which records already have sample_i, so it's safe for several workers to run this on
+    the same records at the same time.
+
+    Args:
+        sample_model: the Sample model
+        where_condition: optional where-clause that selects whole variants (eg. a genomic region)
+        num_primary_samples: if specified, records with sample_i >= num_primary_samples are marked as inactive backups
+        batch_size: max number of record ids per update query
+        variant_batch_size: max number of variants per select query
+    Return:
+        the number of records updated
+    """
+    variant_key_fields = [sample_model.chrom, sample_model.pos, sample_model.ref, sample_model.alt,
+                          sample_model.het_or_hom_or_hemi]
+
+    missing_condition = sample_model.sample_i.is_null()
+    if where_condition is not None:
+        missing_condition = missing_condition & where_condition
+    variant_keys = list(sample_model.select(*variant_key_fields).where(missing_condition).distinct().tuples())
+    if not variant_keys:
+        return 0
+
+    ids_by_sample_i = {}
+    for batch_start in range(0, len(variant_keys), variant_batch_size):
+        variants_condition = reduce(operator.or_, [
+            get_variant_key_condition(sample_model, variant_key)
+            for variant_key in variant_keys[batch_start:batch_start + variant_batch_size]])
+
+        query = sample_model.select(*([sample_model.id] + variant_key_fields + [sample_model.sample_i])).where(
+            variants_condition).order_by(*(variant_key_fields + [sample_model.id]))
+
+        rows = ((row[0], row[1:6], row[6]) for row in query.tuples().iterator())
+        for record_id, sample_i in compute_sample_indexes(rows):
+            ids_by_sample_i.setdefault(sample_i, []).append(record_id)
+
+    num_updated = 0
+    for sample_i, ids in sorted(ids_by_sample_i.items()):
+        for batch_start in range(0, len(ids), batch_size):
+            num_updated += sample_model.update(
+                sample_i=sample_i,
+                is_inactive_backup=num_primary_samples is not None and sample_i >= num_primary_samples,
+            ).where(
+                (sample_model.id << ids[batch_start:batch_start + batch_size]) & sample_model.sample_i.is_null()
+            ).execute()
+
+    logging.info("%s: assigned sample_i to %s records of %s variants" % (
+        sample_model._meta.db_table, num_updated, len(variant_keys)))
+    return num_updated
+
+
+def get_variant_key_condition(sample_model, variant_key):
+    """Returns a where-clause that selects all samples with the given (chrom, pos, ref, alt, het_or_hom_or_hemi)"""
+    chrom, pos, ref, alt, het_or_hom_or_hemi = variant_key
+    return ((sample_model.chrom == chrom) &
+            (sample_model.pos == pos) &
+            (sample_model.ref == ref) &
+            (sample_model.alt == alt) &
+            (sample_model.het_or_hom_or_hemi == het_or_hom_or_hemi))
+
+
+def get_variant_condition(sample_model, sample_record):
+    """Returns a where-clause that selects all samples of the given sample's variant and genotype"""
+    return get_variant_key_condition(sample_model, (
+        sample_record.chrom, sample_record.pos, sample_record.ref, sample_record.alt,
+        sample_record.het_or_hom_or_hemi))
+
+
+def activate_backup_samples(sample_model, failed_sample_record, num_samples_needed):
+    """Called when HC fails on a sample. If the variant now has fewer than num_samples_needed active samples that
+    succeeded or are still pending, activates enough of its inactive backup samples (lowest sample_i first) to make
+    up the difference.
+
+    Args:
+        sample_model: the Sample model
+        failed_sample_record: the Sample record that failed
+        num_samples_needed: how many samples to show per variant (MAX_SAMPLES_TO_SHOW_PER_VARIANT)
+    Return:
+        the number of backup samples that were activated
+    """
+    variant_condition = get_variant_condition(sample_model, failed_sample_record)
+
+    num_succeeded_or_pending = sample_model.select(sample_model.id).where(
+        variant_condition &
+        (sample_model.is_inactive_backup == 0) &
+        (sample_model.id != failed_sample_record.id) &
+        ((sample_model.hc_succeeded == 1) | ((sample_model.finished == 0) & sample_model.hc_error_code.is_null()))
+    ).count()
+
+    num_to_activate = num_samples_needed - num_succeeded_or_pending
+    if num_to_activate <= 0:
+        return 0
+
+    backup_ids = [row[0] for row in sample_model.select(sample_model.id).where(
+        variant_condition & (sample_model.is_inactive_backup == 1)
+    ).order_by(sample_model.sample_i).limit(num_to_activate).tuples()]
+
+    if not backup_ids:
+        return 0
+
+    num_activated = sample_model.update(is_inactive_backup=0).where(
+        (sample_model.id << backup_ids) & (sample_model.is_inactive_backup == 1)).execute()
+
+    logging.info("%s-%s-%s-%s %s - activated %s backup samples" % (
+        failed_sample_record.chrom, failed_sample_record.pos, failed_sample_record.ref, failed_sample_record.alt,
+        failed_sample_record.het_or_hom_or_hemi, num_activated))
+
+    return num_activated
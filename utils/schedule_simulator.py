@@ -0,0 +1,164 @@
+"""
+Offline simulator for choosing parallelize.py settings (--num-jobs, --interval-size, EXIT_UGER_JOB_AFTER_N_HOURS).
+It replays per-interval runtimes from a finished intervals table through a model of how array job tasks claim and
+process intervals, and predicts the makespan and how much compute is wasted.
+
+The model:
+   - num_jobs tasks start at time 0. When a task exits (after exit_after_seconds, or when it's killed at the queue
+     time limit), a replacement task starts resubmit_delay_seconds later, like with parallelize.py --supervise.
+   - Each claim takes claim_seconds. Like parallelize.py, a task picks a random interval among the first claim_window
+     claimable ones. Intervals claimed by other tasks within the last claim_seconds still look claimable, so picking
+     one of them is a collision, and the task has to claim again.
+   - If an interval doesn't finish before the task's queue time limit, the task is killed, the time spent on the
+     interval is wasted, and the interval becomes claimable again once its lease expires.
+"""
+
+import collections
+import heapq
+import random
+
+from utils.interval_splitting import split_intervals_by_size
+
+
+def retile_interval_runtimes(intervals, interval_size, per_interval_overhead_seconds=0):
+    """Predicts per-interval runtimes for a different --interval-size by spreading each historical interval's runtime
+    evenly over its bases and re-splitting.
+
+    Args:
+        intervals: list of dicts with chrom, start_pos, end_pos and runtime (in seconds) keys, sorted by chrom and
+            start_pos. Adjacent intervals (where one starts right after the previous one ends) are assumed to come
+            from the same original interval, and are re-split together.
+        interval_size: the new max interval size
+        per_interval_overhead_seconds: fixed cost per interval (eg. startup time) that doesn't scale with size
+    Return:
+        list of predicted runtimes (in seconds) for the re-split intervals
+    """
+    # group adjacent intervals
+    groups = []
+    for interval in intervals:
+        if groups and groups[-1][-1]["chrom"] == interval["chrom"] and groups[-1][-1]["end_pos"] + 1 == interval["start_pos"]:
+            groups[-1].append(interval)
+        else:
+            groups.append([interval])
+
+    runtimes = []
+    for group in groups:
+        new_intervals = split_intervals_by_size(
+            [{"chrom": group[0]["chrom"], "start_pos": group[0]["start_pos"], "end_pos": group[-1]["end_pos"]}],
+            interval_size)
+
+        for new_interval in new_intervals:
+            work_seconds = 0.0
+            for interval in group:
+                overlap = min(interval["end_pos"], new_interval["end_pos"]) - max(interval["start_pos"], new_interval["start_pos"]) + 1
+                if overlap > 0:
+                    size = interval["end_pos"] - interval["start_pos"] + 1
+                    work = max(0, interval["runtime"] - per_interval_overhead_seconds)
+                    work_seconds += work * overlap / float(size)
+            runtimes.append(per_interval_overhead_seconds + work_seconds)
+
+    return runtimes
+
+
+SimulationResult = collections.namedtuple("SimulationResult", [
+    "makespan_seconds",  # time until the last interval finished
+    "task_seconds",  # total time tasks were running (including claims and killed intervals)
+    "useful_seconds",  # time spent on intervals that finished
+    "killed_seconds",  # time spent on intervals that were killed at the queue time limit
+    "collision_seconds",  # time spent on claims that collided with another task's claim
+    "num_tasks",  # total number of tasks that were started
+    "num_killed",  # number of times an interval was killed at the queue time limit
+    "num_collisions",
+    "num_unfinished",  # intervals that can't finish within the time limit even in a new task
+])
+
+
+def simulate_schedule(runtimes, num_jobs, time_limit_seconds, exit_after_seconds, claim_seconds=1.0,
+                      lease_seconds=600, resubmit_delay_seconds=60, claim_window=1000, seed=0):
+    """Simulates processing intervals with the given runtimes.
+
+    Args:
+        runtimes: list of interval runtimes in seconds
+        num_jobs: number of concurrent array job tasks
+        time_limit_seconds: queue time limit after which a task is killed
+        exit_after_seconds: tasks don't claim new intervals after running this long (EXIT_UGER_JOB_AFTER_N_HOURS)
+        claim_seconds: how long it takes to claim an interval
+        lease_seconds: how long a killed task's interval stays claimed (CLAIM_LEASE_DURATION_MINUTES)
+        resubmit_delay_seconds: how long it takes for a replacement task to start after a task exits
+        claim_window: tasks pick a random interval among this many claimable ones
+        seed: random seed
+    Return:
+        SimulationResult
+    """
+    rng = random.Random(seed)
+
+    # intervals that would be killed even at the start of a task can never finish, so leave them out
+    claimable = [i for i, runtime in enumerate(runtimes) if claim_seconds + runtime <= time_limit_seconds]
+    num_unfinished = len(runtimes) - len(claimable)
+
+    released = []  # heap of (time when lease expires, interval index) for killed intervals
+    recent_claims = collections.deque()  # times of claims within the last claim_seconds
+
+    tasks = [(0.0, task_i, 0.0) for task_i in range(num_jobs)]  # heap of (time, task id, task start time)
+    heapq.heapify(tasks)
+    num_tasks = num_jobs
+
+    makespan = task_seconds = useful = killed = collision = 0.0
+    num_killed = num_collisions = 0
+
+    while tasks:
+        t, task_i, task_start = heapq.heappop(tasks)
+
+        while released and released[0][0] <= t:
+            claimable.append(heapq.heappop(released)[1])
+
+        if not claimable:
+            # no more work for this task
+            task_seconds += t - task_start
+            if not tasks and released:
+                # like --supervise, start a new task once a killed interval becomes claimable again
+                heapq.heappush(tasks, (released[0][0], num_tasks, released[0][0]))
+                num_tasks += 1
+            continue
+
+        if t - task_start > exit_after_seconds:
+            task_seconds += t - task_start
+            heapq.heappush(tasks, (t + resubmit_delay_seconds, num_tasks, t + resubmit_delay_seconds))
+            num_tasks += 1
+            continue
+
+        # claim
+        while recent_claims and recent_claims[0] <= t - claim_seconds:
+            recent_claims.popleft()
+
+        r = rng.randrange(min(claim_window, len(claimable) + len(recent_claims)))
+        if r < len(recent_claims):
+            num_collisions += 1
+            collision += claim_seconds
+            heapq.heappush(tasks, (t + claim_seconds, task_i, task_start))
+            continue
+
+        r -= len(recent_claims)
+        recent_claims.append(t)
+        interval_i = claimable[r]
+        claimable[r] = claimable[-1]
+        claimable.pop()
+
+        interval_started = t + claim_seconds
+        interval_finished = interval_started + runtimes[interval_i]
+        task_killed_time = task_start + time_limit_seconds
+        if interval_finished > task_killed_time:
+            num_killed += 1
+            killed += task_killed_time - interval_started
+            task_seconds += task_killed_time - task_start
+            heapq.heappush(released, (task_killed_time + lease_seconds, interval_i))
+            heapq.heappush(tasks, (task_killed_time + resubmit_delay_seconds, num_tasks, task_killed_time + resubmit_delay_seconds))
+            num_tasks += 1
+            continue
+
+        useful += runtimes[interval_i]
+        makespan = max(makespan, interval_finished)
+        heapq.heappush(tasks, (interval_finished, task_i, task_start))
+
+    return SimulationResult(makespan, task_seconds, useful, killed, collision, num_tasks, num_killed,
+                            num_collisions, num_unfinished)
@@ -0,0 +1,48 @@
+"""
+Utility methods for recording how long each stage of processing a sample takes, so that it's clear which stages are
+worth optimizing. Each stage's wall time is added to a <stage>_seconds field of the record (eg. Sample.hc_seconds),
+and is saved along with the record's other fields. See scripts/print_progress_report.py for aggregate reports.
+"""
+
+import contextlib
+import time
+
+# the stages of processing a sample, in order
+STAGES = ("claim", "interval_lookup", "hc", "gvcf_check", "postprocess", "db_save")
+
+STAGE_TIMING_FIELDS = tuple("%s_seconds" % stage for stage in STAGES)
+
+
+@contextlib.contextmanager
+def timed_stage(record, stage):
+    """Adds the wall time spent in the with-block to the given record's <stage>_seconds field.
+
+    Example:
+        with timed_stage(sr, "postprocess"):
+            postprocess_bam(..)
+    """
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        add_stage_seconds(record, stage, time.time() - start_time)
+
+
+def add_stage_seconds(record, stage, seconds):
+    """Adds seconds to the given record's <stage>_seconds field"""
+    field_name = "%s_seconds" % stage
+    setattr(record, field_name, (getattr(record, field_name) or 0) + seconds)
+
+
+def reset_stage_timings(record, keep=("claim",)):
+    """Clears the record's timing fields, except for the stages in keep, so that timings from a previous attempt
+    aren't added to"""
+    for stage in STAGES:
+        if stage not in keep:
+            setattr(record, "%s_seconds" % stage, None)
+
+
+def format_stage_timings(record):
+    """Returns a string like 'claim=0.1s hc=12.3s ...' with the record's timing fields that are set"""
+    return " ".join("%s=%0.1fs" % (stage, getattr(record, "%s_seconds" % stage))
+                    for stage in STAGES if getattr(record, "%s_seconds" % stage) is not None)